@@ -1,4 +1,10 @@
 from alignment.stochastic import *
 from alignment.pmc import *
 from alignment.pairing import *
-from alignment.affine import *
\ No newline at end of file
+from alignment.affine import *
+from alignment.voting import *
+from alignment.refinement import *
+from alignment.fft import *
+from alignment.plate import *
+from alignment.tracking import *
+from alignment.batch import *
\ No newline at end of file
@@ -1,31 +1,136 @@
 import numpy as np
 
+from alignment.pairing import make_pairing
+from profiling import get_profiler
+
 
 """
 Calculates the optimal affine transformation with least squares.
 :param source_points: numpy array containing points which will be translated.
 :param target_points: numpy array containing the points where the source points will be translated to.
 :param pairing: the pairs to minimize distance between.
+:param weights: optional weight of each pair.
 """
-def get_affine_transformation(source_points: np.ndarray, target_points: np.ndarray, pairing: list):
-    n = len(pairing)
+def get_affine_transformation(source_points: np.ndarray, target_points: np.ndarray, pairing: list, weights: np.ndarray = None):
+    pairs = __to_index_pairs(pairing)
 
     # Constructing homogeneous source point and target points from pairing.
-    P_hom, Q = np.zeros((n, 3)), np.zeros((n, 2))
-    for i in range(n):
-        P_hom[i] = np.append(source_points[pairing[i][0]], 1)
-        Q[i] = target_points[pairing[i][1]]
-    
-    # Constructing and solving the linear equation system.
-    A, b = np.zeros((2 * n, 6)), np.zeros(2 * n)
-    for i in range(n):
-        A[2 * i, :3] = P_hom[i]
-        b[2 * i] = Q[i, 0]
-        A[2 * i + 1, 3:] = P_hom[i]
-        b[2 * i + 1] = Q[i, 1]
-    params, _, _, _ = np.linalg.lstsq(A, b, rcond=None)
-
-    # Converting params to matrix and transpone to work with row vector.
-    affine = np.append(params, [0, 0, 1]).reshape(3, 3)
-    return affine.T
+    P_hom = np.column_stack((source_points[pairs[:, 0]], np.ones(len(pairs))))
+    Q = target_points[pairs[:, 1]].astype(np.float64)
+
+    # The x and y coordinates share the design matrix, so both are solved with a single least squares.
+    if weights is not None:
+        sqrt_weights = np.sqrt(weights)[:, np.newaxis]
+        P_hom, Q = P_hom * sqrt_weights, Q * sqrt_weights
+    params, _, _, _ = np.linalg.lstsq(P_hom, Q, rcond=None)
+
+    # Converting params to a matrix working with row vectors.
+    return np.column_stack((params, [0, 0, 1]))
+
+
+"""
+Refines a translation to an affine transformation by iterating pairing and fitting. The pairs are weighted by
+Tukey's biweight of their residuals, which rejects the pairs much further than the typical pair. The iteration
+stops when the transformation moves the points less than the tolerance. Optionally the initial pairs are filtered
+with RANSAC, fitting affine transformations to random triplets of them.
+
+:param source_points: numpy array containing points which will be transformed. (-1, 2) shaped.
+:param target_points: numpy array containing the points where the source points will be transformed to. (-1, 2) shaped.
+:param translation: the initial translation, or an initial (3, 3) affine transformation working with row vectors.
+:param threshold: pairing maximal difference threshold.
+:param max_iterations: maximal number of pairing and fitting steps.
+:param tolerance: the iteration stops when the points move less than this.
+:param ransac_iterations: number of random triplets tried on the initial pairs, 0 turns RANSAC off.
+:param profiler: profiling.Profiler recording the stage and the number of iterations.
+:return: the (3, 3) affine transformation working with row vectors and its inlier pairs as (source index, target index, distance) tuples.
+"""
+def refine_affine(source_points: np.ndarray, target_points: np.ndarray, translation: np.ndarray, threshold: float = 10, max_iterations: int = 50,
+                  tolerance: float = 1e-2, ransac_iterations: int = 100, profiler=None):
+    profiler = get_profiler(profiler)
+
+    affine = np.asarray(translation, dtype=np.float64)
+    if affine.shape != (3, 3):
+        affine = np.eye(3)
+        affine[2, :2] = translation
+
+    # Corners of the source points, the change of the transformation is measured by their movement.
+    low, high = np.min(source_points, axis=0), np.max(source_points, axis=0)
+    corners = np.array([[low[0], low[1], 1], [low[0], high[1], 1], [high[0], low[1], 1], [high[0], high[1], 1]])
+
+    inliers = []
+    with profiler.stage("affine"):
+        for iteration in range(max_iterations):
+            profiler.count("affine.iterations")
+
+            pairs = __pair_transformed(source_points, target_points, affine, threshold)
+            if len(pairs) < 3:
+                break
+
+            if iteration == 0 and ransac_iterations > 0:
+                pairs = __filter_pairs_ransac(source_points, target_points, pairs, threshold, ransac_iterations)
+
+            weights = __get_biweights(pairs[:, 2], tolerance)
+            inliers = pairs[weights > 0]
+            if len(inliers) < 3:
+                break
+
+            new_affine = get_affine_transformation(source_points, target_points, inliers, weights[weights > 0])
+            shift = np.max(np.linalg.norm(corners @ (new_affine - affine), axis=1))
+            affine = new_affine
+            if shift < tolerance:
+                break
+
+    # The inliers of the final transformation.
+    pairs = __pair_transformed(source_points, target_points, affine, threshold)
+    if len(pairs) > 0:
+        pairs = pairs[__get_biweights(pairs[:, 2], tolerance) > 0]
+
+    return affine, [(int(i), int(j), d) for i, j, d in pairs.tolist()]
+
+
+# Converts a pairing of (source index, target index, ...) items to an index array.
+def __to_index_pairs(pairing):
+    pairs = np.asarray(pairing)
+    if pairs.size == 0:
+        return np.zeros((0, 2), dtype=np.intp)
+    return pairs.reshape(len(pairs), -1)[:, :2].astype(np.intp)
+
+
+# Pairs the transformed source points with the target points, returned as (source index, target index, distance) rows.
+def __pair_transformed(source_points: np.ndarray, target_points: np.ndarray, affine: np.ndarray, threshold: float):
+    transformed_points = source_points @ affine[:2, :2] + affine[2, :2]
+    pairs = make_pairing(transformed_points, target_points, np.zeros(2), threshold)
+    return np.array(pairs, dtype=np.float64).reshape(-1, 3)
+
+
+# Gets Tukey's biweight of the residuals, the residuals above 4.685 robust standard deviations get 0 weight.
+def __get_biweights(residuals: np.ndarray, tolerance: float):
+    scale = 4.685 * max(1.4826 * np.median(residuals), tolerance)
+    return np.clip(1 - (residuals / scale) ** 2, 0, None) ** 2
+
+
+# Keeps the pairs agreeing with the affine transformation of the random pair triplet having the most inliers.
+def __filter_pairs_ransac(source_points: np.ndarray, target_points: np.ndarray, pairs: np.ndarray, threshold: float, n_iterations: int):
+    index_pairs = pairs[:, :2].astype(np.intp)
+    P_hom = np.column_stack((source_points[index_pairs[:, 0]], np.ones(len(pairs))))
+    Q = target_points[index_pairs[:, 1]]
+
+    # Fitting the affine transformations of all the triplets at once, skipping the degenerate ones.
+    samples = np.array([np.random.choice(len(pairs), 3, replace=False) for _ in range(n_iterations)])
+    systems = P_hom[samples]
+    valid = np.abs(np.linalg.det(systems)) > 1e-6
+    if not np.any(valid):
+        return pairs
+    params = np.linalg.solve(systems[valid], Q[samples[valid]])
+
+    # Counting the pairs close to their transformed source point.
+    residuals = np.linalg.norm(np.einsum("nk,skd->snd", P_hom, params) - Q, axis=2)
+    inlier_counts = np.sum(residuals < threshold / 2, axis=1)
+    best = np.argmax(inlier_counts)
+
+    # Keeping the initial pairs if even the best triplet has too few inliers.
+    inliers = residuals[best] < threshold / 2
+    if np.sum(inliers) < 3:
+        return pairs
 
+    return pairs[inliers]
@@ -0,0 +1,343 @@
+import numpy as np
+
+from profiling import get_profiler
+
+
+"""
+Concatenates the point sets of the wells to ragged arrays, which are the input of the batch functions.
+:param point_sets: list of (-1, 2) shaped numpy arrays.
+:return: the (-1, 2) shaped concatenated points and the offsets of the wells in them, the points of the ith
+well are points[offsets[i]:offsets[i + 1]].
+"""
+def concatenate_point_sets(point_sets: list):
+  offsets = np.zeros(len(point_sets) + 1, dtype=np.int64)
+  np.cumsum([len(points) for points in point_sets], out=offsets[1:])
+  points = np.concatenate([np.asarray(points, dtype=np.float64).reshape(-1, 2) for points in point_sets] + [np.zeros((0, 2))])
+  return points, offsets
+
+
+"""
+Finds the translations of a batch of wells, given as ragged arrays, with a single call. The voting method runs on all the
+wells at once, the other methods are called for each well. The translations are refined together with refine_translation_batch.
+The translations are the same as of the single well methods up to floating point errors.
+
+:param source_points: (-1, 2) shaped concatenated points of the wells which will be translated.
+:param source_offsets: offsets of the wells in source_points, see concatenate_point_sets.
+:param target_points: (-1, 2) shaped concatenated points of the wells where the source points will be translated to.
+:param target_offsets: offsets of the wells in target_points.
+:param mode: the method, its main parameter and optionally a dict of its further parameters, e.g. ("voting", 20, {"n_levels": 3}).
+:param refine: parameters of refine_translation_batch, None skips the refinement.
+:param profiler: profiling.Profiler recording the stages.
+:return: (n_wells, 2) shaped translations of the wells.
+"""
+def find_translation_batch(source_points: np.ndarray, source_offsets: np.ndarray, target_points: np.ndarray, target_offsets: np.ndarray, mode: tuple,
+                           refine: dict = None, profiler=None):
+  from alignment import find_translation_stochastic, find_translation_pmc, find_translation_fft
+
+  profiler = get_profiler(profiler)
+  options = dict(mode[2]) if len(mode) > 2 else {}
+  n_wells = len(source_offsets) - 1
+
+  if mode[0] == "voting":
+    translations, _ = find_translation_voting_batch(source_points, source_offsets, target_points, target_offsets, mode[1], **options, profiler=profiler)
+  elif mode[0] in ("stochastic", "pmc", "fft"):
+    method = {"stochastic": find_translation_stochastic, "pmc": find_translation_pmc, "fft": find_translation_fft}[mode[0]]
+    translations = np.zeros((n_wells, 2))
+    for i in range(n_wells):
+      well_source_points = source_points[source_offsets[i]:source_offsets[i + 1]]
+      well_target_points = target_points[target_offsets[i]:target_offsets[i + 1]]
+      if len(well_source_points) > 0 and len(well_target_points) > 0:
+        translations[i] = method(well_source_points, well_target_points, mode[1], **options, profiler=profiler)[0]
+  else:
+    raise ValueError(f"Unknown alignment mode: {mode[0]}")
+
+  if refine is not None:
+    translations, _ = refine_translation_batch(source_points, source_offsets, target_points, target_offsets, translations, **refine, profiler=profiler)
+
+  return translations
+
+
+"""
+The voting method of find_translation_voting on a batch of wells. The votes of all the wells are generated together
+in blocks, and the histograms of the wells are stacked into one array, so every level is a few numpy operations for the
+whole batch instead of for each well.
+
+:param source_points: (-1, 2) shaped concatenated points of the wells which will be translated.
+:param source_offsets: offsets of the wells in source_points, see concatenate_point_sets.
+:param target_points: (-1, 2) shaped concatenated points of the wells where the source points will be translated to.
+:param target_offsets: offsets of the wells in target_points.
+:param bin_size: size of the histogram bins on the coarsest level.
+:param n_levels: number of histogram levels, the bin size is halved on each of them.
+:param block_size: maximal number of votes generated at once.
+:param profiler: profiling.Profiler recording the stage and the number of counted votes.
+:return: (n_wells, 2) shaped averages of the votes around the peaks and the numbers of these votes.
+The wells without source or target points get zero translation and zero votes.
+"""
+def find_translation_voting_batch(source_points: np.ndarray, source_offsets: np.ndarray, target_points: np.ndarray, target_offsets: np.ndarray, bin_size: float,
+                                  n_levels: int = 3, block_size: int = 2**20, profiler=None):
+  profiler = get_profiler(profiler)
+  n_wells = len(source_offsets) - 1
+  source_sizes, target_sizes = np.diff(source_offsets), np.diff(target_offsets)
+  valid = (source_sizes > 0) & (target_sizes > 0)
+  if n_wells == 0:
+    return np.zeros((0, 2)), np.zeros(0, dtype=np.int64)
+
+  # The votes are generated once if they fit in a single block, otherwise on every level again.
+  blocks = __plan_vote_blocks(source_sizes * valid, target_sizes, block_size)
+  cached_votes = [__generate_votes(source_points, source_offsets, target_points, target_offsets, blocks[0])] if len(blocks) == 1 else None
+
+  # Without bounds, all the votes are kept, which are within the bounds of the first level.
+  def iterate_votes(low: np.ndarray = None, high: np.ndarray = None):
+    for i in range(len(blocks)):
+      wells, votes = cached_votes[i] if cached_votes is not None else __generate_votes(source_points, source_offsets, target_points, target_offsets, blocks[i])
+      if low is None:
+        yield wells, votes
+        continue
+
+      kept = np.all((votes >= low[wells]) & (votes <= high[wells]), axis=1)
+      yield wells[kept], votes[kept]
+
+  # The windows of the later levels are within twice the width of the current window around it,
+  # so the cached votes outside of it are dropped.
+  def shrink_cached_votes(low: np.ndarray, high: np.ndarray):
+    nonlocal cached_votes
+    if cached_votes is not None:
+      margin = 2 * (high - low)
+      cached_votes = list(iterate_votes(low - margin, high + margin))
+
+  with profiler.stage("batch.voting", n_wells=n_wells):
+    # Bounds of all the possible votes of every well.
+    low = __reduce_wells(np.minimum, target_points, target_offsets) - __reduce_wells(np.maximum, source_points, source_offsets)
+    high = __reduce_wells(np.maximum, target_points, target_offsets) - __reduce_wells(np.minimum, source_points, source_offsets)
+    low[~valid], high[~valid] = 0, 0
+
+    for level in range(n_levels):
+      shapes = np.floor((high - low) / bin_size).astype(np.intp) + 1
+      height, width = np.max(shapes, axis=0) if n_wells > 0 else (1, 1)
+
+      # Accumulating the votes of every well in its own histogram, padded to the largest one.
+      counts = np.zeros(n_wells * height * width, dtype=np.int64)
+      for wells, votes in iterate_votes(low, high) if level > 0 else iterate_votes():
+        bins = np.minimum(((votes - low[wells]) / bin_size).astype(np.intp), shapes[wells] - 1)
+        counts += np.bincount((wells * height + bins[:, 0]) * width + bins[:, 1], minlength=len(counts))
+        profiler.count("voting.votes", len(votes))
+
+      # Summing the neighbouring bins, so a peak split by a bin edge is found too.
+      summed = __sum_neighbours(counts.reshape(n_wells, height, width)).reshape(n_wells, -1)
+      peaks = np.column_stack(np.unravel_index(np.argmax(summed, axis=1), (height, width)))
+
+      # The next level only covers the neighbourhood of the peaks.
+      centers = low + (peaks + 0.5) * bin_size
+      low, high = centers - 1.5 * bin_size, centers + 1.5 * bin_size
+      bin_size /= 2
+      shrink_cached_votes(low, high)
+
+    # Averaging the votes around the peaks.
+    vote_sums, vote_counts = np.zeros((n_wells, 2)), np.zeros(n_wells, dtype=np.int64)
+    for wells, votes in iterate_votes(low, high):
+      vote_sums[:, 0] += np.bincount(wells, weights=votes[:, 0], minlength=n_wells)
+      vote_sums[:, 1] += np.bincount(wells, weights=votes[:, 1], minlength=n_wells)
+      vote_counts += np.bincount(wells, minlength=n_wells)
+
+  translations = vote_sums / np.maximum(vote_counts, 1)[:, np.newaxis]
+  translations[~valid] = 0
+  return translations, vote_counts
+
+
+"""
+The refinement of refine_translation on a batch of wells. The wells are placed side by side along the x axis, far enough
+from each other, so a single kd-tree serves all of them, and the pattern search and the averaging steps of all the wells
+are evaluated together. Every well keeps its own step size and stops on its own, like the single well refinement.
+
+:param source_points: (-1, 2) shaped concatenated points of the wells which will be translated.
+:param source_offsets: offsets of the wells in source_points, see concatenate_point_sets.
+:param target_points: (-1, 2) shaped concatenated points of the wells where the source points will be translated to.
+:param target_offsets: offsets of the wells in target_points.
+:param translations: (n_wells, 2) shaped initial translations.
+:param radius: radius of the search around the initial translations.
+:param max_distance: points further than this from their nearest neighbour are unpaired. Defaults to radius.
+:param tolerance: precision of the refined translations.
+:param max_iterations: maximal number of averaging steps.
+:param profiler: profiling.Profiler recording the stage, the number of evaluations and averaging steps.
+:return: the (n_wells, 2) shaped refined translations and their average errors.
+"""
+def refine_translation_batch(source_points: np.ndarray, source_offsets: np.ndarray, target_points: np.ndarray, target_offsets: np.ndarray, translations: np.ndarray,
+                             radius: float = 10, max_distance: float = None, tolerance: float = 1e-2, max_iterations: int = 100, profiler=None):
+  profiler = get_profiler(profiler)
+  if max_distance is None:
+    max_distance = radius
+
+  with profiler.stage("batch.refinement", n_wells=len(source_offsets) - 1):
+    return __refine_translations(source_points, source_offsets, target_points, target_offsets, np.asarray(translations, dtype=np.float64),
+                                 radius, max_distance, tolerance, max_iterations, profiler)
+
+
+# Refines the translations of the wells with pattern search, then with averaging the differences of the paired points.
+def __refine_translations(source_points: np.ndarray, source_offsets: np.ndarray, target_points: np.ndarray, target_offsets: np.ndarray, translations: np.ndarray,
+                          radius: float, max_distance: float, tolerance: float, max_iterations: int, profiler):
+  from scipy.spatial import cKDTree
+
+  n_wells = len(source_offsets) - 1
+  target_sizes = np.diff(target_offsets)
+  source_wells = np.repeat(np.arange(n_wells), np.diff(source_offsets))
+  target_wells = np.repeat(np.arange(n_wells), target_sizes)
+
+  # The gap between the wells is larger than any translated point can get from its well, the pairs across
+  # wells are still rejected if a translation drifts further.
+  extent = np.max(np.abs(source_points), initial=0) + np.max(np.abs(target_points), initial=0) + np.max(np.abs(translations), initial=0)
+  gap = 2 * (extent + radius + max_distance) + 1
+  source_tree = cKDTree(source_points + np.column_stack((source_wells * gap, np.zeros(len(source_wells)))))
+  shifted_target_points = target_points + np.column_stack((target_wells * gap, np.zeros(len(target_wells))))
+
+  # Pairs the target points of the wells with their nearest translated source point of the same well.
+  # The items are the (well, translation) evaluations, the queries are returned along with their items.
+  def query(item_wells: np.ndarray, item_translations: np.ndarray):
+    items, indices = __expand_wells(item_wells, target_offsets)
+    distances, neighbours = source_tree.query(shifted_target_points[indices] - item_translations[items], distance_upper_bound=max_distance)
+    paired = neighbours < len(source_wells)
+    paired[paired] = source_wells[neighbours[paired]] == item_wells[items[paired]]
+    distances[~paired] = np.inf
+    return items, indices, distances, neighbours
+
+  # Evaluating the translations by the capped distances of the nearest neighbours.
+  def evaluate_translations(item_wells: np.ndarray, item_translations: np.ndarray):
+    profiler.count("refinement.evaluations", len(item_wells))
+    items, _, distances, _ = query(item_wells, item_translations)
+    errors = np.bincount(items, weights=np.minimum(distances, max_distance) ** 2, minlength=len(item_wells))
+    return errors / np.maximum(target_sizes[item_wells], 1)
+
+  all_wells = np.arange(n_wells)
+  initial_translations = translations
+  best_translations, best_errors = initial_translations.copy(), evaluate_translations(all_wells, initial_translations)
+
+  # Pattern search in the radius, halving the step of a well when none of its neighbours are better.
+  directions = np.array([[-1, -1], [-1, 0], [-1, 1], [0, -1], [0, 1], [1, -1], [1, 0], [1, 1]])
+  steps = np.full(n_wells, radius / 2)
+  while True:
+    active = np.flatnonzero(steps >= tolerance)
+    if len(active) == 0:
+      break
+
+    candidates = best_translations[active, np.newaxis] + steps[active, np.newaxis, np.newaxis] * directions
+    in_radius = np.all(np.abs(candidates - initial_translations[active, np.newaxis]) <= radius, axis=2)
+    rows, columns = np.nonzero(in_radius)
+
+    errors = np.full(in_radius.shape, np.inf)
+    errors[rows, columns] = evaluate_translations(active[rows], candidates[rows, columns])
+    best_directions = np.argmin(errors, axis=1)
+    min_errors = errors[np.arange(len(active)), best_directions]
+
+    improved = min_errors < best_errors[active]
+    best_translations[active[improved]] = candidates[improved, best_directions[improved]]
+    best_errors[active[improved]] = min_errors[improved]
+    steps[active[~improved]] /= 2
+
+  # Shifting the translations by the average difference of the paired points, ignoring the pairs
+  # which are much further than the typical pair of the well.
+  active = all_wells
+  for _ in range(max_iterations):
+    if len(active) == 0:
+      break
+    profiler.count("refinement.iterations", len(active))
+
+    items, indices, distances, neighbours = query(active, best_translations[active])
+    paired = distances < max_distance
+    has_pairs = np.bincount(items[paired], minlength=len(active)) > 0
+
+    limits = np.maximum(3 * __get_median(items[paired], distances[paired], len(active)), tolerance)
+    paired &= distances <= limits[items]
+    items, indices, neighbours = items[paired], indices[paired], neighbours[paired]
+
+    differences = target_points[indices] - source_points[neighbours]
+    counts = np.maximum(np.bincount(items, minlength=len(active)), 1)
+    shifts = np.column_stack([np.bincount(items, weights=differences[:, axis], minlength=len(active)) / counts for axis in range(2)])
+    shifts -= best_translations[active]
+    shifts[~has_pairs] = 0
+
+    best_translations[active] += shifts
+    active = active[has_pairs & (np.linalg.norm(shifts, axis=1) >= tolerance / 10)]
+
+  return best_translations, evaluate_translations(all_wells, best_translations)
+
+
+# Reduces the points of every well with the ufunc, the wells without points get nan.
+def __reduce_wells(ufunc, points: np.ndarray, offsets: np.ndarray):
+  sizes = np.diff(offsets)
+  result = np.full((len(sizes), 2), np.nan)
+  if np.any(sizes > 0):
+    result[sizes > 0] = ufunc.reduceat(points, offsets[:-1][sizes > 0], axis=0)
+  return result
+
+
+# Gets the indices of the points of the wells of the items in the ragged arrays, along with the item of every index.
+def __expand_wells(item_wells: np.ndarray, offsets: np.ndarray):
+  sizes = offsets[item_wells + 1] - offsets[item_wells]
+  items = np.repeat(np.arange(len(item_wells)), sizes)
+  starts = np.cumsum(sizes) - sizes
+  indices = np.arange(len(items)) - starts[items] + offsets[item_wells][items]
+  return items, indices
+
+
+# Gets the median of the values of every group, the groups without values get nan.
+def __get_median(groups: np.ndarray, values: np.ndarray, n_groups: int):
+  order = np.lexsort((values, groups))
+  sorted_values = values[order]
+  counts = np.bincount(groups, minlength=n_groups)
+  starts = np.cumsum(counts) - counts
+
+  medians = np.full(n_groups, np.nan)
+  has_values = counts > 0
+  lower = starts[has_values] + (counts[has_values] - 1) // 2
+  upper = starts[has_values] + counts[has_values] // 2
+  medians[has_values] = (sorted_values[lower] + sorted_values[upper]) / 2
+  return medians
+
+
+# Splits the votes of the wells into blocks of at most block_size votes. A block is a list of (well, first source
+# row, last source row) chunks, a well with more votes is split by its source rows.
+def __plan_vote_blocks(source_sizes: np.ndarray, target_sizes: np.ndarray, block_size: int):
+  blocks, block, n_votes = [], [], 0
+  for well, (n_sources, n_targets) in enumerate(zip(source_sizes.tolist(), target_sizes.tolist())):
+    if n_sources == 0 or n_targets == 0:
+      continue
+
+    n_rows = max(1, block_size // n_targets)
+    for start in range(0, n_sources, n_rows):
+      stop = min(start + n_rows, n_sources)
+      if n_votes + (stop - start) * n_targets > block_size and len(block) > 0:
+        blocks.append(block)
+        block, n_votes = [], 0
+      block.append((well, start, stop))
+      n_votes += (stop - start) * n_targets
+
+  if len(block) > 0:
+    blocks.append(block)
+  return blocks
+
+
+# Generates the correspondence vectors of the chunks of a block, returning the well of every vector too.
+def __generate_votes(source_points: np.ndarray, source_offsets: np.ndarray, target_points: np.ndarray, target_offsets: np.ndarray, block: list):
+  wells, starts, stops = np.array(block, dtype=np.int64).T
+  n_targets = target_offsets[wells + 1] - target_offsets[wells]
+  sizes = (stops - starts) * n_targets
+
+  # Every vote is the difference of a target and a source point of the same chunk.
+  chunks = np.repeat(np.arange(len(block)), sizes)
+  positions = np.arange(len(chunks)) - (np.cumsum(sizes) - sizes)[chunks]
+  source_indices = source_offsets[wells][chunks] + starts[chunks] + positions // n_targets[chunks]
+  target_indices = target_offsets[wells][chunks] + positions % n_targets[chunks]
+
+  return wells[chunks], target_points[target_indices] - source_points[source_indices]
+
+
+# Sums the 3x3 neighbourhood of every bin of the stacked histograms.
+def __sum_neighbours(counts: np.ndarray):
+  padded = np.pad(counts, ((0, 0), (1, 1), (1, 1)))
+  height, width = counts.shape[1:]
+
+  result = np.zeros_like(counts)
+  for dy in range(3):
+    for dx in range(3):
+      result += padded[:, dy:dy + height, dx:dx + width]
+
+  return result
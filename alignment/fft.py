@@ -0,0 +1,138 @@
+import numpy as np
+
+from alignment.memory import check_memory
+from profiling import get_profiler
+
+
+"""
+The source and target points are rendered as Gaussian blurred density images and the translation is found
+at the peak of their cross-correlation, computed with FFT. The running time depends on the size of the images,
+not on the number of point pairs. On an image pyramid, the coarsest level searches all the translations and
+the finer levels only search around the peak of the previous level, on images cropped to the overlapping region.
+
+:param source_points: numpy array containing points which will be translated. (-1, 2) shaped.
+:param target_points: numpy array containing the points where the source points will be translated to. (-1, 2) shaped.
+:param pixel_size: size of the pixels on the finest level.
+:param sigma: standard deviation of the Gaussian blur of the points. Defaults to pixel_size.
+:param n_levels: number of pyramid levels, the pixel size is doubled on each coarser level.
+:param search_center: center of the searched translations. Defaults to searching all the translations.
+:param search_radius: maximal distance of the searched translations from search_center along each axis.
+:param memory_limit: memory limit in bytes, a MemoryError is raised if the images of a level don't fit in it, instead of
+running out of memory. Increasing the pixel size decreases the memory quadratically. Defaults to no limit.
+:param profiler: profiling.Profiler recording the stage.
+:return: the translation and the quality of the peak, which is the ratio of the peak to the highest correlation
+outside of its neighbourhood on the first level. Values close to 1 mean ambiguous translations.
+"""
+def find_translation_fft(source_points: np.ndarray, target_points: np.ndarray, pixel_size: float = 2, sigma: float = None, n_levels: int = 3,
+                         search_center: np.ndarray = None, search_radius: float = None, memory_limit: int = None, profiler=None):
+  profiler = get_profiler(profiler)
+  if sigma is None:
+    sigma = pixel_size
+
+  # Without a window, the center of all the possible translations is searched in a radius covering them.
+  if search_center is None:
+    low = np.min(target_points, axis=0) - np.max(source_points, axis=0)
+    high = np.max(target_points, axis=0) - np.min(source_points, axis=0)
+    search_center, search_radius = (low + high) / 2, np.max(high - low) / 2
+
+  translation, quality = np.asarray(search_center, dtype=np.float64), None
+  with profiler.stage("fft.correlation", n_levels=n_levels):
+    for level in reversed(range(n_levels)):
+      level_pixel_size = pixel_size * 2**level
+      level_sigma = max(sigma, level_pixel_size)
+
+      translation, level_quality = __find_peak(source_points, target_points, translation, search_radius, level_pixel_size, level_sigma, memory_limit)
+      quality = level_quality if quality is None else quality
+
+      # The next level searches the neighbourhood of the peak, which is within a few pixels.
+      search_radius = min(search_radius, 2 * level_pixel_size + level_sigma)
+
+  return translation, quality
+
+
+# Finds the peak of the cross-correlation of the densities in the window around the center.
+def __find_peak(source_points: np.ndarray, target_points: np.ndarray, center: np.ndarray, radius: float, pixel_size: float, sigma: float, memory_limit: int = None):
+  from scipy import fft
+
+  shifted_points = source_points + center
+
+  # Only the points in the overlap of the two point sets, extended by the radius, can be paired.
+  low = np.maximum(np.min(target_points, axis=0), np.min(shifted_points, axis=0)) - radius
+  high = np.minimum(np.max(target_points, axis=0), np.max(shifted_points, axis=0)) + radius
+  if np.any(low >= high):
+    return center, 1.0
+
+  # Padding the images by the maximal lag, so the circular correlation doesn't wrap around in the window.
+  max_lag = int(np.ceil(radius / pixel_size))
+  shape = tuple(fft.next_fast_len(int(np.ceil(size / pixel_size)) + 2 + max_lag, real=True) for size in high - low)
+
+  # The images, their spectra, the blur and the correlation take about 64 bytes per pixel.
+  if memory_limit is not None:
+    check_memory(64 * shape[0] * shape[1], memory_limit, "Correlation images")
+
+  source_image = __render_points(shifted_points, low, high, pixel_size, shape)
+  target_image = __render_points(target_points, low, high, pixel_size, shape)
+
+  # Correlating in the frequency domain, where both Gaussian blurs are a single multiplication.
+  frequencies = np.meshgrid(fft.fftfreq(shape[0]), fft.rfftfreq(shape[1]), indexing="ij")
+  blur = np.exp(-4 * np.pi**2 * (sigma / pixel_size)**2 * (frequencies[0]**2 + frequencies[1]**2))
+  correlation = fft.irfft2(fft.rfft2(target_image) * np.conj(fft.rfft2(source_image)) * blur, s=shape)
+
+  # Cutting out the lags of the window, the negative lags are at the end of the circular correlation.
+  lags = np.arange(-max_lag, max_lag + 1)
+  window = correlation[np.ix_(lags % shape[0], lags % shape[1])]
+
+  peak = np.array(np.unravel_index(np.argmax(window), window.shape))
+  offset = __fit_parabola(window, peak)
+  translation = center + (lags[peak] + offset) * pixel_size
+
+  return translation, __get_peak_quality(window, peak, sigma / pixel_size)
+
+
+# Renders the points between low and high to an image, splitting every point between its four nearest pixels.
+def __render_points(points: np.ndarray, low: np.ndarray, high: np.ndarray, pixel_size: float, shape: tuple):
+  points = points[np.all((points >= low) & (points <= high), axis=1)]
+  coords = (points - low) / pixel_size
+
+  base = np.floor(coords).astype(np.intp)
+  fraction = coords - base
+
+  image = np.zeros(shape[0] * shape[1])
+  for dy in (0, 1):
+    for dx in (0, 1):
+      weights = np.abs(1 - dy - fraction[:, 0]) * np.abs(1 - dx - fraction[:, 1])
+      image += np.bincount((base[:, 0] + dy) * shape[1] + base[:, 1] + dx, weights=weights, minlength=len(image))
+
+  return image.reshape(shape)
+
+
+# Fits a parabola to the peak and its neighbours along each axis, giving the sub-pixel offset of the peak.
+def __fit_parabola(image: np.ndarray, peak: np.ndarray):
+  offset = np.zeros(2)
+  for axis in range(2):
+    if peak[axis] == 0 or peak[axis] == image.shape[axis] - 1:
+      continue
+
+    before, after = peak.copy(), peak.copy()
+    before[axis] -= 1
+    after[axis] += 1
+    left, center, right = image[tuple(before)], image[tuple(peak)], image[tuple(after)]
+
+    denominator = left - 2 * center + right
+    if denominator < 0:
+      offset[axis] = 0.5 * (left - right) / denominator
+
+  return offset
+
+
+# Gets the ratio of the peak to the highest value outside of the neighbourhood of the peak.
+def __get_peak_quality(image: np.ndarray, peak: np.ndarray, sigma: float):
+  radius = max(3 * sigma, 2)
+  y, x = np.ogrid[:image.shape[0], :image.shape[1]]
+  outside = (y - peak[0])**2 + (x - peak[1])**2 > radius**2
+
+  peak_value = image[tuple(peak)]
+  if not np.any(outside) or peak_value <= 0:
+    return 1.0
+
+  return float(peak_value / max(np.max(image[outside]), peak_value * 1e-6))
@@ -0,0 +1,42 @@
+import numpy as np
+
+
+"""
+Gets the dtype of the coordinates, the memory limited mode uses float32 to halve the memory usage.
+:param memory_limit: memory limit in bytes, None means no limit.
+"""
+def get_coordinate_dtype(memory_limit: int = None):
+  return np.float64 if memory_limit is None else np.float32
+
+
+"""
+Raises a MemoryError if the required memory exceeds the memory limit, instead of being killed for running out of memory.
+:param required_bytes: the memory needed.
+:param memory_limit: memory limit in bytes, None means no limit.
+:param purpose: what the memory is needed for, shown in the error message.
+"""
+def check_memory(required_bytes: float, memory_limit: int, purpose: str):
+  if memory_limit is not None and required_bytes > memory_limit:
+    raise MemoryError(f"{purpose} needs {required_bytes / 2**20:.1f} MiB, which exceeds the memory limit of {memory_limit / 2**20:.1f} MiB.")
+
+
+"""
+Iterates the correspondence vectors between the source and target points in blocks of source rows,
+in the same order as (target_points - source_points[:, np.newaxis]).reshape(-1, 2).
+:param source_points: numpy array containing points which will be translated. (-1, 2) shaped.
+:param target_points: numpy array containing the points where the source points will be translated to. (-1, 2) shaped.
+:param block_memory: maximal memory of a block in bytes.
+:param dtype: dtype of the vectors.
+:param search_center: if given, only the vectors in the window around it are kept.
+:param search_radius: maximal distance of the kept vectors from search_center along each axis.
+"""
+def iterate_correspondence_vectors(source_points: np.ndarray, target_points: np.ndarray, block_memory: int, dtype=np.float64,
+                                   search_center: np.ndarray = None, search_radius: float = None):
+  source_points, target_points = source_points.astype(dtype, copy=False), target_points.astype(dtype, copy=False)
+  n_rows = max(1, int(block_memory // max(2 * len(target_points) * np.dtype(dtype).itemsize, 1)))
+
+  for start in range(0, len(source_points), n_rows):
+    vectors = (target_points - source_points[start:start + n_rows, np.newaxis]).reshape(-1, 2)
+    if search_center is not None:
+      vectors = vectors[np.all(np.abs(vectors - np.asarray(search_center, dtype=dtype)) <= search_radius, axis=1)]
+    yield vectors
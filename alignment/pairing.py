@@ -6,29 +6,63 @@ import numpy as np
     :param target_points: numpy array containing the points where the source points will be translated to.
     :param translation: translation vector to shift source points with.
     :param threshold: pairing maximal difference threshold.
+    :param engine: "kdtree" only looks up neighbours within threshold, "dense" builds the full distance matrix.
+    :param assignment: "greedy" pairs the closest points first, "optimal" maximizes the number of pairs
+    and minimizes their total distance.
+    :return: list of (source index, target index, distance) tuples.
 """
-def make_pairing(source_points: np.ndarray, target_points: np.ndarray, translation: np.ndarray, threshold: float):
+def make_pairing(source_points: np.ndarray, target_points: np.ndarray, translation: np.ndarray, threshold: float,
+                 engine: str = "kdtree", assignment: str = "greedy"):
     # Translate source points.
     translated_source_points = source_points + translation
 
+    # Get valid pairs under the threshold with their distances.
+    if engine == "kdtree":
+        source_idx, target_idx, distances = __get_valid_pairs_kdtree(translated_source_points, target_points, threshold)
+    elif engine == "dense":
+        source_idx, target_idx, distances = __get_valid_pairs_dense(translated_source_points, target_points, threshold)
+    else:
+        raise ValueError(f"Unknown pairing engine: {engine}")
+
+    if assignment == "greedy":
+        return __assign_greedy(source_idx, target_idx, distances)
+    elif assignment == "optimal":
+        return __assign_optimal(source_idx, target_idx, distances, len(source_points), len(target_points), threshold)
+    else:
+        raise ValueError(f"Unknown pairing assignment: {assignment}")
+
+
+# Gets all pairs closer than threshold from the full distance matrix.
+def __get_valid_pairs_dense(source_points: np.ndarray, target_points: np.ndarray, threshold: float):
     # Get all distances between all pairs.
-    distances = np.linalg.norm(translated_source_points[:, None, :] - target_points[None, :, :], axis=-1)
+    distances = np.linalg.norm(source_points[:, None, :] - target_points[None, :, :], axis=-1)
 
     # Get valid pairs by thresholding.
-    valid_pairs = np.argwhere(distances <= threshold)
-    valid_distances = distances[valid_pairs[:, 0], valid_pairs[:, 1]]
+    source_idx, target_idx = np.nonzero(distances <= threshold)
+    return source_idx, target_idx, distances[source_idx, target_idx]
+
+
+# Gets all pairs closer than threshold by querying only the neighbourhood of the points.
+def __get_valid_pairs_kdtree(source_points: np.ndarray, target_points: np.ndarray, threshold: float):
+    from scipy.spatial import cKDTree
+
+    if len(source_points) == 0 or len(target_points) == 0:
+        return np.array([], dtype=np.intp), np.array([], dtype=np.intp), np.array([])
+
+    pairs = cKDTree(source_points).sparse_distance_matrix(cKDTree(target_points), threshold, output_type="ndarray")
+    return pairs["i"].astype(np.intp), pairs["j"].astype(np.intp), pairs["v"]
+
 
-    # Include distance to pairs and sort by it.
-    valid_pairs = np.column_stack((valid_pairs, valid_distances))
-    valid_pairs = valid_pairs[np.argsort(valid_pairs[:, 2])]
+# Greedily selects the closest pairs, not using the same source and target indices twice.
+def __assign_greedy(source_idx: np.ndarray, target_idx: np.ndarray, distances: np.ndarray):
+    # Sort by distance, ties are broken by source then target index.
+    order = np.lexsort((target_idx, source_idx, distances))
 
     # Not using the same source and target indices twice to ensure correct pairing.
     used_source_idx, used_target_idx = set(), set()
 
-    # Greedily selecting pairs.
     result = []
-    for pair in valid_pairs:
-        i, j, diff = int(pair[0]), int(pair[1]), pair[2]
+    for i, j, diff in zip(source_idx[order].tolist(), target_idx[order].tolist(), distances[order].tolist()):
         if i not in used_source_idx and j not in used_target_idx:
             result.append((i, j, diff))
             used_source_idx.add(i)
@@ -36,3 +70,37 @@ def make_pairing(source_points: np.ndarray, target_points: np.ndarray, translati
 
     return result
 
+
+# Selects the maximal number of pairs with minimal total distance by solving a sparse assignment problem.
+def __assign_optimal(source_idx: np.ndarray, target_idx: np.ndarray, distances: np.ndarray, n_source: int, n_target: int, threshold: float):
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+
+    if len(distances) == 0:
+        return []
+
+    # Rows are the sources followed by a dummy row for every target, columns are the targets followed
+    # by a dummy column for every source. Leaving a point unpaired means matching it with its dummy,
+    # which costs more than any set of real pairs could save, so the pair count is maximized first.
+    unpaired_cost = threshold * (min(n_source, n_target) + 1) + 1
+    n_edges = len(distances)
+    source_range, target_range = np.arange(n_source), np.arange(n_target)
+
+    rows = np.concatenate((source_idx, source_range, n_source + target_range, n_source + target_idx))
+    cols = np.concatenate((target_idx, n_target + source_range, target_range, n_target + source_idx))
+    weights = np.concatenate((distances, np.full(n_source + n_target, unpaired_cost), np.zeros(n_edges)))
+
+    # Weights are shifted by one as zero weights are not edges. Every full matching has the same
+    # number of edges, so the shift does not change the optimum.
+    size = n_source + n_target
+    biadjacency = coo_matrix((weights + 1, (rows, cols)), shape=(size, size)).tocsr()
+    row_ind, col_ind = min_weight_full_bipartite_matching(biadjacency)
+
+    # Keeping the real pairs, sorted by distance like the greedy pairing.
+    is_real = (row_ind < n_source) & (col_ind < n_target)
+    row_ind, col_ind = row_ind[is_real], col_ind[is_real]
+    edge_ids = coo_matrix((np.arange(1, n_edges + 1), (source_idx, target_idx)), shape=(n_source, n_target)).tocsr()
+    pair_distances = distances[np.asarray(edge_ids[row_ind, col_ind]).ravel().astype(np.intp) - 1]
+    order = np.lexsort((col_ind, row_ind, pair_distances))
+
+    return [(i, j, diff) for i, j, diff in zip(row_ind[order].tolist(), col_ind[order].tolist(), pair_distances[order].tolist())]
@@ -0,0 +1,35 @@
+import numpy as np
+
+from alignment.pairing import make_pairing
+
+
+"""
+Gets the support of a translation, which is the ratio of the points paired within the threshold after the translation.
+:param source_points: numpy array containing points which will be translated. (-1, 2) shaped.
+:param target_points: numpy array containing the points where the source points will be translated to. (-1, 2) shaped.
+:param translation: the translation of the source points.
+:param threshold: pairing maximal difference threshold.
+:return: the number of pairs relative to the size of the smaller point set.
+"""
+def get_translation_support(source_points: np.ndarray, target_points: np.ndarray, translation: np.ndarray, threshold: float = 3):
+  n_pairs = len(make_pairing(source_points, target_points, translation, threshold))
+  return n_pairs / max(min(len(source_points), len(target_points)), 1)
+
+
+"""
+Estimates the translation shared by the wells of a plate from the reliably aligned wells.
+:param translations: the translations of the aligned wells.
+:param supports: the supports of the translations, see get_translation_support.
+:param min_support: minimal support of a reliable well.
+:param min_wells: minimal number of reliable wells for the estimate.
+:return: the median of the reliable translations and the median absolute deviation from it,
+or None, None if there are too few reliable wells.
+"""
+def estimate_translation_prior(translations: list, supports: list, min_support: float = 0.3, min_wells: int = 2):
+  reliable = np.array([translation for translation, support in zip(translations, supports) if support >= min_support]).reshape(-1, 2)
+  if len(reliable) < min_wells:
+    return None, None
+
+  prior = np.median(reliable, axis=0)
+  deviation = np.median(np.linalg.norm(reliable - prior, axis=1))
+  return prior, deviation
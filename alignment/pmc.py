@@ -1,16 +1,84 @@
+import time
+import ctypes
+import itertools
 import numpy as np
 
+from alignment.memory import check_memory, iterate_correspondence_vectors
+from profiling import get_profiler
+
 
 """
 :param source_points: numpy array containing points which will be translated. (-1, 2) shaped.
 :param target_points: numpy array containing the points where the source points will be translated to. (-1, 2) shaped.
 :param epsilon: pairwise consistency threshold.
 :param correspondence_ratio: the percentage of random correspondence vector samples.
+:param engine: "bitset" keeps node sets as bitsets, "numpy" as index arrays. Both find the identical clique.
+:param time_budget: maximal time of the clique search in seconds, the best clique found until then is used. Only for the bitset engine.
+With any of the budgets, the search starts from a greedy clique, so a good clique is found even if the budget runs out early.
+:param node_budget: maximal number of expanded search nodes, the best clique found until then is used. Only for the bitset engine.
+:param search_center: center of the window of the correspondence vectors, e.g. from find_translation_fft. Defaults to no window.
+:param search_radius: maximal distance of the correspondence vectors from search_center along each axis.
+The graph is only built from the vectors in the window, which makes it much smaller.
+:param workers: number of processes searching the branches of the top level candidates, sharing the best clique size.
+The found clique is the same with any number of workers. Only for the bitset engine, without node_budget.
+:param return_info: if true, a dict is returned too, with "optimal" telling if the search finished within the budgets
+and "upper_bound" on the size of the maximal clique from the coloring, which equals the clique size if optimal.
+:param memory_limit: memory limit in bytes of the graph. The graph is built from float32 vectors of the same sample as without the limit,
+and its edges are counted before they are stored. If the graph doesn't fit, the vectors are sampled with lower ratios until it does. Defaults to no limit.
+:param profiler: profiling.Profiler recording the stages, the graph size and the expanded and pruned search nodes.
+:return: the average of the correspondence vectors in the clique, the size of the clique and optionally the info dict.
 """
-def find_translation_pmc(source_points: np.ndarray, target_points: np.ndarray, epsilon: float, correspondence_ratio: float = 1):
+def find_translation_pmc(source_points: np.ndarray, target_points: np.ndarray, epsilon: float, correspondence_ratio: float = 1, engine: str = "bitset",
+                         time_budget: float = None, node_budget: int = None, workers: int = 1, search_center: np.ndarray = None, search_radius: float = None,
+                         return_info: bool = False, memory_limit: int = None, profiler=None):
+  profiler = get_profiler(profiler)
+  if engine == "numpy" and (time_budget is not None or node_budget is not None or workers > 1):
+    raise ValueError("The search budgets and workers are only supported by the bitset engine.")
+  if node_budget is not None and workers > 1:
+    raise ValueError("The node budget is only supported by the serial search.")
+
+  # Build the graph out of selected indices.
+  with profiler.stage("pmc.graph"):
+    if memory_limit is None:
+      correspondence_vectors, indptr, indices = __build_graph(source_points, target_points, epsilon, correspondence_ratio, search_center, search_radius)
+    else:
+      # Every worker process gets its own copy of the graph.
+      graph_memory = memory_limit // (workers + 1) if workers > 1 else memory_limit
+      correspondence_vectors, indptr, indices = __build_graph_limited(source_points, target_points, epsilon, correspondence_ratio, search_center, search_radius,
+                                                                      graph_memory, profiler)
+  profiler.count("pmc.graph_nodes", len(correspondence_vectors))
+  profiler.count("pmc.graph_edges", len(indices) // 2)
+
+  # Sort the candidates in decreasing degree to minimize branching.
+  candidates = np.argsort(np.diff(indptr), kind="stable")[::-1].astype(indices.dtype)
+
+  # Finding the maximal clique.
+  with profiler.stage("pmc.search", engine=engine, workers=workers):
+    if engine == "bitset":
+      best_clique, optimal, upper_bound = __find_max_clique_bitset(candidates, indptr, indices, time_budget, node_budget, workers, profiler)
+    elif engine == "numpy":
+      best_clique = __find_max_clique_numpy(candidates, np.split(indices, indptr[1:-1]), profiler)
+      optimal, upper_bound = True, len(best_clique)
+    else:
+      raise ValueError(f"Unknown pmc engine: {engine}")
+
+  if not optimal:
+    profiler.count("pmc.budget_exceeded")
+
+  translation = np.average(correspondence_vectors[np.array(best_clique, dtype=np.intp)].astype(np.float64), axis=0)
+  if return_info:
+    return translation, len(best_clique), {"optimal": optimal, "upper_bound": upper_bound}
+
+  return translation, len(best_clique)
+
+
+# Finds the maximal clique with branch and bound, storing the node sets as numpy index arrays.
+def __find_max_clique_numpy(candidates: np.ndarray, adjacency_list: list, profiler):
   def __find_clique(candidates: np.ndarray, removed: np.ndarray, coloring: np.ndarray):
     nonlocal best_clique
     nonlocal current_clique
+    nonlocal n_expanded, n_pruned
+    n_expanded += 1
 
     # Selecting the branches which needs to be evaluated.
     required_candidates = __get_required_candidates(candidates, removed, adjacency_list)
@@ -19,6 +87,7 @@ def find_translation_pmc(source_points: np.ndarray, target_points: np.ndarray, e
     while i >= 0:
       # If can't achieve bigger clique then cut this branch.
       if (len(current_clique) + np.max(coloring)) <= len(best_clique):
+        n_pruned += 1
         return
 
       node = candidates[i]
@@ -41,41 +110,352 @@ def find_translation_pmc(source_points: np.ndarray, target_points: np.ndarray, e
       
       i -= 1
 
-  # Build the graph out of selected indices.
-  correspondence_vectors, adjacency_list = __build_graph(source_points, target_points, epsilon, correspondence_ratio)
+  current_clique, best_clique = [], []
+  n_expanded, n_pruned = 0, 0
+  __find_clique(candidates, np.array([], dtype=candidates.dtype), __get_coloring_greedy(candidates, adjacency_list))
 
-  # Sort the candidates in decreasing degree to minimize branching.
-  candidates = np.argsort([len(x) for x in adjacency_list])[::-1].astype(np.uint16)
+  profiler.count("pmc.nodes_expanded", n_expanded)
+  profiler.count("pmc.nodes_pruned", n_pruned)
+  return best_clique
+
+
+# Finds the maximal clique with the same branch and bound as the numpy engine, storing the node sets
+# as bitsets in python integers. The traversal order is kept identical, so is the found clique.
+# The top level works on the CSR arrays, the branches use bitsets over the neighbourhood of their root.
+# When a budget runs out, the search stops and the best clique so far is returned, along with whether it is
+# proven to be maximal and the upper bound of the maximal clique size. With a budget, the search starts from
+# a greedy clique, which may lead to a different clique of the same size than the unbudgeted search.
+def __find_max_clique_bitset(candidates: np.ndarray, indptr: np.ndarray, indices: np.ndarray, time_budget: float, node_budget: int, workers: int, profiler):
+  # The roots are searched in increasing degree, a root excludes the required roots before it from its branch.
+  roots = candidates[::-1]
+  positions = np.empty(len(roots), dtype=np.int64)
+  positions[roots] = np.arange(len(roots))
+
+  # The pivot leaving the fewest candidates is the first one with the highest degree.
+  required_candidates = np.ones(len(candidates), dtype=bool)
+  if len(candidates) > 0:
+    required_candidates[indices[indptr[candidates[0]]:indptr[candidates[0] + 1]]] = False
+
+  # The bound of each root is the number of colors of the roots not searched before it.
+  bounds = __get_root_bounds(candidates, roots, required_candidates, indptr, indices)
+  graph = (roots, positions, required_candidates, bounds, indptr, indices)
+
+  best_clique = []
+  if node_budget is not None or time_budget is not None:
+    best_clique = __find_clique_greedy(candidates, indptr, indices, np.full(len(candidates), -1, dtype=np.int64))
+
+  max_nodes = node_budget if node_budget is not None else np.inf
+  deadline = time.time() + time_budget if time_budget is not None else np.inf
+
+  if workers > 1:
+    results = __search_roots_parallel(graph, len(best_clique), max_nodes, deadline, workers)
+  else:
+    results = [__search_roots(graph, 0, 1, len(best_clique), None, max_nodes, deadline)]
+
+  # The largest clique is kept, from the earliest root on ties, like in the serial traversal.
+  stop_position, n_expanded, n_pruned = len(roots), 1, 0
+  for clique, clique_position, task_expanded, task_pruned, task_stop_position in sorted(results, key=lambda result: (-len(result[0]), result[1])):
+    if len(clique) > len(best_clique):
+      best_clique = clique
+    stop_position = min(stop_position, task_stop_position)
+    n_expanded += task_expanded
+    n_pruned += task_pruned
+
+  # The colors of the unfinished roots bound the cliques not searched yet.
+  stopped = stop_position < len(roots)
+
+  profiler.count("pmc.nodes_expanded", n_expanded)
+  profiler.count("pmc.nodes_pruned", n_pruned)
+  return best_clique, not stopped, max(len(best_clique), int(bounds[stop_position])) if stopped else len(best_clique)
+
+
+# Searches the branches of every step-th root from the start position in the traversal order. Cliques
+# are only searched above best_size, and above the shared best size of all the workers if given. Returns
+# the best clique, the position of its root, the number of expanded and pruned nodes and the position of
+# the first unfinished root if a budget ran out.
+def __search_roots(graph: tuple, start: int, step: int, best_size: int, shared_best, max_nodes: float, deadline: float):
+  # The shared best size is read without the lock, only the updates are synchronized.
+  def __update_shared_best():
+    if shared_best is not None:
+      with shared_best.get_lock():
+        shared_best.value = max(shared_best.value, best_size)
+
+  def __find_clique(candidates: int, removed: int):
+    nonlocal best_clique, best_size, best_position
+    nonlocal n_expanded, n_pruned, stopped
+    n_expanded += 1
+
+    # Stopping the whole search when a budget runs out, but only after a first clique is found.
+    if best_size > 0 and (n_expanded > max_nodes or time.time() > deadline):
+      stopped = True
+      return
+
+    # Selecting the branches which needs to be evaluated.
+    required_candidates = __get_required_candidates_bitset(candidates, removed, adjacency)
+    color_classes = __get_color_classes_bitset(candidates, adjacency)
+    n_colors = len(color_classes)
+
+    for node in __iterate_bits_reversed(candidates):
+      # If can't achieve bigger clique then cut this branch. Another worker's clique of the same size
+      # may be from a later root, so only smaller branches are cut by it.
+      if (len(current_clique) + n_colors) <= best_size or (len(current_clique) + n_colors) < shared_best_value.value:
+        n_pruned += 1
+        return
+
+      bit = 1 << node
+      if required_candidates & bit:
+        current_clique.append(node)
+
+        new_candidates = candidates & adjacency[node]
+        if new_candidates:
+          __find_clique(new_candidates, removed & adjacency[node])
+          if stopped:
+            return
+        elif len(current_clique) > best_size:
+          best_clique = [current_clique[0]] + neighbours[current_clique[1:]].tolist()
+          best_size, best_position = len(best_clique), position
+          __update_shared_best()
+
+        current_clique.pop()
+        candidates ^= bit
+        removed |= bit
+
+        # Removing the node from its color, the bound decreases if the color becomes unused.
+        for i in range(n_colors):
+          if color_classes[i] & bit:
+            color_classes[i] ^= bit
+            break
+        if not color_classes[i]:
+          n_colors -= 1
+          del color_classes[i]
+
+  roots, positions, required_candidates, bounds, indptr, indices = graph
+  shared_best_value = shared_best.get_obj() if shared_best is not None else ctypes.c_int64(0)
+  local_ids = np.full(len(roots), -1, dtype=np.int64)
+  current_clique, best_clique, best_position = [], [], len(roots)
+  n_expanded, n_pruned, stopped = 0, 0, False
+
+  for position in range(start, len(roots), step):
+    # If can't achieve bigger clique then cut this branch, the bounds of the later roots are not larger.
+    if bounds[position] <= best_size or bounds[position] < shared_best_value.value:
+      n_pruned += 1
+      break
+
+    root = int(roots[position])
+    if required_candidates[root]:
+      current_clique.append(root)
+
+      # The neighbourhood is relabeled in node id order, which keeps the order of the traversal.
+      neighbours = indices[indptr[root]:indptr[root + 1]]
+      neighbours_removed = required_candidates[neighbours] & (positions[neighbours] < position)
+      if not np.all(neighbours_removed):
+        adjacency = __build_local_bitsets(neighbours, indptr, indices, local_ids)
+        __find_clique(__bools_to_bitset(~neighbours_removed), __bools_to_bitset(neighbours_removed))
+        if stopped:
+          return best_clique, best_position, n_expanded, n_pruned, position
+      elif len(current_clique) > best_size:
+        best_clique = current_clique.copy()
+        best_size, best_position = len(best_clique), position
+        __update_shared_best()
+
+      current_clique.pop()
+
+  return best_clique, best_position, n_expanded, n_pruned, len(roots)
+
+
+# Searches the roots in worker processes sharing the best clique size. Every worker gets every
+# step-th root, so the expensive high degree roots at the end are spread among them.
+def __search_roots_parallel(graph: tuple, best_size: int, max_nodes: float, deadline: float, workers: int, tasks_per_worker: int = 4):
+  import multiprocessing
+  from concurrent.futures import ProcessPoolExecutor
+
+  shared_best = multiprocessing.Value("q", best_size)
+  n_tasks = workers * tasks_per_worker
+
+  with ProcessPoolExecutor(max_workers=workers, initializer=__init_search_worker, initargs=(graph, shared_best)) as executor:
+    futures = [executor.submit(__search_roots_worker, start, n_tasks, best_size, max_nodes, deadline) for start in range(n_tasks)]
+    return [future.result() for future in futures]
+
+
+# State of a search worker process, which is shared by its tasks.
+__search_worker_state = {}
+
+
+# Initializes a search worker process with the graph and the shared best clique size.
+def __init_search_worker(graph: tuple, shared_best):
+  __search_worker_state["graph"] = graph
+  __search_worker_state["shared_best"] = shared_best
+
+
+# Searches the roots of a task in a worker process.
+def __search_roots_worker(start: int, step: int, best_size: int, max_nodes: float, deadline: float):
+  return __search_roots(__search_worker_state["graph"], start, step, best_size, __search_worker_state["shared_best"], max_nodes, deadline)
 
-  # Finding the maximal clique.
-  current_clique, best_clique = [], []
-  __find_clique(candidates, np.array([], dtype=np.uint16), __get_coloring_greedy(candidates, adjacency_list))
 
-  return np.average(correspondence_vectors[np.array(best_clique, dtype=np.uint16)], axis=0), len(best_clique)
+# Gets the bound of every root in the traversal order, which is the number of colors of the greedy
+# coloring still having a root not searched before it.
+def __get_root_bounds(candidates: np.ndarray, roots: np.ndarray, required_candidates: np.ndarray, indptr: np.ndarray, indices: np.ndarray):
+  colors = __get_coloring_greedy_csr(candidates, indptr, indices)
+  color_sizes = np.bincount(colors)
+  n_colors = len(color_sizes) - 1
+
+  bounds = np.empty(len(roots) + 1, dtype=np.int64)
+  for position, root in enumerate(roots.tolist()):
+    bounds[position] = n_colors
+    if required_candidates[root]:
+      color_sizes[colors[root]] -= 1
+      if color_sizes[colors[root]] == 0:
+        n_colors -= 1
+  bounds[len(roots)] = n_colors
+
+  return bounds
+
+
+# Finds a clique greedily in the neighbourhoods of the highest degree nodes, always adding the candidate
+# which keeps the most candidates.
+def __find_clique_greedy(candidates: np.ndarray, indptr: np.ndarray, indices: np.ndarray, local_ids: np.ndarray, n_roots: int = 8):
+  best_clique = []
+
+  for root in candidates[:n_roots].tolist():
+    neighbours = indices[indptr[root]:indptr[root + 1]]
+    if len(neighbours) < len(best_clique):
+      break
+
+    adjacency = __build_local_bitsets(neighbours, indptr, indices, local_ids)
+    clique, remaining = [], (1 << len(neighbours)) - 1
+    while remaining:
+      node = max(__iterate_bits(remaining), key=lambda node: (remaining & adjacency[node]).bit_count())
+      clique.append(node)
+      remaining &= adjacency[node]
+
+    if len(clique) + 1 > len(best_clique):
+      best_clique = [root] + neighbours[clique].tolist()
+
+  return best_clique
 
 
 # Builds a graph out of correspodence vectors between source and target points with epsilon maximal threshold.
-def __build_graph(source_points: np.ndarray, target_points: np.ndarray, epsilon: float, correspondence_ratio: float):
-  # Random sampling.
+# The neighbours are found with a kd-tree and the graph is returned as CSR adjacency arrays.
+def __build_graph(source_points: np.ndarray, target_points: np.ndarray, epsilon: float, correspondence_ratio: float, search_center: np.ndarray, search_radius: float):
+  from scipy.spatial import cKDTree
+
   correspondence_vectors = (target_points - source_points[:, np.newaxis]).reshape(-1, 2)
+  if search_center is not None:
+    correspondence_vectors = correspondence_vectors[np.all(np.abs(correspondence_vectors - search_center) <= search_radius, axis=1)]
+
+  # Random sampling.
   correspondence_vectors = correspondence_vectors[np.random.choice(len(correspondence_vectors), int(correspondence_ratio * len(correspondence_vectors)), replace=False)]
-  
-  [a_nodes, b_nodes] = np.where(np.linalg.norm(correspondence_vectors[:, np.newaxis] - correspondence_vectors, axis=-1) <= epsilon)
 
-  adjacency_list = [[] for _ in range(len(correspondence_vectors))]
-  for a, b in zip(a_nodes, b_nodes): 
-    if a != b:
-      adjacency_list[a].append(b)
-  
-  for i in range(len(adjacency_list)):
-    adjacency_list[i] = np.array(adjacency_list[i], dtype=np.uint16)
+  n_nodes = len(correspondence_vectors)
+  index_dtype = np.int32 if n_nodes <= np.iinfo(np.int32).max else np.int64
+
+  # Every edge is found once as (a, b) where a < b, storing it in both directions.
+  pairs = cKDTree(correspondence_vectors).query_pairs(epsilon, output_type="ndarray") if n_nodes > 0 else np.zeros((0, 2), dtype=np.intp)
+  a_nodes = np.concatenate((pairs[:, 0], pairs[:, 1])).astype(index_dtype)
+  b_nodes = np.concatenate((pairs[:, 1], pairs[:, 0])).astype(index_dtype)
+  del pairs
+
+  # Ordering the edges by node then by neighbour.
+  order = np.lexsort((b_nodes, a_nodes))
+  indices = b_nodes[order]
+  indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+  np.cumsum(np.bincount(a_nodes, minlength=n_nodes), out=indptr[1:])
+
+  return correspondence_vectors, indptr, indices
+
+
+# Builds the graph of __build_graph within a memory limit. The indices of the vectors are sampled like in __build_graph
+# and only the sampled vectors are generated as float32, then the edges are counted with the kd-tree. While the graph
+# doesn't fit in half of the limit, the vectors are resampled, the number of edges decreases quadratically with the ratio.
+# The neighbours are stored in blocks of nodes, so the temporary lists of the kd-tree stay within the limit too.
+def __build_graph_limited(source_points: np.ndarray, target_points: np.ndarray, epsilon: float, correspondence_ratio: float, search_center: np.ndarray,
+                          search_radius: float, memory_limit: int, profiler):
+  from scipy.spatial import cKDTree
+
+  # A node needs its vector, its float64 copy and index in the kd-tree, its degree and its index pointer.
+  node_bytes, edge_bytes, block_memory = 48, 8, memory_limit // 8
+  graph_memory = memory_limit // 2
+
+  def iterate_vectors():
+    return iterate_correspondence_vectors(source_points, target_points, block_memory, np.float32, search_center, search_radius)
+
+  # Refusing instead of degrading, when the kept vectors are expected to contain less than a few matching pairs.
+  def degrade(ratio: float, required_bytes: float):
+    if ratio * min(len(source_points), len(target_points)) < 3:
+      check_memory(required_bytes, graph_memory, "Correspondence graph")
+    profiler.count("pmc.memory_degraded")
+    return ratio
+
+  # Lowering the ratio if even the nodes don't fit. The window is applied in float64, like in __build_graph.
+  n_vectors = len(source_points) * len(target_points)
+  if search_center is not None:
+    n_vectors = sum(len(vectors) for vectors in iterate_correspondence_vectors(source_points, target_points, block_memory, np.float64, search_center, search_radius))
+  ratio = correspondence_ratio
+  if 2 * node_bytes * ratio * n_vectors > graph_memory:
+    ratio = degrade(graph_memory / (2 * node_bytes * n_vectors), 2 * node_bytes * ratio * n_vectors)
+
+  # Random sampling of the same indices as __build_graph, as long as the permutation of the indices and the indices of the window fit.
+  # Otherwise the vectors are sampled in blocks.
+  if (8 if search_center is None else 16) * n_vectors <= graph_memory:
+    vector_indices = np.random.choice(n_vectors, int(ratio * n_vectors), replace=False)
+    if search_center is not None:
+      vector_indices = __get_window_indices(source_points, target_points, block_memory, search_center, search_radius)[vector_indices]
+    source_indices, target_indices = np.divmod(vector_indices, len(target_points))
+    correspondence_vectors = target_points.astype(np.float32)[target_indices] - source_points.astype(np.float32)[source_indices]
+    del vector_indices, source_indices, target_indices
+  else:
+    profiler.count("pmc.memory_degraded")
+    correspondence_vectors = np.concatenate([vectors[np.random.random_sample(len(vectors)) < ratio] for vectors in iterate_vectors()] + [np.zeros((0, 2), dtype=np.float32)])
+
+  while True:
+    tree = cKDTree(correspondence_vectors) if len(correspondence_vectors) > 0 else None
+    degrees = tree.query_ball_point(correspondence_vectors, epsilon, return_length=True) - 1 if tree is not None else np.zeros(0, dtype=np.intp)
+    required_bytes = len(correspondence_vectors) * node_bytes + np.sum(degrees) * edge_bytes / 2
+    if required_bytes <= graph_memory:
+      break
+
+    keep_ratio = 0.9 * np.sqrt(graph_memory / required_bytes)
+    ratio = degrade(ratio * keep_ratio, required_bytes)
+    correspondence_vectors = correspondence_vectors[np.random.choice(len(correspondence_vectors), int(keep_ratio * len(correspondence_vectors)), replace=False)]
+
+  n_nodes = len(correspondence_vectors)
+  index_dtype = np.int32 if n_nodes <= np.iinfo(np.int32).max else np.int64
 
-  return correspondence_vectors, adjacency_list
+  indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+  np.cumsum(degrees, out=indptr[1:])
+  indices = np.empty(indptr[-1], dtype=index_dtype)
+
+  # A neighbour in the lists of the kd-tree takes about 64 bytes with its owner, until it is stored.
+  max_block_edges = max(1, block_memory // 64)
+  start = 0
+  while start < n_nodes:
+    stop = max(start + 1, int(np.searchsorted(indptr, indptr[start] + max_block_edges, side="right")) - 1)
+    stop = min(stop, n_nodes)
+
+    # The lists are sorted, so the neighbours are ordered like in __build_graph, without the node itself.
+    neighbour_lists = tree.query_ball_point(correspondence_vectors[start:stop], epsilon, return_sorted=True)
+    neighbours = np.fromiter(itertools.chain.from_iterable(neighbour_lists), dtype=index_dtype)
+    owners = np.repeat(np.arange(start, stop, dtype=index_dtype), degrees[start:stop] + 1)
+    indices[indptr[start]:indptr[stop]] = neighbours[neighbours != owners]
+    start = stop
+
+  return correspondence_vectors, indptr, indices
+
+
+# Gets the indices of the correspondence vectors in the search window, in the order of the flattened vectors of all the pairs.
+def __get_window_indices(source_points: np.ndarray, target_points: np.ndarray, block_memory: int, search_center: np.ndarray, search_radius: float):
+  n_rows = max(1, int(block_memory // max(16 * len(target_points), 1)))
+
+  window_indices = [np.zeros(0, dtype=np.intp)]
+  for start in range(0, len(source_points), n_rows):
+    vectors = (target_points - source_points[start:start + n_rows, np.newaxis]).reshape(-1, 2)
+    window_indices.append(start * len(target_points) + np.flatnonzero(np.all(np.abs(vectors - search_center) <= search_radius, axis=1)))
+  return np.concatenate(window_indices)
 
 
 # Gets the candidates which are needed to be evaluated to find the maximal clique.
 def __get_required_candidates(candidates: np.ndarray, removed: np.ndarray, adjacency_list: list):
-  all = np.concatenate((candidates, removed)).astype(np.uint16)
+  all = np.concatenate((candidates, removed)).astype(candidates.dtype)
 
   best = candidates
   for node in all:
@@ -102,7 +482,7 @@ def __get_coloring_greedy(candidates: np.ndarray, adjacency_list: list):
     used_neighbour_colors = {coloring[nbr] for nbr in adjacency_list[node] if nbr in coloring}
     coloring[node] = __get_first_available_color(used_neighbour_colors)
   
-  return np.array([coloring[x] for x in candidates], dtype=np.uint16)
+  return np.array([coloring[x] for x in candidates], dtype=candidates.dtype)
 
 
 # Updates the coloring to be consecutive numbers if element is removed.
@@ -116,3 +496,85 @@ def __update_coloring(coloring: np.ndarray, id: int):
     coloring[coloring > value] -= 1
     return coloring
 
+
+# Colors the candidates with greedy coloring algorithm on the CSR adjacency, returning the color of each node.
+def __get_coloring_greedy_csr(candidates: np.ndarray, indptr: np.ndarray, indices: np.ndarray):
+  colors = np.zeros(len(candidates), dtype=np.int64)
+
+  for node in candidates.tolist():
+    used_neighbour_colors = colors[indices[indptr[node]:indptr[node + 1]]]
+
+    # The first available color is at most one more than the number of neighbours.
+    available = np.ones(len(used_neighbour_colors) + 2, dtype=bool)
+    available[0] = False
+    available[used_neighbour_colors[used_neighbour_colors < len(available)]] = False
+    colors[node] = np.argmax(available)
+
+  return colors
+
+
+# Converts the subgraph induced by the nodes to a list of bitsets, where the jth bit of the ith item
+# marks the edge between the ith and jth nodes. The nodes are relabeled by their position.
+def __build_local_bitsets(nodes: np.ndarray, indptr: np.ndarray, indices: np.ndarray, local_ids: np.ndarray):
+  local_ids[nodes] = np.arange(len(nodes))
+  row = np.zeros(len(nodes), dtype=bool)
+
+  adjacency = []
+  for node in nodes.tolist():
+    neighbours = local_ids[indices[indptr[node]:indptr[node + 1]]]
+    neighbours = neighbours[neighbours >= 0]
+    row[neighbours] = True
+    adjacency.append(__bools_to_bitset(row))
+    row[neighbours] = False
+
+  local_ids[nodes] = -1
+  return adjacency
+
+
+# Converts a boolean mask to a bitset.
+def __bools_to_bitset(mask: np.ndarray):
+  return int.from_bytes(np.packbits(mask, bitorder="little").tobytes(), "little")
+
+
+# Iterates the nodes of a bitset in increasing order.
+def __iterate_bits(bitset: int):
+  while bitset:
+    lowest = bitset & -bitset
+    yield lowest.bit_length() - 1
+    bitset ^= lowest
+
+
+# Iterates the nodes of a bitset in decreasing order.
+def __iterate_bits_reversed(bitset: int):
+  while bitset:
+    node = bitset.bit_length() - 1
+    yield node
+    bitset ^= 1 << node
+
+
+# Gets the candidates which are needed to be evaluated to find the maximal clique, using the pivot
+# which leaves the fewest candidates. The pivots are tried in the order of the numpy engine.
+def __get_required_candidates_bitset(candidates: int, removed: int, adjacency: list):
+  best, best_count = candidates, candidates.bit_count()
+  for nodes in (candidates, removed):
+    for node in __iterate_bits(nodes):
+      diff = candidates & ~adjacency[node]
+      diff_count = diff.bit_count()
+      if diff_count < best_count:
+        best, best_count = diff, diff_count
+
+  return best
+
+
+# Colors the candidates with greedy coloring algorithm, each color class is a bitset.
+def __get_color_classes_bitset(candidates: int, adjacency: list):
+  color_classes = []
+  for node in __iterate_bits(candidates):
+    for i in range(len(color_classes)):
+      if not color_classes[i] & adjacency[node]:
+        color_classes[i] |= 1 << node
+        break
+    else:
+      color_classes.append(1 << node)
+
+  return color_classes
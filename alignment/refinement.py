@@ -0,0 +1,77 @@
+import numpy as np
+
+from profiling import get_profiler
+
+
+"""
+Refines a translation found by any of the methods to sub-pixel precision.
+A translation is scored by the squared distances of the target points to their nearest translated source point,
+capped at max_distance. A pattern search with halving steps finds the best translation in the radius, then
+the translation is shifted by the average difference of the closely paired points until it converges.
+
+:param source_points: numpy array containing points which will be translated. (-1, 2) shaped.
+:param target_points: numpy array containing the points where the source points will be translated to. (-1, 2) shaped.
+:param translation: the initial translation.
+:param radius: radius of the search around the initial translation.
+:param max_distance: points further than this from their nearest neighbour are unpaired. Defaults to radius.
+:param tolerance: precision of the refined translation.
+:param max_iterations: maximal number of averaging steps.
+:param source_tree: kd-tree built on the source points, it can be reused between calls.
+:param profiler: profiling.Profiler recording the stage, the number of evaluations and averaging steps.
+:return: the refined translation and its average error.
+"""
+def refine_translation(source_points: np.ndarray, target_points: np.ndarray, translation: np.ndarray, radius: float = 10, max_distance: float = None,
+                       tolerance: float = 1e-2, max_iterations: int = 100, source_tree=None, profiler=None):
+  profiler = get_profiler(profiler)
+  with profiler.stage("refinement"):
+    return __refine_translation(source_points, target_points, translation, radius, max_distance, tolerance, max_iterations, source_tree, profiler)
+
+
+# Refines the translation with pattern search, then with averaging the differences of the paired points.
+def __refine_translation(source_points: np.ndarray, target_points: np.ndarray, translation: np.ndarray, radius: float, max_distance: float,
+                         tolerance: float, max_iterations: int, source_tree, profiler):
+  from scipy.spatial import cKDTree
+
+  if source_tree is None:
+    source_tree = cKDTree(source_points)
+  if max_distance is None:
+    max_distance = radius
+
+  # Evaluating a translation by the capped distances of the nearest neighbours.
+  def evaluate_translation(translation: np.ndarray):
+    profiler.count("refinement.evaluations")
+    distances, _ = source_tree.query(target_points - translation, distance_upper_bound=max_distance)
+    return np.mean(np.minimum(distances, max_distance) ** 2)
+
+  initial_translation = np.asarray(translation, dtype=np.float64)
+  best_translation, best_error = initial_translation, evaluate_translation(initial_translation)
+
+  # Pattern search in the radius, halving the step when none of the neighbours are better.
+  directions = np.array([[-1, -1], [-1, 0], [-1, 1], [0, -1], [0, 1], [1, -1], [1, 0], [1, 1]])
+  step = radius / 2
+  while step >= tolerance:
+    candidates = best_translation + step * directions
+    candidates = candidates[np.all(np.abs(candidates - initial_translation) <= radius, axis=1)]
+    errors = [evaluate_translation(candidate) for candidate in candidates]
+
+    if len(errors) > 0 and np.min(errors) < best_error:
+      best_translation, best_error = candidates[np.argmin(errors)], np.min(errors)
+    else:
+      step /= 2
+
+  # Shifting the translation by the average difference of the paired points, ignoring the pairs
+  # which are much further than the typical pair.
+  for _ in range(max_iterations):
+    profiler.count("refinement.iterations")
+    distances, indices = source_tree.query(target_points - best_translation, distance_upper_bound=max_distance)
+    paired = distances < max_distance
+    if not np.any(paired):
+      break
+
+    paired &= distances <= max(3 * np.median(distances[paired]), tolerance)
+    shift = np.mean(target_points[paired] - source_points[indices[paired]] - best_translation, axis=0)
+    best_translation = best_translation + shift
+    if np.linalg.norm(shift) < tolerance / 10:
+      break
+
+  return best_translation, evaluate_translation(best_translation)
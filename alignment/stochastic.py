@@ -1,59 +1,136 @@
 import numpy as np
 
+from alignment.memory import check_memory, get_coordinate_dtype, iterate_correspondence_vectors
+from alignment.refinement import refine_translation
+from profiling import get_profiler
+
 
 """
 This algorithm tries to match samples of source points to each target point.
 One occurence of a match is described as a translation candidate.
-This method uses the combination of standard python operations and numpy operations to save memory.
+The candidates are scored in blocks with numpy operations, the block size is limited by a memory budget.
+With a memory limit, the coordinates are float32 and the correspondence vectors are generated lazily in blocks
+too, so the memory usage doesn't depend on the number of point pairs.
 
 :param source_points: numpy array containing points which will be translated. (-1, 2) shaped.
 :param target_points: numpy array containing the points where the source points will be translated to. (-1, 2) shaped.
 :param source_indices_ratio: the percentage of random source samples.
-:param optimizer_radius: 
+:param optimizer_radius: radius of the refinement around the best translation candidate.
+:param batch_memory: memory budget in bytes for scoring a block of translation candidates.
+:param search_center: center of the window of the translation candidates, e.g. from find_translation_fft. Defaults to no window.
+:param search_radius: maximal distance of the translation candidates from search_center along each axis.
+:param memory_limit: memory limit in bytes of the scoring, a MemoryError is raised if even the smallest blocks don't fit. Defaults to no limit.
+:param profiler: profiling.Profiler recording the stages and the number of evaluated candidates.
 """
-def find_translation_stochastic(source_points: np.ndarray, target_points: np.ndarray, source_indices_ratio: float, optimizer_radius: int = 10):
+def find_translation_stochastic(source_points: np.ndarray, target_points: np.ndarray, source_indices_ratio: float, optimizer_radius: int = 10, batch_memory: int = 2**28,
+                                search_center: np.ndarray = None, search_radius: float = None, memory_limit: int = None, profiler=None):
+  profiler = get_profiler(profiler)
+  dtype = get_coordinate_dtype(memory_limit)
+  n_selected = int(source_indices_ratio * len(source_points))
+
+  # The candidates and the scoring share the memory limit.
+  if memory_limit is not None:
+    check_memory(n_selected * len(target_points) * 2 * np.dtype(dtype).itemsize, memory_limit // 2, "Translation candidates")
+    batch_memory = min(batch_memory, memory_limit // 2)
+
   # Select random points from source data.
-  selected_source_points = source_points[np.random.choice(len(source_points), int(source_indices_ratio * len(source_points)), replace=False)]
+  selected_source_points = source_points[np.random.choice(len(source_points), n_selected, replace=False)].astype(dtype, copy=False)
 
   # Calculate all translation candidate vectors from selected source points.
-  translation_candidates = (target_points - selected_source_points[:, np.newaxis]).reshape(-1, 2)
+  translation_candidates = (target_points.astype(dtype, copy=False) - selected_source_points[:, np.newaxis]).reshape(-1, 2)
 
-  # Calculate all correspondence vectors between the two datasets.
-  correspondence_vectors = (target_points - source_points[:, np.newaxis]).reshape(-1, 2)
+  # Keeping the candidates in the search window, the center is tried if none of them are.
+  if search_center is not None:
+    translation_candidates = translation_candidates[np.all(np.abs(translation_candidates - search_center) <= search_radius, axis=1)]
+    if len(translation_candidates) == 0:
+      translation_candidates = np.asarray(search_center, dtype=np.float64)[np.newaxis]
 
-  # Storing the best average error and best translation.
-  best_error, best_translation = np.Infinity, None
+  # Calculate all correspondence vectors between the two datasets, unless they are generated lazily.
+  if memory_limit is None:
+    correspondence_vectors = (target_points - source_points[:, np.newaxis]).reshape(-1, 2)
 
-  # Evaluating a translation candidate by shifting all correspondence vectors and calculating
+  # Evaluating translation candidates by shifting all correspondence vectors and calculating
   # average length.
-  def evaluate_candidate(translation_candidate: np.ndarray):
-    error_vectors = correspondence_vectors - translation_candidate
-    error_lengths = np.linalg.norm(error_vectors, axis=-1)
-    return np.average(np.sort(error_lengths)[:len(target_points)] ** 2)
-  
-  # Optimizing translation by shifting it by a grid of vectors.
-  def optimize_translation(translation: np.ndarray):
-    x = np.linspace(-optimizer_radius, optimizer_radius, 2 * optimizer_radius + 1)
-    y = np.linspace(-optimizer_radius, optimizer_radius, 2 * optimizer_radius + 1)
-
-    X, Y = np.meshgrid(x, y)
-    dt = np.stack([X, Y], axis=-1).reshape((-1, 2))
+  def evaluate_candidates(candidates: np.ndarray):
+    profiler.count("stochastic.candidates_evaluated", len(candidates))
+    if memory_limit is not None:
+      return __evaluate_candidates_lazy(source_points, target_points, candidates, len(target_points), batch_memory, dtype)
+    return __evaluate_candidates(correspondence_vectors, candidates, len(target_points), batch_memory)
 
-    best_error, best_transformed = np.Infinity, None
-    for t in dt:
-      error = evaluate_candidate(translation + t)
-      if error < best_error:
-        best_error = error
-        best_transformed = translation + t
-    
-    return best_transformed, best_error
+  # Optimizing translation to sub-pixel precision around the best candidate.
+  def optimize_translation(translation: np.ndarray):
+    optimized_translation, _ = refine_translation(source_points, target_points, translation, optimizer_radius, profiler=profiler)
+    return optimized_translation, evaluate_candidates(optimized_translation[np.newaxis])[0]
 
   # Tries each translation candidate and select the best.
-  for candidate in translation_candidates:
-    error = evaluate_candidate(candidate)
-    if error < best_error:
-      best_error = error
-      best_translation = candidate
-  
+  with profiler.stage("stochastic.candidates"):
+    errors = evaluate_candidates(translation_candidates)
+    best_translation = translation_candidates[np.argmin(errors)].astype(np.float64)
+
   return optimize_translation(best_translation)
 
+
+# Calculates the average of the smallest squared error lengths for every translation candidate.
+# The candidates are evaluated in blocks whose float64 work arrays fit in batch_memory bytes.
+def __evaluate_candidates(correspondence_vectors: np.ndarray, candidates: np.ndarray, n_smallest: int, batch_memory: int):
+  n_vectors = len(correspondence_vectors)
+  n_smallest = min(n_smallest, n_vectors)
+
+  # A block needs two (block size, number of correspondence vectors) shaped arrays.
+  block_size = max(1, int(batch_memory // (2 * n_vectors * np.dtype(np.float64).itemsize)))
+
+  errors = np.empty(len(candidates))
+  for start in range(0, len(candidates), block_size):
+    block = candidates[start:start + block_size]
+
+    # Squared error lengths of the shifted correspondence vectors.
+    error_lengths = np.subtract(correspondence_vectors[:, 0], block[:, 0, np.newaxis], dtype=np.float64)
+    error_y = np.subtract(correspondence_vectors[:, 1], block[:, 1, np.newaxis], dtype=np.float64)
+    np.square(error_lengths, out=error_lengths)
+    np.square(error_y, out=error_y)
+    error_lengths += error_y
+    del error_y
+
+    # Partial selection of the smallest errors instead of sorting all of them.
+    error_lengths.partition(n_smallest - 1, axis=1)
+    errors[start:start + len(block)] = np.mean(error_lengths[:, :n_smallest], axis=1)
+
+  return errors
+
+
+# Calculates the same errors as __evaluate_candidates, but generates the correspondence vectors in blocks for
+# each block of candidates, keeping the smallest errors of the candidates between the vector blocks.
+def __evaluate_candidates_lazy(source_points: np.ndarray, target_points: np.ndarray, candidates: np.ndarray, n_smallest: int, batch_memory: int, dtype):
+  n_smallest = min(n_smallest, len(source_points) * len(target_points))
+  itemsize = np.dtype(dtype).itemsize
+
+  # A vector block has at least n_smallest vectors, a block of candidates needs three
+  # (block size, n_smallest + number of vectors in a block) shaped arrays.
+  n_rows = max(1, -(-n_smallest // max(len(target_points), 1)))
+  n_vectors = n_rows * len(target_points)
+  check_memory(3 * (n_smallest + n_vectors) * itemsize, batch_memory, "Scoring a translation candidate")
+  block_size = max(1, int(batch_memory // (3 * (n_smallest + n_vectors) * itemsize)))
+
+  errors = np.empty(len(candidates))
+  for start in range(0, len(candidates), block_size):
+    block = candidates[start:start + block_size].astype(dtype)
+
+    smallest = np.empty((len(block), 0), dtype=dtype)
+    for vectors in iterate_correspondence_vectors(source_points, target_points, 2 * n_vectors * itemsize, dtype):
+      error_lengths = np.subtract(vectors[:, 0], block[:, 0, np.newaxis])
+      error_y = np.subtract(vectors[:, 1], block[:, 1, np.newaxis])
+      np.square(error_lengths, out=error_lengths)
+      np.square(error_y, out=error_y)
+      error_lengths += error_y
+      del error_y
+
+      # Merging with the smallest errors of the previous blocks.
+      error_lengths = np.concatenate((smallest, error_lengths), axis=1)
+      if error_lengths.shape[1] > n_smallest:
+        error_lengths.partition(n_smallest - 1, axis=1)
+      smallest = error_lengths[:, :n_smallest].copy()
+      del error_lengths
+
+    errors[start:start + len(block)] = np.mean(smallest, axis=1, dtype=np.float64)
+
+  return errors
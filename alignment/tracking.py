@@ -0,0 +1,39 @@
+import numpy as np
+
+from alignment.refinement import refine_translation
+from profiling import get_profiler
+
+
+"""
+Tracks a slowly drifting translation over a series of target point sets, e.g. the biosensor points of consecutive
+windows of a recording. Every set is warm-started from the translation of the previous one and only refined in a
+narrow radius, instead of searching all the translations again. The kd-tree of the fixed source points is built once
+and shared by all the refinements.
+
+:param source_points: numpy array containing the fixed points which will be translated. (-1, 2) shaped.
+:param target_point_series: list of numpy arrays containing the points where the source points will be translated to. (-1, 2) shaped.
+:param translation: the initial translation, e.g. found by any of the methods on the whole recording.
+:param radius: radius of the search around the translation of the previous set.
+:param max_distance: points further than this from their nearest neighbour are unpaired. Defaults to radius.
+:param tolerance: precision of the refined translations.
+:param profiler: profiling.Profiler recording the stage and the number of tracked sets.
+:return: (-1, 2) shaped array of the translations and the array of their average errors, see refine_translation.
+The sets without points keep the previous translation with nan error.
+"""
+def track_translation(source_points: np.ndarray, target_point_series: list, translation: np.ndarray, radius: float = 5, max_distance: float = None,
+                      tolerance: float = 1e-2, profiler=None):
+  from scipy.spatial import cKDTree
+
+  profiler = get_profiler(profiler)
+  translation = np.asarray(translation, dtype=np.float64)
+  translations, errors = np.empty((len(target_point_series), 2)), np.full(len(target_point_series), np.nan)
+
+  with profiler.stage("tracking", n_sets=len(target_point_series)):
+    source_tree = cKDTree(source_points)
+    for i, target_points in enumerate(target_point_series):
+      if len(target_points) > 0:
+        translation, errors[i] = refine_translation(source_points, target_points, translation, radius, max_distance, tolerance, source_tree=source_tree, profiler=profiler)
+      translations[i] = translation
+
+  profiler.count("tracking.sets", len(target_point_series))
+  return translations, errors
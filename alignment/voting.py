@@ -0,0 +1,100 @@
+import numpy as np
+
+from alignment.memory import check_memory, get_coordinate_dtype
+from profiling import get_profiler
+
+
+"""
+Every correspondence vector between the source and target points is a vote for a translation.
+The votes are accumulated in a 2D histogram, then the densest region is accumulated again with finer bins.
+The votes are generated in blocks, so the memory usage only depends on the number of bins.
+
+:param source_points: numpy array containing points which will be translated. (-1, 2) shaped.
+:param target_points: numpy array containing the points where the source points will be translated to. (-1, 2) shaped.
+:param bin_size: size of the histogram bins on the coarsest level.
+:param n_levels: number of histogram levels, the bin size is halved on each of them.
+:param block_size: maximal number of votes generated at once.
+:param search_center: center of the window of the votes, e.g. from find_translation_fft. Defaults to no window.
+:param search_radius: maximal distance of the votes from search_center along each axis.
+:param memory_limit: memory limit in bytes, the votes are float32 and the blocks are limited to fit in it. A MemoryError
+is raised if a histogram doesn't fit. Defaults to no limit.
+:param profiler: profiling.Profiler recording the stage and the number of counted votes.
+:return: the average of the votes around the peak and the number of these votes.
+"""
+def find_translation_voting(source_points: np.ndarray, target_points: np.ndarray, bin_size: float, n_levels: int = 3, block_size: int = 2**20,
+                            search_center: np.ndarray = None, search_radius: float = None, memory_limit: int = None, profiler=None):
+  profiler = get_profiler(profiler)
+
+  # A vote takes about 64 bytes with its bin, the histograms get the other half of the limit.
+  if memory_limit is not None:
+    block_size = max(1, min(block_size, memory_limit // 128))
+
+  with profiler.stage("voting.histogram"):
+    translation, vote_count = __find_peak(source_points, target_points, bin_size, n_levels, block_size, search_center, search_radius, memory_limit, profiler)
+
+  return translation, vote_count
+
+
+# Finds the peak of the votes, refining the histogram on each level.
+def __find_peak(source_points: np.ndarray, target_points: np.ndarray, bin_size: float, n_levels: int, block_size: int,
+                search_center: np.ndarray, search_radius: float, memory_limit: int, profiler):
+  dtype = get_coordinate_dtype(memory_limit)
+
+  # Bounds of all the possible votes.
+  low = np.min(target_points, axis=0) - np.max(source_points, axis=0)
+  high = np.max(target_points, axis=0) - np.min(source_points, axis=0)
+  if search_center is not None:
+    low, high = np.maximum(low, search_center - search_radius), np.minimum(high, search_center + search_radius)
+    if np.any(low > high):
+      return np.asarray(search_center, dtype=np.float64), 0
+
+  for _ in range(n_levels):
+    shape = np.floor((high - low) / bin_size).astype(np.intp) + 1
+    if memory_limit is not None:
+      check_memory(32 * shape[0] * shape[1], memory_limit // 2, "Voting histogram")
+
+    # Accumulating the votes in the bins.
+    counts = np.zeros(shape[0] * shape[1], dtype=np.int64)
+    for votes in __iterate_votes(source_points, target_points, low, high, block_size, dtype):
+      bins = np.minimum(((votes - low) / bin_size).astype(np.intp), shape - 1)
+      counts += np.bincount(bins[:, 0] * shape[1] + bins[:, 1], minlength=len(counts))
+      profiler.count("voting.votes", len(votes))
+
+    # Summing the neighbouring bins, so a peak split by a bin edge is found too.
+    peak = np.unravel_index(np.argmax(__sum_neighbours(counts.reshape(shape))), shape)
+
+    # The next level only covers the neighbourhood of the peak.
+    center = low + (np.array(peak) + 0.5) * bin_size
+    low, high = center - 1.5 * bin_size, center + 1.5 * bin_size
+    bin_size /= 2
+
+  # Averaging the votes around the peak.
+  vote_sum, vote_count = np.zeros(2), 0
+  for votes in __iterate_votes(source_points, target_points, low, high, block_size, dtype):
+    vote_sum += np.sum(votes, axis=0, dtype=np.float64)
+    vote_count += len(votes)
+
+  return vote_sum / max(vote_count, 1), vote_count
+
+
+# Iterates the correspondence vectors in blocks, keeping only the ones between low and high.
+def __iterate_votes(source_points: np.ndarray, target_points: np.ndarray, low: np.ndarray, high: np.ndarray, block_size: int, dtype=np.float64):
+  source_points, target_points = source_points.astype(dtype, copy=False), target_points.astype(dtype, copy=False)
+  n_rows = max(1, block_size // max(len(target_points), 1))
+
+  for start in range(0, len(source_points), n_rows):
+    votes = (target_points - source_points[start:start + n_rows, np.newaxis]).reshape(-1, 2)
+    yield votes[np.all((votes >= low) & (votes <= high), axis=1)]
+
+
+# Sums the 3x3 neighbourhood of every bin.
+def __sum_neighbours(counts: np.ndarray):
+  padded = np.pad(counts, 1)
+  height, width = counts.shape
+
+  result = np.zeros_like(counts)
+  for dy in range(3):
+    for dx in range(3):
+      result += padded[dy:dy + height, dx:dx + width]
+
+  return result
@@ -1,9 +1,11 @@
-import numpy as np
+import csv
+import json
 import time
 import click
-import pickle
+import numpy as np
 from memory_profiler import memory_usage
-from alignment import find_translation_pmc, find_translation_stochastic
+from alignment import find_translation_pmc, find_translation_stochastic, find_translation_voting, find_translation_fft, make_pairing, get_affine_transformation
+from cli.synthetic import generate_well, generate_segmentation
 
 
 @click.group()
@@ -13,115 +15,215 @@ def cli():
 
 
 @cli.command()
-@click.option("--n_source_points_array", type=str, required=True, help="1D array as a comma-separated string (e.g. 1,2,3).")
-@click.option("--n_target_points_array", type=str, required=True, help="1D array as a comma-separated string (e.g. 1,2,3).")
-@click.option("--n_source_indices_array", type=str, required=True, help="1D array as a comma-separated string (e.g. 1,2,3).")
-@click.option("--out_path", type=str, required=True, help="A valid path to store results.")
-def eval_stochastic(n_source_points_array: str, n_target_points_array: str, n_source_indices_array: str, out_path: str):
-  n_source_points_array = __parse_1d_int_array(n_source_points_array)
-  n_target_points_array = __parse_1d_int_array(n_target_points_array)
-  n_source_indices_array = __parse_1d_int_array(n_source_indices_array)
-  assert len(n_source_points_array) == len(n_target_points_array) == len(n_source_indices_array)
-
-  output = []
-  for i in range(len(n_source_points_array)):
-    output.append({
-      "input": {
-        "n_source_points": n_source_points_array[i],
-        "n_target_points": n_target_points_array[i],
-        "n_source_indices": n_source_indices_array[i]
-      },
-      "result": __benchmark_stochastic(n_source_points_array[i], n_target_points_array[i], n_source_indices_array[i])
-    })
-    
-    with open(out_path, 'wb') as file:
-      pickle.dump(output, file)
+@click.option("--benchmarks", type=str, default="all", help="Comma-separated names of pairing, affine, centroids, stochastic, pmc, voting, fft, pipeline or all.")
+@click.option("--sizes", type=str, default="100,200,400", help="1D array as a comma-separated string (e.g. 1,2,3) of cell counts.")
+@click.option("--repeats", type=int, default=3, help="Number of repeats with different seeds for every size.")
+@click.option("--source_indices_ratio", type=float, default=0.1, help="Ratio of source samples for the stochastic method.")
+@click.option("--epsilon", type=float, default=3, help="Consistency threshold for the pmc method.")
+@click.option("--bin_size", type=float, default=20, help="Coarsest bin size for the voting method.")
+@click.option("--pixel_size", type=float, default=2, help="Finest pixel size for the fft method.")
+@click.option("--out_json", type=str, required=True, help="A valid path to store the results as json.")
+@click.option("--out_csv", type=str, default=None, help="A valid path to store the results as csv.")
+def run(benchmarks: str, sizes: str, repeats: int, source_indices_ratio: float, epsilon: float, bin_size: float, pixel_size: float, out_json: str, out_csv: str):
+  names = list(BENCHMARKS) if benchmarks == "all" else benchmarks.split(",")
+  sizes = __parse_1d_int_array(sizes)
+  config = {
+    "source_indices_ratio": source_indices_ratio,
+    "epsilon": epsilon,
+    "bin_size": bin_size,
+    "pixel_size": pixel_size
+  }
+
+  records = []
+  for name in names:
+    for size in sizes:
+      for seed in range(repeats):
+        execution_time, peak_memory, error = __benchmark_method(BENCHMARKS[name], size, seed, config)
+        records.append({
+          "benchmark": name,
+          "size": size,
+          "seed": seed,
+          "execution_time": execution_time,
+          "peak_memory": peak_memory,
+          "error": error
+        })
+        click.echo(f"{name:>12} size={size:<6} seed={seed:<3} time={execution_time:.4f}s memory={peak_memory:.1f}MiB error={error:.4f}")
+
+        # Storing the results after every run, so an interrupted sweep is not lost.
+        __write_results(records, config, out_json, out_csv)
 
 
 @cli.command()
-@click.option("--n_source_points_array", type=str, required=True, help="1D array as a comma-separated string (e.g. 1,2,3).")
-@click.option("--n_target_points_array", type=str, required=True, help="1D array as a comma-separated string (e.g. 1,2,3).")
-@click.option("--epsilon_array", type=str, required=True, help="1D array as a comma-separated string (e.g. 1,2,3).")
-@click.option("--out_path", type=str, required=True, help="A valid path to store results.")
-def eval_pmc(n_source_points_array: str, n_target_points_array: str, epsilon_array: str, out_path: str):
-  n_source_points_array = __parse_1d_int_array(n_source_points_array)
-  n_target_points_array = __parse_1d_int_array(n_target_points_array)
-  epsilon_array = __parse_1d_float_array(epsilon_array)
-  assert len(n_source_points_array) == len(n_target_points_array) == len(epsilon_array)
-
-  output = []
-  for i in range(len(n_source_points_array)):
-    output.append({
-      "input": {
-        "n_source_points": n_source_points_array[i],
-        "n_target_points": n_target_points_array[i],
-        "epsilon": epsilon_array[i]
-      },
-      "result": __benchmark_pmc(n_source_points_array[i], n_target_points_array[i], epsilon_array[i])
-    })
-
-  with open(out_path, 'wb') as file:
-    pickle.dump(output, file)   
+@click.option("--baseline", type=str, required=True, help="Path of the baseline results json.")
+@click.option("--current", type=str, required=True, help="Path of the current results json.")
+@click.option("--time_tolerance", type=float, default=0.2, help="Allowed relative increase of the median execution time.")
+@click.option("--min_time", type=float, default=0.01, help="Execution time increases below this many seconds are ignored.")
+@click.option("--memory_tolerance", type=float, default=16, help="Allowed increase of the median peak memory in MiB.")
+@click.option("--error_tolerance", type=float, default=0.1, help="Allowed increase of the median error.")
+def compare(baseline: str, current: str, time_tolerance: float, min_time: float, memory_tolerance: float, error_tolerance: float):
+  baseline_results, current_results = __read_medians(baseline), __read_medians(current)
 
+  regressions = 0
+  for key in sorted(set(baseline_results) & set(current_results)):
+    base, curr = baseline_results[key], current_results[key]
 
-# Parses a command line string input as an int array.
-def __parse_1d_int_array(str):
-  array_1d = list(map(int, str.split(',')))
-  return array_1d
+    flags = []
+    if curr["execution_time"] > base["execution_time"] * (1 + time_tolerance) and curr["execution_time"] - base["execution_time"] > min_time:
+      flags.append("time")
+    if curr["peak_memory"] - base["peak_memory"] > memory_tolerance:
+      flags.append("memory")
+    if curr["error"] - base["error"] > error_tolerance:
+      flags.append("error")
+    regressions += len(flags) > 0
 
+    click.echo(
+      f"{key[0]:>12} size={key[1]:<6} "
+      f"time={base['execution_time']:.4f}s->{curr['execution_time']:.4f}s "
+      f"memory={base['peak_memory']:.1f}->{curr['peak_memory']:.1f}MiB "
+      f"error={base['error']:.4f}->{curr['error']:.4f} "
+      f"{'REGRESSION: ' + ','.join(flags) if flags else 'ok'}")
 
-# Parses a command line string input as a float array.
-def __parse_1d_float_array(str):
-  array_1d = list(map(float, str.split(',')))
-  return array_1d
+  if regressions > 0:
+    raise click.ClickException(f"{regressions} benchmark(s) regressed.")
 
 
-# Benchmarks an evaluation method by measuring execution time and maximal memory usage.
-def __benchmark_method(method_fn, params):
-  start_time = time.time()
-  max_usage = memory_usage((method_fn, params), max_usage=True)
-  end_time = time.time()
+# Benchmarks pairing with the true translation by the ratio of missed and wrong pairs.
+def __benchmark_pairing(size: int, seed: int, config: dict):
+  microscope_points, biosensor_points, translation, pairs = generate_well(size, seed=seed)
 
-  return (end_time - start_time), max_usage
+  def run():
+    return make_pairing(microscope_points, biosensor_points, translation, 3)
 
+  def error(result):
+    found = {(i, j) for i, j, _ in result}
+    expected = {(i, j) for i, j in pairs.tolist()}
+    return 1 - 2 * len(found & expected) / max(len(found) + len(expected), 1)
 
-# Benchmark the stochastic method implementation by generating random input.
-def __benchmark_stochastic(n_source_points: int, n_target_points: int, n_source_indices: int):
-  assert n_source_indices <= n_source_points
-  np.random.seed(42)
+  return run, error
 
-  rnd_source_points = np.random.rand(n_source_points, 2)
-  rnd_target_points = np.random.rand(n_target_points, 2)
-  rnd_source_indices = np.random.randint(0, n_source_points, size=(n_source_indices))
 
-  execution_time, max_memory = __benchmark_method(
-    find_translation_stochastic,
-    (rnd_source_points, rnd_target_points, rnd_source_indices)
-  )
+# Benchmarks affine fitting on the true pairs by the error of the fitted translation.
+def __benchmark_affine(size: int, seed: int, config: dict):
+  microscope_points, biosensor_points, translation, pairs = generate_well(size, seed=seed)
 
-  return {
-    "execution_time": execution_time,
-    "max_memory": max_memory
-  }
+  def run():
+    return get_affine_transformation(microscope_points, biosensor_points, pairs)
+
+  def error(result):
+    return float(np.linalg.norm(result[2, :2] - translation))
+
+  return run, error
+
+
+# Benchmarks the centroid calculation by the largest difference from the scipy centers of mass.
+def __benchmark_centroids(size: int, seed: int, config: dict):
+  from scipy.ndimage import center_of_mass
+  from utils import calculate_microscope_cell_centroids
+
+  segmentation = generate_segmentation(size, seed=seed)
+
+  def run():
+    return calculate_microscope_cell_centroids(segmentation)
+
+  def error(result):
+    ids = np.unique(segmentation)[1:]
+    expected = np.array(center_of_mass(segmentation > 0, segmentation, ids))[:, ::-1]
+    return float(np.max(np.abs(result - expected)))
+
+  return run, error
+
+
+# Benchmarks a translation method by the error of the found translation.
+def __benchmark_translation(method_fn, param_name: str):
+  def benchmark(size: int, seed: int, config: dict):
+    microscope_points, biosensor_points, translation, _ = generate_well(size, seed=seed)
+
+    def run():
+      np.random.seed(seed)
+      return method_fn(microscope_points, biosensor_points, config[param_name])
+
+    def error(result):
+      return float(np.linalg.norm(result[0] - translation))
 
+    return run, error
 
-# Benchmark the algorithms which finds the maximal cliques. (pmc)
-def __benchmark_pmc(n_source_points: int, n_target_points: int, epsilon: float):
-  np.random.seed(42)
+  return benchmark
 
-  rnd_source_points = np.random.rand(n_source_points, 2)
-  rnd_target_points = np.random.rand(n_target_points, 2)
 
-  execution_time, max_memory = __benchmark_method(
-    find_translation_pmc,
-    (rnd_source_points, rnd_target_points, epsilon)
-  )
+# Benchmarks the pipeline on a plate of processed wells by the average error of the translations.
+def __benchmark_pipeline(size: int, seed: int, config: dict):
+  from pipeline import run_pipeline
+
+  wells = {f"W{i}": generate_well(size, seed=seed * 100 + i) for i in range(8)}
+  data = {key: ((None, well[0]), (None, well[1], None)) for key, well in wells.items()}
+
+  def run():
+    np.random.seed(seed)
+    return run_pipeline(data, mode=("voting", config["bin_size"]), is_processed=True, refine={})
+
+  def error(result):
+    return float(np.mean([np.linalg.norm(result[key][2] + wells[key][2]) for key in wells]))
+
+  return run, error
+
+
+BENCHMARKS = {
+  "pairing": __benchmark_pairing,
+  "affine": __benchmark_affine,
+  "centroids": __benchmark_centroids,
+  "stochastic": __benchmark_translation(find_translation_stochastic, "source_indices_ratio"),
+  "pmc": __benchmark_translation(find_translation_pmc, "epsilon"),
+  "voting": __benchmark_translation(find_translation_voting, "bin_size"),
+  "fft": __benchmark_translation(find_translation_fft, "pixel_size"),
+  "pipeline": __benchmark_pipeline
+}
+
+
+# Benchmarks a method by measuring execution time, the peak memory usage above the usage before the
+# call and the error of the result.
+def __benchmark_method(benchmark_fn, size: int, seed: int, config: dict):
+  run_fn, error_fn = benchmark_fn(size, seed, config)
+
+  base_usage = memory_usage(-1, interval=0.01, timeout=0.05, max_usage=True)
+  start_time = time.perf_counter()
+  max_usage, result = memory_usage((run_fn, ()), interval=0.01, max_usage=True, retval=True)
+  end_time = time.perf_counter()
+
+  return end_time - start_time, max(max_usage - base_usage, 0), error_fn(result)
+
+
+# Writes the results as json and optionally as csv.
+def __write_results(records: list, config: dict, out_json: str, out_csv: str):
+  with open(out_json, "w") as file:
+    json.dump({"config": config, "results": records}, file, indent=2)
+
+  if out_csv is not None:
+    with open(out_csv, "w", newline="") as file:
+      writer = csv.DictWriter(file, fieldnames=list(records[0].keys()))
+      writer.writeheader()
+      writer.writerows(records)
+
+
+# Reads a results json and takes the median of the repeats of every benchmark and size.
+def __read_medians(path: str):
+  with open(path, "r") as file:
+    records = json.load(file)["results"]
+
+  groups = {}
+  for record in records:
+    groups.setdefault((record["benchmark"], record["size"]), []).append(record)
 
   return {
-    "execution_time": execution_time,
-    "max_memory": max_memory
+    key: {field: float(np.median([record[field] for record in group])) for field in ("execution_time", "peak_memory", "error")}
+    for key, group in groups.items()
   }
 
 
+# Parses a command line string input as an int array.
+def __parse_1d_int_array(str):
+  array_1d = list(map(int, str.split(',')))
+  return array_1d
+
+
 if __name__ == "__main__":
-  cli()
\ No newline at end of file
+  cli()
@@ -0,0 +1,168 @@
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import click
+
+
+# The client only imports the standard library and click, the heavy modules are kept loaded by the daemon.
+DEFAULT_SOCKET_PATH = os.path.join(tempfile.gettempdir(), f"cell-aligner-{os.getuid()}.sock")
+
+
+"""
+Sends a request to the daemon and returns its response. The messages are single line json objects.
+:param request: the request, with the command and its parameters.
+:param socket_path: path of the unix socket of the daemon.
+:param timeout: maximal time in seconds to wait for the response, None waits until the job is finished.
+"""
+def send_request(request: dict, socket_path: str = DEFAULT_SOCKET_PATH, timeout: float = None):
+  with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+    connection.settimeout(timeout)
+    connection.connect(socket_path)
+    send_message(connection, request)
+    return receive_message(connection)
+
+
+# Sends a json message terminated by a newline.
+def send_message(connection: socket.socket, message: dict):
+  connection.sendall(json.dumps(message).encode() + b"\n")
+
+
+# Receives a json message terminated by a newline, or None if the connection is closed before it.
+def receive_message(connection: socket.socket):
+  with connection.makefile("rb") as file:
+    line = file.readline()
+  return json.loads(line) if line else None
+
+
+@click.group()
+@click.option("--socket_path", type=str, default=DEFAULT_SOCKET_PATH, help="Path of the unix socket of the daemon.")
+@click.pass_context
+def cli(context, socket_path: str):
+  """Client of the alignment daemon."""
+  context.obj = {"socket_path": socket_path}
+
+
+@cli.command()
+@click.option("--cellpose_model_path", type=str, default="", help="Path of the Cellpose model loaded at the start.")
+@click.option("--gpu/--cpu", default=None, help="Running the model on the gpu. Defaults to the gpu if available.")
+@click.option("--cache", type=str, default=None, help="Directory of the processing cache of the daemon.")
+@click.option("--wait", type=float, default=120, help="Maximal time in seconds to wait for the daemon to start.")
+@click.pass_context
+def start(context, cellpose_model_path: str, gpu: bool, cache: str, wait: float):
+  """Starts the daemon in the background and waits until it accepts jobs."""
+  import subprocess
+
+  socket_path = context.obj["socket_path"]
+  if __is_running(socket_path):
+    click.echo(f"The daemon is already running on {socket_path}.")
+    return
+
+  arguments = [sys.executable, "-m", "cli.daemon", "--socket_path", socket_path, "--cellpose_model_path", cellpose_model_path]
+  if gpu is not None:
+    arguments.append("--gpu" if gpu else "--cpu")
+  if cache is not None:
+    arguments += ["--cache", cache]
+
+  # The daemon is detached from the terminal, so it outlives the client.
+  root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+  process = subprocess.Popen(arguments, cwd=root_path, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+  deadline = time.time() + wait
+  while time.time() < deadline:
+    if process.poll() is not None:
+      raise click.ClickException(f"The daemon exited with code {process.returncode}.")
+    if __is_running(socket_path):
+      click.echo(f"The daemon is running on {socket_path} with pid {process.pid}.")
+      return
+    time.sleep(0.1)
+
+  raise click.ClickException(f"The daemon didn't start in {wait} seconds.")
+
+
+@cli.command()
+@click.pass_context
+def ping(context):
+  """Prints the state of the daemon."""
+  response = __request(context, {"command": "ping"})
+  click.echo(json.dumps(response, indent=2))
+
+
+@cli.command()
+@click.pass_context
+def stop(context):
+  """Stops the daemon after the current job."""
+  __request(context, {"command": "shutdown"})
+  click.echo("The daemon is stopped.")
+
+
+@cli.command()
+@click.argument("path", type=str)
+@click.option("--mode", type=str, default="pmc", help="Alignment method: stochastic, pmc, voting or fft.")
+@click.option("--mode_param", type=float, default=3, help="Main parameter of the method, e.g. epsilon of pmc.")
+@click.option("--mode_options", type=str, default=None, help="Json object of the further parameters of the method.")
+@click.option("--flip_epic", type=str, default="0,0", help="Flipping of the biosensor data as comma-separated 0 or 1 values.")
+@click.option("--epic_params", type=str, default=None, help="Path of the json file of the biosensor processing parameters.")
+@click.option("--pipeline_options", type=str, default=None, help="Json object of further run_pipeline parameters, e.g. refine or plate.")
+@click.option("--cellpose_model_path", type=str, default="", help="Path of the Cellpose model, the daemon keeps it loaded.")
+@click.option("--out", type=str, default=None, help="Path of the pickle file of the pipeline results.")
+@click.option("--profile", is_flag=True, help="Printing the stages of the job.")
+@click.pass_context
+def align(context, path: str, mode: str, mode_param: float, mode_options: str, flip_epic: str, epic_params: str, pipeline_options: str, cellpose_model_path: str,
+          out: str, profile: bool):
+  """Aligns the wells of the measurement at PATH, or of the pickled data dict of run_pipeline at PATH, in the daemon."""
+  request = {
+    "command": "align",
+    "path": os.path.abspath(path),
+    "mode": [mode, mode_param] + ([json.loads(mode_options)] if mode_options is not None else []),
+    "flip_epic": [bool(int(flip)) for flip in flip_epic.split(",")],
+    "cellpose_model_path": cellpose_model_path,
+    "options": json.loads(pipeline_options) if pipeline_options is not None else {},
+    "out": os.path.abspath(out) if out is not None else None,
+    "profile": profile
+  }
+  if epic_params is not None:
+    with open(epic_params, "r") as file:
+      request["epic_params"] = json.load(file)
+
+  response = __request(context, request)
+  for key, translation in response["translations"].items():
+    click.echo(f"{key:>8} {translation}")
+  if profile:
+    click.echo(response["profile"])
+  click.echo(f"Finished in {response['time']:.2f}s.")
+
+
+# Sends a request to the daemon of the context, raising click errors if it isn't running or the job failed.
+def __request(context, request: dict):
+  socket_path = context.obj["socket_path"]
+  try:
+    response = send_request(request, socket_path)
+  except (FileNotFoundError, ConnectionRefusedError):
+    raise click.ClickException(f"The daemon is not running on {socket_path}, it can be started with the start command.")
+
+  if response is None:
+    raise click.ClickException("The daemon closed the connection.")
+  if response["status"] != "ok":
+    raise click.ClickException(f"{response['error']}\n{response.get('traceback', '')}")
+  return response
+
+
+# Checks whether the daemon is running. A daemon busy with a job accepts the connection, but doesn't answer the ping in time.
+# The other errors of the socket, e.g. of a socket of another user, are raised as click errors.
+def __is_running(socket_path: str):
+  try:
+    send_request({"command": "ping"}, socket_path, timeout=1)
+  except (FileNotFoundError, ConnectionRefusedError):
+    return False
+  except socket.timeout:
+    return True
+  except (OSError, ValueError) as error:
+    raise click.ClickException(f"Can't connect to the daemon on {socket_path}: {error}")
+  return True
+
+
+if __name__ == "__main__":
+  cli()
@@ -0,0 +1,177 @@
+import os
+import time
+import socket
+import traceback
+import click
+
+from cli.client import DEFAULT_SOCKET_PATH, send_message, receive_message
+
+
+# Modules imported at the start, so the jobs don't pay for importing them.
+WARM_MODULES = [
+  "pipeline",
+  "alignment",
+  "preprocessing",
+  "cellpose.models",
+  "nanopyx.methods",
+  "nanobio_core.epic_cardio.processing",
+  "nanobio_core.epic_cardio.data_correction",
+  "nanobio_core.epic_cardio.math_ops",
+  "nanobio_core.image_fitting.cardio_mic"
+]
+
+
+"""
+Serves alignment jobs over a unix socket, keeping the imported modules and the loaded Cellpose models warm between them.
+The jobs are run one after another, the other clients wait in the backlog of the socket. Every connection sends a
+single json request and receives a single json response, see cli.client.send_request.
+
+The requests are {"command": "ping"}, {"command": "shutdown"} and {"command": "align", ...} with the measurement "path",
+or the path of a pickle file of the data dict of run_pipeline, its "flip_epic", the "mode" and "epic_params" of run_pipeline, the "cellpose_model_path", further run_pipeline "options",
+the "out" path of the pickled results and "profile" to get the summary of the stages.
+
+:param socket_path: path of the unix socket, only the user can connect to it.
+:param cellpose_model_path: path of the Cellpose model loaded at the start, None doesn't load any model until a job needs it.
+:param gpu: running the models on the gpu, defaults to the gpu if available.
+:param cache: directory of the processing cache shared by the jobs, also holding the converted biosensor wells, see preprocessing.ProcessingCache.
+:param warm_modules: modules imported at the start, the missing ones are skipped.
+:param request_timeout: maximal time in seconds to wait for the request of a connection, so a silent client can't block the daemon.
+"""
+def serve(socket_path: str = DEFAULT_SOCKET_PATH, cellpose_model_path: str = None, gpu: bool = None, cache: str = None, warm_modules: list = WARM_MODULES,
+          request_timeout: float = 10):
+  state = {"models": {}, "gpu": gpu, "cache": None, "jobs": 0, "started": time.time()}
+
+  __warm_modules(warm_modules)
+  if cache is not None:
+    from preprocessing import ProcessingCache
+
+    state["cache"] = ProcessingCache(cache)
+  if cellpose_model_path is not None:
+    __get_model(state, cellpose_model_path)
+
+  __remove_stale_socket(socket_path)
+  with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+    # The socket is only accessible by the user, as the jobs can read and write any of their files.
+    previous_umask = os.umask(0o177)
+    try:
+      server.bind(socket_path)
+    finally:
+      os.umask(previous_umask)
+    server.listen()
+
+    try:
+      running = True
+      while running:
+        connection, _ = server.accept()
+        connection.settimeout(request_timeout)
+        with connection:
+          try:
+            response, running = __handle_request(receive_message(connection), state)
+          except Exception as error:
+            response = {"status": "error", "error": f"{type(error).__name__}: {error}", "traceback": traceback.format_exc()}
+          try:
+            send_message(connection, response)
+          except OSError:
+            pass
+    finally:
+      os.remove(socket_path)
+
+
+# Handles a request, returning the response and whether the daemon keeps running.
+def __handle_request(request: dict, state: dict):
+  if request is None:
+    return {"status": "error", "error": "Empty request."}, True
+
+  command = request.get("command")
+  if command == "ping":
+    return {"status": "ok", "pid": os.getpid(), "models": list(state["models"]), "jobs": state["jobs"], "uptime": time.time() - state["started"]}, True
+  if command == "shutdown":
+    return {"status": "ok"}, False
+  if command == "align":
+    state["jobs"] += 1
+    return __run_alignment(request, state), True
+
+  return {"status": "error", "error": f"Unknown command: {command}"}, True
+
+
+# Runs the pipeline on a measurement with the warm model of the request.
+def __run_alignment(request: dict, state: dict):
+  import pickle
+  from pipeline import run_pipeline
+  from preprocessing import NanoReader
+  from profiling import Profiler
+
+  start_time = time.time()
+  options = dict(request.get("options", {}))
+  options.setdefault("cache", state["cache"])
+
+  # The model is only needed for the unprocessed microscope images.
+  if not options.get("is_processed", False):
+    options["cellpose_model"] = __get_model(state, request.get("cellpose_model_path", ""))
+
+  profiler = Profiler() if request.get("profile", False) else None
+  if os.path.isfile(request["path"]):
+    with open(request["path"], "rb") as file:
+      data = pickle.load(file)
+  else:
+    data = NanoReader(request["path"], request.get("flip_epic", [False, False]), lazy=True, cache=state["cache"])
+  result = run_pipeline(data, mode=tuple(request.get("mode", ())), epic_params=request.get("epic_params", {}), profiler=profiler, **options)
+
+  if request.get("out") is not None:
+    with open(request["out"], "wb") as file:
+      pickle.dump(result, file)
+
+  translations = {} if options.get("only_process", False) else {str(key): well[2].tolist() for key, well in result.items()}
+  response = {"status": "ok", "translations": translations, "time": time.time() - start_time}
+  if profiler is not None:
+    response["profile"] = profiler.summary()
+  return response
+
+
+# Gets the loaded model of the path, loading it on the first use.
+def __get_model(state: dict, cellpose_model_path: str):
+  if cellpose_model_path not in state["models"]:
+    from preprocessing import load_cellpose_model
+
+    state["models"][cellpose_model_path] = load_cellpose_model(cellpose_model_path, state["gpu"])
+  return state["models"][cellpose_model_path]
+
+
+# Imports the modules, skipping the ones which are not installed.
+def __warm_modules(modules: list):
+  import importlib
+
+  for module in modules:
+    try:
+      importlib.import_module(module)
+    except ImportError as error:
+      click.echo(f"Skipping the warm import of {module}: {error}", err=True)
+
+
+# Removes the socket file of a daemon which is not running anymore, refusing to start next to a running one.
+def __remove_stale_socket(socket_path: str):
+  if not os.path.exists(socket_path):
+    return
+
+  with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+    try:
+      connection.connect(socket_path)
+    except (ConnectionRefusedError, FileNotFoundError):
+      os.remove(socket_path)
+      return
+
+  raise RuntimeError(f"A daemon is already running on {socket_path}.")
+
+
+@click.command()
+@click.option("--socket_path", type=str, default=DEFAULT_SOCKET_PATH, help="Path of the unix socket.")
+@click.option("--cellpose_model_path", type=str, default=None, help="Path of the Cellpose model loaded at the start.")
+@click.option("--gpu/--cpu", default=None, help="Running the models on the gpu. Defaults to the gpu if available.")
+@click.option("--cache", type=str, default=None, help="Directory of the processing cache shared by the jobs.")
+def cli(socket_path: str, cellpose_model_path: str, gpu: bool, cache: str):
+  """Runs the alignment daemon in the foreground."""
+  serve(socket_path, cellpose_model_path, gpu, cache)
+
+
+if __name__ == "__main__":
+  cli()
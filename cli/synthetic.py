@@ -0,0 +1,75 @@
+import numpy as np
+
+
+"""
+Generates a synthetic well with a known translation between the microscope and biosensor points.
+The cells are clustered in colonies, the biosensor field only partially overlaps the microscope field,
+a part of the cells is not detected, the detections are noisy and there are false detections too.
+
+:param n_cells: number of cells in the microscope field.
+:param size: width and height of the microscope and biosensor fields.
+:param n_clusters: number of cell colonies.
+:param cluster_std: spread of the colonies.
+:param overlap: minimal ratio of the fields overlapping along each axis.
+:param noise: standard deviation of the biosensor localization noise.
+:param detection_ratio: ratio of the cells detected on the biosensor.
+:param outlier_ratio: ratio of false detections among the biosensor points.
+:param seed: random seed.
+:return: microscope points, biosensor points, the translation from the microscope to the biosensor points
+and the (microscope index, biosensor index) pairs of the detected cells.
+"""
+def generate_well(n_cells: int, size: float = 1000, n_clusters: int = 8, cluster_std: float = 80, overlap: float = 0.8, noise: float = 1,
+                  detection_ratio: float = 0.9, outlier_ratio: float = 0.1, seed: int = 0):
+  rng = np.random.default_rng(seed)
+
+  # Cells of colonies, the ones falling out of the field are reflected back.
+  centers = rng.uniform(0, size, (n_clusters, 2))
+  microscope_points = centers[rng.integers(0, n_clusters, n_cells)] + rng.normal(0, cluster_std, (n_cells, 2))
+  microscope_points = np.abs(microscope_points)
+  microscope_points = size - np.abs(size - microscope_points)
+
+  # Shifting the cells to the biosensor field and keeping the detected ones inside it.
+  translation = rng.uniform(-(1 - overlap) * size, (1 - overlap) * size, 2)
+  shifted_points = microscope_points + translation
+  detected = (rng.random(n_cells) < detection_ratio) & np.all((shifted_points >= 0) & (shifted_points <= size), axis=1)
+  microscope_idx = np.flatnonzero(detected)
+  detections = shifted_points[microscope_idx] + rng.normal(0, noise, (len(microscope_idx), 2))
+
+  # Adding false detections and shuffling the biosensor points.
+  n_outliers = int(outlier_ratio * len(detections) / (1 - outlier_ratio))
+  biosensor_points = np.concatenate((detections, rng.uniform(0, size, (n_outliers, 2))))
+  order = rng.permutation(len(biosensor_points))
+  biosensor_points = biosensor_points[order]
+
+  biosensor_idx = np.argsort(order)[:len(microscope_idx)]
+  pairs = np.column_stack((microscope_idx, biosensor_idx))
+
+  return microscope_points, biosensor_points, translation, pairs
+
+
+"""
+Generates a segmentation mask of clustered, disk shaped cells, labeled from 1.
+
+:param n_cells: number of cells.
+:param size: width and height of the mask.
+:param radius: radius of the cells.
+:param n_clusters: number of cell colonies.
+:param seed: random seed.
+:return: the segmentation mask.
+"""
+def generate_segmentation(n_cells: int, size: int = 2048, radius: int = 8, n_clusters: int = 8, seed: int = 0):
+  rng = np.random.default_rng(seed)
+
+  centers = rng.uniform(0, size, (n_clusters, 2))
+  cell_centers = centers[rng.integers(0, n_clusters, n_cells)] + rng.normal(0, size / 10, (n_cells, 2))
+  cell_centers = np.clip(cell_centers, radius, size - radius - 1).astype(np.intp)
+
+  # Drawing the cells with a stencil, later cells overlap the earlier ones.
+  segmentation = np.zeros((size, size), dtype=np.int32)
+  dy, dx = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+  disk = dx ** 2 + dy ** 2 <= radius ** 2
+  dy, dx = dy[disk], dx[disk]
+  for id, (x, y) in enumerate(cell_centers, start=1):
+    segmentation[y + dy, x + dx] = id
+
+  return segmentation
@@ -1,7 +1,61 @@
+import time
+import numpy as np
+
 from preprocessing import Reader
+from profiling import get_profiler
+
+
+def run_pipeline(data, mode: tuple = (), cellpose_model_path: str = "", epic_params: dict = {}, is_processed: bool = False, only_process: bool = False, refine: dict = None,
+                 initialize: dict = None, affine: dict = None, plate: dict = None, track: dict = None, cellpose_model=None, gpu: bool = None, batch_size: int = 8, workers: int = 1, cache=None, store=None, profiler=None):
+  profiler = get_profiler(profiler)
+  with profiler.stage("read"):
+    microscope_data, biosensor_data = __read_data(data)
+
+  store = __open_store(store)
+  wells = __iter_wells(microscope_data, biosensor_data, mode, cellpose_model_path, epic_params, is_processed, only_process, refine, initialize, affine, plate, track,
+                       cellpose_model, gpu, batch_size, workers, cache, store, profiler)
+
+  # With a store, the results are not kept in memory, the view of the wells of this run in the store is returned instead,
+  # which loads the wells on access. The wells of earlier runs are replaced by the wells of the same keys.
+  if store is not None:
+    for _ in wells:
+      pass
+    return store["_"] if isinstance(data, list) else store.select(microscope_data.keys())
+
+  wells = dict(wells)
+
+  # Keeping the order of the input wells regardless of the order they finished in.
+  result = {key: wells[key] for key in microscope_data.keys()}
+  return result["_"] if isinstance(data, list) else result
+
+
+"""
+Same as run_pipeline, but yields the (key, result) pair of every well as soon as it is finished.
+With multiple workers the wells are yielded in the order they finish.
+The results are also appended to the given results.ResultStore or the store at the given path, as soon as they are finished.
+The stages are recorded by the given profiling.Profiler, the records of the workers are merged into it.
+"""
+def iter_pipeline(data, mode: tuple = (), cellpose_model_path: str = "", epic_params: dict = {}, is_processed: bool = False, only_process: bool = False, refine: dict = None,
+                  initialize: dict = None, affine: dict = None, plate: dict = None, track: dict = None, cellpose_model=None, gpu: bool = None, batch_size: int = 8, workers: int = 1, cache=None, store=None, profiler=None):
+  profiler = get_profiler(profiler)
+  with profiler.stage("read"):
+    microscope_data, biosensor_data = __read_data(data)
 
+  yield from __iter_wells(microscope_data, biosensor_data, mode, cellpose_model_path, epic_params, is_processed, only_process, refine, initialize, affine, plate, track,
+                          cellpose_model, gpu, batch_size, workers, cache, __open_store(store), profiler)
 
-def run_pipeline(data, mode: tuple = (), cellpose_model_path: str = "", epic_params: dict = {}, is_processed: bool = False, only_process: bool = False):
+
+# Opens the result store of a path, see results.ResultStore.
+def __open_store(store):
+  if isinstance(store, str):
+    from results import ResultStore
+
+    return ResultStore(store)
+  return store
+
+
+# Reads the microscope and biosensor data of the wells from a reader, a dict or a single well list.
+def __read_data(data):
   microscope_data, biosensor_data = {}, {}
   if isinstance(data, Reader):
     microscope_data, biosensor_data = data.read_microscope_data(), data.read_biosensor_data()
@@ -10,32 +64,304 @@ def run_pipeline(data, mode: tuple = (), cellpose_model_path: str = "", epic_par
       microscope_data[key] = data[key][0]
       biosensor_data[key] = data[key][1]
   elif isinstance(data, list):
-    microscope_data["_"] = data[0],
+    microscope_data["_"] = data[0]
     biosensor_data["_"] = data[1]
 
-  result = {}
-  for key in microscope_data.keys():
-    if is_processed:
-      microscope_processed = microscope_data[key]
-      biosensor_processed = biosensor_data[key]
+  return microscope_data, biosensor_data
+
+
+# Segments the microscope images in batches, then processes and aligns the wells serially or in a process pool.
+def __iter_wells(microscope_data, biosensor_data, mode: tuple, cellpose_model_path: str, epic_params: dict, is_processed: bool, only_process: bool, refine: dict, initialize: dict,
+                 affine: dict, plate: dict, track: dict, cellpose_model, gpu: bool, batch_size: int, workers: int, cache, store, profiler):
+  from itertools import islice
+  from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+  from preprocessing import ProcessingCache, get_model_identity
+  from results import get_result_fields
+
+  if track is not None and is_processed:
+    raise ValueError("Tracking needs the biosensor recordings, not the processed biosensor data.")
+
+  # Loading the model once for all the wells when it is first needed, gpu is used if available when not specified.
+  def get_cellpose_model():
+    nonlocal cellpose_model
+    if cellpose_model is None:
+      from preprocessing import load_cellpose_model
+
+      with profiler.stage("load_model"):
+        cellpose_model = load_cellpose_model(cellpose_model_path, gpu)
+    return cellpose_model
+
+  if isinstance(cache, str):
+    cache = ProcessingCache(cache)
+  model_identity = get_model_identity(cellpose_model_path) if cellpose_model is None else str(getattr(cellpose_model, "pretrained_model", cellpose_model_path))
+
+  # Merges the profile of a finished well and appends its result to the store, returning the (key, result) pair.
+  result_fields = get_result_fields(only_process, affine is not None, track is not None, plate is not None)
+  if store is not None:
+    store.check_fields(result_fields)
+  def finish_well(key, result, well_profiler, wall_time: float):
+    profiler.merge(well_profiler)
+    if store is not None:
+      store.append(key, result, result_fields, wall_time=wall_time)
+    return key, result
+
+  # Processes the wells of the keys, the plate parameters are passed to every well.
+  def iter_keys(keys: list, well_plate: dict):
+    # Lazy readers decode the next images in the background while the current batch is processed.
+    if hasattr(microscope_data, "iter_items"):
+      microscope_items = microscope_data.iter_items(keys)
     else:
-      from cellpose import models
-      from preprocessing import process_microscope_data, process_biosensor_data
+      microscope_items = ((key, microscope_data[key]) for key in keys)
 
-      cellpose_model = models.CellposeModel(pretrained_model=cellpose_model_path, gpu=True)
-      microscope_processed = process_microscope_data(microscope_data[key], cellpose_model)
-      biosensor_processed = process_biosensor_data(biosensor_data[key], epic_params)
+    pending = set()
+    for start in range(0, len(keys), batch_size):
+      with profiler.stage("read_microscope"):
+        batch_keys, batch_data = zip(*islice(microscope_items, batch_size))
 
-    if only_process:
-      result[key] = (microscope_processed, biosensor_processed)
+      # Segmenting the microscope images of the batch together.
+      if is_processed:
+        microscope_batch = list(batch_data)
+      else:
+        microscope_batch = __process_microscope_batch(list(batch_data), get_cellpose_model, cache, model_identity, profiler)
+
+      for key, microscope_processed in zip(batch_keys, microscope_batch):
+        params = (key, microscope_processed, biosensor_data[key], mode, epic_params, is_processed, only_process, refine, initialize, affine, well_plate, track, seeds[key], cache)
+        if pool is None:
+          # The wells are seeded through the global random state of the methods, the state of the caller is restored after them.
+          random_state = np.random.get_state()
+          try:
+            processed_well = __process_well(*params, profiler)
+          finally:
+            np.random.set_state(random_state)
+          yield finish_well(*processed_well)
+          continue
+
+        # Limiting the number of wells waiting in the pool.
+        while len(pending) >= 2 * workers:
+          done, pending = wait(pending, return_when=FIRST_COMPLETED)
+          for future in done:
+            yield finish_well(*future.result())
+        pending.add(pool.submit(__process_well, *params, profiler.fork()))
+
+    while pending:
+      done, pending = wait(pending, return_when=FIRST_COMPLETED)
+      for future in done:
+        yield finish_well(*future.result())
+
+  # Every well gets its own seed from the global random state in key order, so the results are
+  # the same with any number of workers.
+  keys = list(microscope_data.keys())
+  seeds = dict(zip(keys, np.random.randint(0, 2**32, size=len(keys), dtype=np.int64)))
+
+  pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+  try:
+    if plate is None or only_process:
+      yield from iter_keys(keys, None)
     else:
-      from alignment import find_translation_stochastic, find_translation_pmc
-
-      if mode[0] == "stochastic":
-        translation = -find_translation_stochastic(microscope_processed[1], biosensor_processed[1], mode[1])
-      elif mode[0] == "pmc":
-        translation = -find_translation_pmc(microscope_processed[1], biosensor_processed[1], mode[1])
-      result[key] = (microscope_processed, biosensor_processed, translation)
-  
-  return result["_"] if isinstance(data, list) else result
+      yield from __iter_plate(iter_keys, keys, plate, profiler)
+  finally:
+    if pool is not None:
+      pool.shutdown(cancel_futures=True)
+
+
+# Aligns the wells of a plate, using the translation shared by the wells as a prior. The reference wells are aligned
+# with the full search until enough of them are reliable, their median translation is the prior. The other wells are
+# only searched in a window around the prior, falling back to the full search if the result has low support.
+# The plate dict may set n_reference wells aligned at once until the prior is found, the min_reference reliable wells
+# needed for it, the search_radius of the window, the min_support of a reliable well and the support_threshold distance
+# of its pairs, see alignment.get_translation_support.
+def __iter_plate(iter_keys, keys: list, plate: dict, profiler):
+  from alignment import estimate_translation_prior
+
+  n_reference = plate.get("n_reference", 4)
+  well_plate = {
+    "prior": None,
+    "search_radius": plate.get("search_radius", 20),
+    "min_support": plate.get("min_support", 0.3),
+    "support_threshold": plate.get("support_threshold", 3)
+  }
+
+  # Aligning the reference wells with the full search until the prior can be estimated.
+  translations, supports = [], []
+  start = 0
+  while start < len(keys) and well_plate["prior"] is None:
+    for key, result in iter_keys(keys[start:start + n_reference], well_plate):
+      translations.append(result[2])
+      supports.append(result[-1]["support"])
+      yield key, result
+    start += n_reference
+
+    prior, _ = estimate_translation_prior(translations, supports, well_plate["min_support"], plate.get("min_reference", 2))
+    well_plate = {**well_plate, "prior": prior}
+
+  if start < len(keys):
+    profiler.count("plate.prior_found" if well_plate["prior"] is not None else "plate.prior_missing")
+    yield from iter_keys(keys[start:], well_plate)
+
+
+# Segments the microscope images of a batch which are not cached yet.
+def __process_microscope_batch(mic_data: list, get_cellpose_model, cache, model_identity: str, profiler):
+  from preprocessing import process_microscope_data_batch
+
+  if cache is None:
+    return process_microscope_data_batch(mic_data, get_cellpose_model(), profiler)
+
+  with profiler.stage("cache_load"):
+    cache_keys = [cache.key("microscope", data, model_identity) for data in mic_data]
+    result = [cache.load(cache_key) for cache_key in cache_keys]
+
+  missing = [i for i in range(len(result)) if result[i] is None]
+  profiler.count("cache_hits", len(result) - len(missing))
+  profiler.count("cache_misses", len(missing))
+  if len(missing) > 0:
+    processed = process_microscope_data_batch([mic_data[i] for i in missing], get_cellpose_model(), profiler)
+    for i, microscope_processed in zip(missing, processed):
+      cache.save(cache_keys[i], microscope_processed)
+      result[i] = microscope_processed
+
+  return result
+
+
+# Processes the biosensor data of a well and aligns it to the processed microscope data.
+# The profile and the wall time of the well are returned too, as the workers can't record into the profiler of the pipeline.
+def __process_well(key, microscope_processed, biosensor_data, mode: tuple, epic_params: dict, is_processed: bool, only_process: bool, refine: dict, initialize: dict,
+                   affine: dict, plate: dict, track: dict, seed: int, cache, profiler):
+  start_time = time.perf_counter()
+  with profiler.well(key), profiler.stage("well"):
+    if is_processed:
+      biosensor_processed = biosensor_data
+    else:
+      biosensor_processed, window_points = __process_biosensor_well(biosensor_data, epic_params, track, cache, profiler)
+
+    if only_process:
+      return key, (microscope_processed, biosensor_processed), profiler, time.perf_counter() - start_time
+
+    np.random.seed(seed)
+    with profiler.stage("alignment"):
+      if plate is None:
+        translation = __find_translation(microscope_processed[1], biosensor_processed[1], mode, refine, initialize, None, profiler)
+      else:
+        translation, plate_result = __find_plate_translation(microscope_processed[1], biosensor_processed[1], mode, refine, initialize, plate, profiler)
+
+    result = (microscope_processed, biosensor_processed, translation)
+
+    # Refining the translation to an affine transformation of the biosensor points to the microscope points,
+    # with the given refine_affine parameters. It is stored after the translation.
+    if affine is not None:
+      from alignment import refine_affine
+
+      affine_transformation, _ = refine_affine(biosensor_processed[1], microscope_processed[1], translation, **affine, profiler=profiler)
+      result += (affine_transformation,)
+
+    # Tracking the translation over the windows of the biosensor recording, warm-started from the translation
+    # of the whole recording. The translations of the windows are stored after the affine transformation.
+    if track is not None:
+      result += (__track_well(microscope_processed[1], window_points, translation, track, profiler),)
+
+    # In plate mode, the last item is the plate alignment of the well.
+    if plate is not None:
+      result += (plate_result,)
+
+    return key, result, profiler, time.perf_counter() - start_time
+
+
+# Processes the biosensor recording of a well and with tracking the points of its windows, which share the drift correction.
+# The processed recording and the points of the windows are cached separately. The points of the windows are None without tracking.
+def __process_biosensor_well(biosensor_data, epic_params: dict, track: dict, cache, profiler):
+  from preprocessing import process_biosensor_data, process_biosensor_windows
+
+  window_params = {"window_size": track["window_size"], "step": track.get("step")} if track is not None else None
+  cache_keys = {}
+  if cache is not None:
+    cache_keys["biosensor"] = cache.key("biosensor", biosensor_data, epic_params)
+    if track is not None:
+      cache_keys["windows"] = cache.key("biosensor_windows", biosensor_data, {**epic_params, **window_params})
+
+  cached = {name: cache.load(key) for name, key in cache_keys.items()}
+  for arrays in cached.values():
+    profiler.count("cache_hits" if arrays is not None else "cache_misses")
+  biosensor_processed, window_points = cached.get("biosensor"), cached.get("windows")
+
+  if track is None and biosensor_processed is None:
+    biosensor_processed = process_biosensor_data(biosensor_data, epic_params, profiler)
+  elif track is not None and (biosensor_processed is None or window_points is None):
+    biosensor_processed, windows = process_biosensor_windows(biosensor_data, epic_params, **window_params, whole=True, profiler=profiler)
+    window_points = tuple(ptss for _, ptss, _ in windows)
+
+  if cache is not None:
+    for name, arrays in (("biosensor", biosensor_processed), ("windows", window_points)):
+      if name in cache_keys and cached[name] is None:
+        cache.save(cache_keys[name], arrays)
+
+  return biosensor_processed, window_points
+
+
+# Tracks the translation of the biosensor points of the windows of the recording to the microscope points.
+# The track dict holds the parameters of alignment.track_translation, besides the window_size and step of the windows.
+def __track_well(microscope_points, window_points: tuple, translation, track: dict, profiler):
+  from alignment import track_translation
+
+  track_params = {key: value for key, value in track.items() if key not in ("window_size", "step")}
+  translations, _ = track_translation(microscope_points, window_points, -translation, **track_params, profiler=profiler)
+  return -translations
+
+
+# Finds the translation of a well of a plate in the window around the prior, falling back to the full search
+# if the translation has low support. The well is an outlier if its translation is unreliable or not near the prior.
+def __find_plate_translation(microscope_points, biosensor_points, mode: tuple, refine: dict, initialize: dict, plate: dict, profiler):
+  from alignment import get_translation_support
+
+  def find_translation(window):
+    translation = __find_translation(microscope_points, biosensor_points, mode, refine, initialize, window, profiler)
+    return translation, get_translation_support(biosensor_points, microscope_points, translation, plate["support_threshold"])
+
+  prior, fallback = plate["prior"], False
+  if prior is None:
+    translation, support = find_translation(None)
+  else:
+    translation, support = find_translation((prior, plate["search_radius"]))
+    if support < plate["min_support"]:
+      profiler.count("plate.fallbacks")
+      translation, support, fallback = *find_translation(None), True
+
+  outlier = support < plate["min_support"] or (prior is not None and np.any(np.abs(translation - prior) > plate["search_radius"]))
+  if outlier:
+    profiler.count("plate.outliers")
+
+  return translation, {"support": support, "reference": prior is None, "fallback": fallback, "outlier": bool(outlier), "prior": prior}
+
+
+# Finds the translation of the biosensor points to the microscope points with the selected method.
+# The window is the (center, radius) of the searched translations of the biosensor points, which overrides initialize.
+def __find_translation(microscope_points, biosensor_points, mode: tuple, refine: dict, initialize: dict, window: tuple, profiler):
+  from alignment import find_translation_stochastic, find_translation_pmc, find_translation_voting, find_translation_fft, refine_translation
+
+  # The optional third item of the mode holds further parameters of the method, e.g. ("pmc", 3, {"time_budget": 10}).
+  options = dict(mode[2]) if len(mode) > 2 else {}
+
+  # Narrowing the search of the method to the neighbourhood of the translation found by the FFT method.
+  # The initialize dict holds the find_translation_fft parameters and the search_radius.
+  if window is not None:
+    options["search_center"], options["search_radius"] = -window[0], window[1]
+  elif initialize is not None:
+    fft_params = {key: value for key, value in initialize.items() if key != "search_radius"}
+    options["search_center"] = find_translation_fft(microscope_points, biosensor_points, **fft_params, profiler=profiler)[0]
+    options["search_radius"] = initialize.get("search_radius", 20)
+
+  if mode[0] == "stochastic":
+    translation = find_translation_stochastic(microscope_points, biosensor_points, mode[1], **options, profiler=profiler)[0]
+  elif mode[0] == "pmc":
+    translation = find_translation_pmc(microscope_points, biosensor_points, mode[1], **options, profiler=profiler)[0]
+  elif mode[0] == "voting":
+    translation = find_translation_voting(microscope_points, biosensor_points, mode[1], **options, profiler=profiler)[0]
+  elif mode[0] == "fft":
+    translation = find_translation_fft(microscope_points, biosensor_points, mode[1], **options, profiler=profiler)[0]
+  else:
+    raise ValueError(f"Unknown alignment mode: {mode[0]}")
+
+  # Refining the translation with the given refine_translation parameters.
+  if refine is not None:
+    translation, _ = refine_translation(microscope_points, biosensor_points, translation, **refine, profiler=profiler)
 
+  return -translation
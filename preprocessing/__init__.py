@@ -1,2 +1,4 @@
 from preprocessing.reader import *
-from preprocessing.process import *
\ No newline at end of file
+from preprocessing.process import *
+from preprocessing.cache import *
+from preprocessing.sweep import *
\ No newline at end of file
@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import shutil
+import uuid
+import hashlib
+import tempfile
+import numpy as np
+
+
+"""
+On-disk cache of processed microscope and biosensor data.
+Every entry is a directory of .npy files named by the hash of the raw data and the processing parameters,
+the arrays are loaded memory-mapped. The least recently used entries are removed above max_bytes.
+The temporary directories left by interrupted saves are removed once they are older than an hour.
+The pinned entries are not evicted while the pinning processes are running, see pin.
+
+:param path: directory of the cache entries.
+:param max_bytes: maximal total size of the entries.
+"""
+class ProcessingCache:
+  def __init__(self, path: str, max_bytes: int = 16 * 2**30):
+    self.path = path
+    self.max_bytes = max_bytes
+    os.makedirs(path, exist_ok=True)
+
+    # Removing the temporary directories of the saves which were interrupted, the recent ones may still be written.
+    for name in os.listdir(path):
+      temp_path = os.path.join(path, name)
+      try:
+        if name.startswith(".tmp-") and time.time() - os.stat(temp_path).st_mtime > 3600:
+          shutil.rmtree(temp_path, ignore_errors=True)
+      except FileNotFoundError:
+        continue
+
+  # Gets the key of an entry from the raw data and everything the processing depends on.
+  # Without raw data, e.g. when the params identify the raw files, only the params are hashed.
+  def key(self, kind: str, raw_data: np.ndarray, params) -> str:
+    digest = hashlib.sha256()
+    digest.update(kind.encode())
+    if raw_data is not None:
+      raw_data = np.ascontiguousarray(raw_data)
+      digest.update(f"{raw_data.dtype.str}{raw_data.shape}".encode())
+      digest.update(raw_data.data)
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+  # Loads the arrays of an entry as a tuple, or None if the entry is missing.
+  def load(self, key: str):
+    try:
+      paths = self.paths(key)
+      arrays = tuple(np.load(path, mmap_mode="r") for path in paths) if paths is not None else None
+    except FileNotFoundError:
+      return None
+
+    return arrays
+
+  # Gets the paths of the .npy files of an entry in order, or None if the entry is missing.
+  def paths(self, key: str):
+    entry_path = os.path.join(self.path, key)
+    try:
+      n_arrays = len([name for name in os.listdir(entry_path) if name.endswith(".npy")])
+      os.utime(entry_path)
+    except FileNotFoundError:
+      return None
+
+    return [os.path.join(entry_path, f"{i}.npy") for i in range(n_arrays)]
+
+  # Saves the arrays of an entry, then evicts the least recently used entries above the size limit.
+  def save(self, key: str, arrays: tuple):
+    # Writing into a temporary directory first, so readers never see a partial entry.
+    temp_path = tempfile.mkdtemp(dir=self.path, prefix=".tmp-")
+    for i, array in enumerate(arrays):
+      np.save(os.path.join(temp_path, f"{i}.npy"), np.asarray(array))
+
+    try:
+      os.rename(temp_path, os.path.join(self.path, key))
+    except OSError:
+      # The same entry was saved by another process meanwhile.
+      shutil.rmtree(temp_path, ignore_errors=True)
+
+    self.evict()
+
+  # Removes the least recently used entries until the total size fits in max_bytes.
+  def evict(self):
+    entries = []
+    for name in os.listdir(self.path):
+      entry_path = os.path.join(self.path, name)
+      if name.startswith(".") or not os.path.isdir(entry_path):
+        continue
+      try:
+        size = sum(entry.stat().st_size for entry in os.scandir(entry_path))
+        entries.append((os.stat(entry_path).st_mtime, size, entry_path))
+      except FileNotFoundError:
+        continue
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, entry_path in sorted(entries):
+      if total_size <= self.max_bytes:
+        break
+      if self.__is_pinned(entry_path):
+        continue
+      shutil.rmtree(entry_path, ignore_errors=True)
+      total_size -= size
+
+  # Protects an entry from the eviction while its files are used, e.g. by a mapping opening them on access. The pin is a file
+  # in the entry named by the process, so the other processes sharing the cache skip the entry too. Returns the pin for
+  # unpin, or None if the entry is missing.
+  def pin(self, key: str):
+    pin_path = os.path.join(self.path, key, f".pin-{os.getpid()}-{uuid.uuid4().hex}")
+    try:
+      open(pin_path, "x").close()
+    except FileNotFoundError:
+      return None
+    return pin_path
+
+  # Releases a pin of an entry, after which it may be evicted.
+  def unpin(self, pin: str):
+    try:
+      os.remove(pin)
+    except FileNotFoundError:
+      pass
+
+  # Checks whether an entry has a pin of a running process, the pins of the stopped processes are ignored.
+  def __is_pinned(self, entry_path: str):
+    for name in os.listdir(entry_path):
+      if not name.startswith(".pin-"):
+        continue
+      try:
+        os.kill(int(name.split("-")[1]), 0)
+        return True
+      except ProcessLookupError:
+        continue
+      except PermissionError:
+        return True
+    return False
+
+
+# Gets the identity of a cellpose model from its path, size and modification time.
+def get_model_identity(model_path: str):
+  if not model_path or not os.path.exists(model_path):
+    return str(model_path)
+
+  stat = os.stat(model_path)
+  return f"{os.path.abspath(model_path)}:{stat.st_size}:{stat.st_mtime_ns}"
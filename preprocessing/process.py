@@ -1,54 +1,172 @@
 import numpy as np
 import cv2
 
+from profiling import get_profiler
 
-def process_microscope_data(mic_data: np.ndarray, cellpose_model):
+
+def load_cellpose_model(pretrained_model: str, gpu: bool = None):
+  from cellpose import core, models
+
+  # Falling back to the cpu when no gpu is available.
+  if gpu is None:
+    gpu = core.use_gpu()
+
+  return models.CellposeModel(pretrained_model=pretrained_model, gpu=gpu)
+
+
+def process_microscope_data(mic_data: np.ndarray, cellpose_model, profiler=None):
   from utils import calculate_microscope_cell_centroids
 
-  mask, _, _ = cellpose_model.eval(mic_data, channels=[0, 0])
-  centroids = calculate_microscope_cell_centroids(mask)
+  profiler = get_profiler(profiler)
+  with profiler.stage("segmentation"):
+    mask, _, _ = cellpose_model.eval(mic_data, channels=[0, 0])
+  with profiler.stage("centroids"):
+    centroids = calculate_microscope_cell_centroids(mask)
   return (mic_data, centroids)
 
 
-def process_biosensor_data(well_data: np.ndarray, params: dict):
+def process_microscope_data_batch(mic_data: list, cellpose_model, profiler=None):
+  from utils import calculate_microscope_cell_centroids
+
+  # Segmenting the whole batch with a single model call.
+  profiler = get_profiler(profiler)
+  with profiler.stage("segmentation", batch_size=len(mic_data)):
+    masks, _, _ = cellpose_model.eval(list(mic_data), channels=[0, 0])
+  with profiler.stage("centroids", batch_size=len(mic_data)):
+    return [(data, calculate_microscope_cell_centroids(mask)) for data, mask in zip(mic_data, masks)]
+
+
+def process_biosensor_data(well_data: np.ndarray, params: dict, profiler=None):
+  profiler = get_profiler(profiler)
+
+  # Running the stages in order, preprocessing.sweep_biosensor_params memoises the same stages.
+  outputs = {"data": well_data}
+  for stage in BIOSENSOR_STAGES:
+    outputs[stage["name"]] = stage["function"](*[outputs[name] for name in stage["inputs"]], params, profiler)
+
+  return outputs[BIOSENSOR_STAGES[-1]["name"]]
+
+
+"""
+Processes the biosensor time series in windows of frames, e.g. to follow the drift of the stage over the recording.
+The drift correction runs once on the whole series, then the cells are localized in every window separately.
+:param well_data: the biosensor time series of the well.
+:param params: the same parameters as of process_biosensor_data.
+:param window_size: number of frames in a window.
+:param step: number of frames between the starts of the windows. Defaults to window_size, which gives disjoint windows.
+:param whole: if true, the whole series is processed too, like by process_biosensor_data, sharing the drift correction.
+:param profiler: profiling.Profiler recording the stages.
+:return: list of (processed_well, ptss, raw_well) tuples of the windows, like the result of process_biosensor_data.
+With whole, the result of the whole series and the list of the windows.
+"""
+def process_biosensor_windows(well_data: np.ndarray, params: dict, window_size: int, step: int = None, whole: bool = False, profiler=None):
+  profiler = get_profiler(profiler)
+  if step is None:
+    step = window_size
+
+  # The raw windows are cut from the frames kept by the drift correction.
+  raw_well = np.max(well_data, axis=0) if whole and len(well_data.shape) > 2 else well_data
+  raw_data = well_data[int(params['preprocessing_params']['range_lowerbound'] * len(well_data)):]
+  well_data = __correct_biosensor_data(well_data, params, profiler)
+
+  windows = []
+  for start in range(0, max(len(well_data) - window_size, 0) + 1, step):
+    with profiler.stage("window", start=start, window_size=window_size):
+      processed_well, ptss = __localize_biosensor_data(well_data[start:start + window_size], params, profiler)
+    windows.append((processed_well, ptss, np.max(raw_data[start:start + window_size], axis=0)))
+
+  if not whole:
+    return windows
+
+  processed_well, ptss = __localize_biosensor_data(well_data, params, profiler)
+  return (processed_well, ptss, raw_well), windows
+
+
+# Corrects the drift of the frames of the biosensor time series after the lower bound of the range.
+def __correct_biosensor_data(well_data: np.ndarray, params: dict, profiler):
   from nanobio_core.epic_cardio.data_correction import correct_well
-  from nanopyx.methods import SRRF
-  from nanobio_core.epic_cardio.math_ops import calculate_cell_maximas
-  from nanobio_core.image_fitting.cardio_mic import CardioMicFitter, CardioMicScaling
 
   slicer = slice(int(params['preprocessing_params']['range_lowerbound'] * len(well_data)), len(well_data))
 
-  # Extracting raw well data.
-  raw_well = well_data
-  if len(raw_well.shape) > 2:
-    raw_well = np.max(raw_well, axis=0)
-
   # Correcting well
-  well_data, _, _ = correct_well(
-    well_data[slicer], coords=[], 
-    threshold=params['preprocessing_params']['drift_correction']['threshold'], 
-    mode=params['preprocessing_params']['drift_correction']['filter_method'])
-  
-  # Magnification if needed
+  with profiler.stage("drift_correction"):
+    well_data, _, _ = correct_well(
+      well_data[slicer], coords=[], 
+      threshold=params['preprocessing_params']['drift_correction']['threshold'], 
+      mode=params['preprocessing_params']['drift_correction']['filter_method'])
+
+  return well_data
+
+
+# Localizes the cells in the corrected biosensor frames, returning the scaled image and the scaled cell coordinates.
+def __localize_biosensor_data(well_data: np.ndarray, params: dict, profiler):
+  well_data = __magnify_biosensor_data(well_data, params, profiler)
+  ptss = __find_biosensor_cells(well_data, params, profiler)
+  return __scale_biosensor_data(well_data, ptss, params, profiler)
+
+
+# Magnifies the corrected biosensor frames with SRRF if needed.
+def __magnify_biosensor_data(well_data: np.ndarray, params: dict, profiler):
+  from nanopyx.methods import SRRF
+
   magnification = params["preprocessing_params"]["magnification"]
   if magnification > 1:
-    well_data = SRRF(well_data, magnification, 0.5)[0]
-  
-  # Localization
-  ptss = calculate_cell_maximas(
-    well_data,
-    min_threshold=params['localization_params']['threshold_range'][0],
-    max_threshold=params['localization_params']['threshold_range'][1],
-    neighborhood_size=params['localization_params']['neighbourhood_size'],
-    error_mask=None)
-  
-  # Scaling
-  size, _ = CardioMicFitter._get_scale(getattr(CardioMicScaling, params["preprocessing_params"]["scaling"]))
-  processed_well = well_data
-  if len(processed_well.shape) > 2:
-    processed_well = np.max(processed_well, axis=0)
-  processed_well = cv2.resize(processed_well, (size, size), interpolation=cv2.INTER_NEAREST)
-  ptss = ptss * size / 80 / magnification
-
-  return (processed_well, ptss, raw_well)
+    with profiler.stage("srrf"):
+      well_data = SRRF(well_data, magnification, 0.5)[0]
+  return well_data
+
+
+# Finds the cell maximas in the magnified biosensor frames.
+def __find_biosensor_cells(well_data: np.ndarray, params: dict, profiler):
+  from nanobio_core.epic_cardio.math_ops import calculate_cell_maximas
+
+  with profiler.stage("localization"):
+    ptss = calculate_cell_maximas(
+      well_data,
+      min_threshold=params['localization_params']['threshold_range'][0],
+      max_threshold=params['localization_params']['threshold_range'][1],
+      neighborhood_size=params['localization_params']['neighbourhood_size'],
+      error_mask=None)
+  profiler.count("biosensor_points", len(ptss))
+  return ptss
+
+
+# Scales the maximum projection of the magnified frames and the cell coordinates to the size of the microscope images.
+def __scale_biosensor_data(well_data: np.ndarray, ptss: np.ndarray, params: dict, profiler):
+  from nanobio_core.image_fitting.cardio_mic import CardioMicFitter, CardioMicScaling
+
+  magnification = params["preprocessing_params"]["magnification"]
+  with profiler.stage("scaling"):
+    size, _ = CardioMicFitter._get_scale(getattr(CardioMicScaling, params["preprocessing_params"]["scaling"]))
+    processed_well = well_data
+    if len(processed_well.shape) > 2:
+      processed_well = np.max(processed_well, axis=0)
+    processed_well = cv2.resize(processed_well, (size, size), interpolation=cv2.INTER_NEAREST)
+    ptss = ptss * size / 80 / magnification
+
+  return processed_well, ptss
+
+
+# Extracts the raw well data as the maximum projection of the time series.
+def __project_raw_data(well_data: np.ndarray, params: dict, profiler):
+  return np.max(well_data, axis=0) if len(well_data.shape) > 2 else well_data
+
+
+# Joins the outputs of the stages to the (processed_well, ptss, raw_well) result.
+def __join_biosensor_result(scaled: tuple, raw_well: np.ndarray, params: dict, profiler):
+  return (*scaled, raw_well)
+
 
+# Stages of process_biosensor_data. Every stage gets the outputs of its input stages, "data" being the raw time series,
+# and only depends on the parameters at its dot-separated paths of the params, see preprocessing.StageGraph.
+BIOSENSOR_STAGES = [
+  {"name": "raw", "inputs": ["data"], "params": [], "function": __project_raw_data},
+  {"name": "drift_correction", "inputs": ["data"], "params": ["preprocessing_params.range_lowerbound", "preprocessing_params.drift_correction"],
+   "function": __correct_biosensor_data},
+  {"name": "srrf", "inputs": ["drift_correction"], "params": ["preprocessing_params.magnification"], "function": __magnify_biosensor_data},
+  {"name": "localization", "inputs": ["srrf"], "params": ["localization_params.threshold_range", "localization_params.neighbourhood_size"],
+   "function": __find_biosensor_cells},
+  {"name": "scaling", "inputs": ["srrf", "localization"], "params": ["preprocessing_params.scaling", "preprocessing_params.magnification"],
+   "function": __scale_biosensor_data},
+  {"name": "result", "inputs": ["scaling", "raw"], "params": [], "function": __join_biosensor_result}
+]
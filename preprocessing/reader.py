@@ -1,7 +1,10 @@
 import os
 import cv2
 import glob
+import numpy as np
 from abc import ABC, abstractmethod
+from collections import deque
+from collections.abc import Mapping
 
 
 class Reader(ABC):
@@ -14,27 +17,144 @@ class Reader(ABC):
     pass
 
 
+"""
+Reads the microscope images and the biosensor wells of a measurement.
+
+In lazy mode with a cache, the biosensor wells are converted once into an entry of the cache, keyed by the paths, sizes and
+modification times of the raw files and the flipping, and are memory-mapped from it afterwards. The conversion itself still
+loads the whole dataset with load_data of nanobio_core, as the format of the raw files is only read by it, so only the
+later reads have a flat memory footprint. Without a cache the wells are loaded in memory.
+
+:param base_path: measurement folder containing the img_data and epic_data folders.
+:param flip_epic: flipping of the biosensor data.
+:param lazy: if true, the data is returned as mappings which read the wells on access.
+:param workers: number of threads decoding the images.
+:param prefetch: maximal number of images decoded ahead while iterating.
+:param cache: preprocessing.ProcessingCache or its directory, holding the converted biosensor wells in lazy mode.
+"""
 class NanoReader(Reader):
-  def __init__(self, base_path: str, flip_epic: list[bool]):
+  def __init__(self, base_path: str, flip_epic: list[bool], lazy: bool = False, workers: int = 4, prefetch: int = 8, cache=None):
+    from preprocessing.cache import ProcessingCache
+
     self.base_path = base_path
     self.flip_epic = flip_epic
+    self.lazy = lazy
+    self.workers = workers
+    self.prefetch = prefetch
+    self.cache = ProcessingCache(cache) if isinstance(cache, str) else cache
 
   def read_microscope_data(self):
     folder_path = os.path.join(self.base_path, "img_data")
     img_paths = glob.glob(os.path.join(folder_path, "*.jpeg"))
 
-    result = {}
-    for path in img_paths:
-      name = os.path.splitext(os.path.basename(path))[0]
-      data = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
-      result[name] = data
-    
-    return result
-  
+    images = ImageMapping({os.path.splitext(os.path.basename(path))[0]: path for path in img_paths}, self.workers, self.prefetch)
+    if self.lazy:
+      return images
+
+    return dict(images.iter_items())
+
   def read_biosensor_data(self):
     from nanobio_core.epic_cardio.processing import load_data
 
     folder_path = os.path.join(self.base_path, "epic_data")
-    raw_wells, _, _ = load_data(folder_path, flip=self.flip_epic)
-    return raw_wells
+    if not self.lazy or self.cache is None:
+      raw_wells, _, _ = load_data(folder_path, flip=self.flip_epic)
+      return raw_wells
+
+    # The first item of the entry is the array of the well keys, the wells follow in the same order.
+    # The entry is pinned while the mapping is used, so the saves of the processed data don't evict it.
+    cache_key = self.cache.key("biosensor_wells", None, {"files": self.__get_files_identity(folder_path), "flip": [bool(flip) for flip in self.flip_epic]})
+    pin = self.cache.pin(cache_key)
+    if pin is None:
+      raw_wells, _, _ = load_data(folder_path, flip=self.flip_epic)
+      self.cache.save(cache_key, (np.array(list(raw_wells.keys())), *[np.asarray(well) for well in raw_wells.values()]))
+      pin = self.cache.pin(cache_key)
+
+      # The wells which don't fit in the cache are kept in memory.
+      if pin is None:
+        return raw_wells
+      del raw_wells
+
+    paths = self.cache.paths(cache_key)
+    keys = np.load(paths[0]).tolist()
+    return WellMapping(dict(zip(keys, paths[1:])), self.cache, pin)
+
+  # Gets the relative paths, sizes and modification times of the raw files, which change with the raw data. Hidden folders are skipped.
+  def __get_files_identity(self, folder_path: str):
+    identity = []
+    for root, folders, names in os.walk(folder_path):
+      folders[:] = [folder for folder in folders if not folder.startswith(".")]
+      for name in names:
+        stat = os.stat(os.path.join(root, name))
+        identity.append([os.path.relpath(os.path.join(root, name), folder_path), stat.st_size, stat.st_mtime_ns])
+    return sorted(identity)
+
+
+"""
+Read-only mapping of well keys to grayscale images, which are decoded when accessed.
+Iterating with iter_items decodes the images in a thread pool with bounded read-ahead.
+"""
+class ImageMapping(Mapping):
+  def __init__(self, paths: dict, workers: int = 4, prefetch: int = 8):
+    self.paths = paths
+    self.workers = workers
+    self.prefetch = prefetch
+
+  def __getitem__(self, key):
+    return cv2.imread(self.paths[key], cv2.IMREAD_GRAYSCALE)
+
+  def __iter__(self):
+    return iter(self.paths)
+
+  def __len__(self):
+    return len(self.paths)
+
+  # Yields the (key, image) pairs in key order, while the next images are decoded in the background.
+  def iter_items(self, keys=None):
+    from concurrent.futures import ThreadPoolExecutor
+
+    keys = iter(self.paths if keys is None else keys)
+    with ThreadPoolExecutor(max_workers=self.workers) as executor:
+      pending = deque()
+      for key in keys:
+        pending.append((key, executor.submit(self.__getitem__, key)))
+        if len(pending) > self.prefetch:
+          key, future = pending.popleft()
+          yield key, future.result()
+
+      while pending:
+        key, future = pending.popleft()
+        yield key, future.result()
+
+
+"""
+Read-only mapping of well keys to memory-mapped biosensor data stored as .npy files.
+The files of a pinned cache entry are released when the mapping is closed or garbage collected.
+
+:param paths: the .npy files of the wells.
+:param cache: preprocessing.ProcessingCache holding the files.
+:param pin: pin of the cache entry of the files, see ProcessingCache.pin.
+"""
+class WellMapping(Mapping):
+  def __init__(self, paths: dict, cache=None, pin: str = None):
+    self.paths = paths
+    self.cache = cache
+    self.pin = pin
+
+  # Releases the pin of the cache entry, after which the files may be evicted.
+  def close(self):
+    if self.pin is not None:
+      self.cache.unpin(self.pin)
+      self.pin = None
+
+  def __del__(self):
+    self.close()
+
+  def __getitem__(self, key):
+    return np.load(self.paths[key], mmap_mode="r")
+
+  def __iter__(self):
+    return iter(self.paths)
 
+  def __len__(self):
+    return len(self.paths)
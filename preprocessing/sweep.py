@@ -0,0 +1,131 @@
+import json
+import copy
+import hashlib
+import itertools
+import numpy as np
+
+from preprocessing.process import BIOSENSOR_STAGES
+from profiling import get_profiler
+
+
+"""
+Dependency graph of processing stages, which memoises the output of every stage by the outputs of its inputs and the values
+of the parameters it depends on. Running the graph again with changed parameters only runs the stages depending on them.
+The input data is identified by the hash of its content, which is computed once for every input array, so the array
+shouldn't be modified in place between the runs.
+Only the last output of every stage is kept, so the runs should change the parameters of the later stages first, see
+sweep_biosensor_params.
+
+:param stages: the stages in topological order, dicts of the "name", the "inputs" stage names, the "params" paths and the
+"function" called with the outputs of the inputs, the parameters and the profiler. The output of the last stage is the result.
+"""
+class StageGraph:
+  def __init__(self, stages: list = BIOSENSOR_STAGES):
+    self.stages = stages
+    self.outputs = {}
+    self.data_key = (None, None)
+
+  # Runs the stages on the data with the parameters, returning the result and the names of the stages which were run.
+  def run(self, data, params: dict, profiler=None):
+    profiler = get_profiler(profiler)
+    keys, outputs, run_stages = {"data": self.__get_data_key(data)}, {"data": data}, []
+
+    for stage in self.stages:
+      values = [self.__get_param(params, path) for path in stage["params"]]
+      keys[stage["name"]] = json.dumps([[keys[name] for name in stage["inputs"]], stage["name"], values], sort_keys=True, default=str)
+
+      memoised = self.outputs.get(stage["name"])
+      if memoised is not None and memoised[0] == keys[stage["name"]]:
+        profiler.count("sweep.stage_hits")
+      else:
+        memoised = (keys[stage["name"]], stage["function"](*[outputs[name] for name in stage["inputs"]], params, profiler))
+        self.outputs[stage["name"]] = memoised
+        run_stages.append(stage["name"])
+        profiler.count("sweep.stage_runs")
+      outputs[stage["name"]] = memoised[1]
+
+    return outputs[self.stages[-1]["name"]], run_stages
+
+  # Gets the index of the first stage depending on the parameter path, or the number of stages if none does.
+  def stage_index(self, path: str):
+    for i, stage in enumerate(self.stages):
+      if any(self.__is_related(path, stage_path) for stage_path in stage["params"]):
+        return i
+    return len(self.stages)
+
+  # Gets the hash of the content of the data, reusing the hash of the previous run for the same array.
+  def __get_data_key(self, data):
+    if self.data_key[0] is not data:
+      data_array = np.ascontiguousarray(data)
+      digest = hashlib.sha256()
+      digest.update(f"{data_array.dtype.str}{data_array.shape}".encode())
+      digest.update(data_array.data)
+      self.data_key = (data, digest.hexdigest())
+    return self.data_key[1]
+
+  # Checks whether one of the paths contains the other.
+  def __is_related(self, path: str, other_path: str):
+    return path == other_path or path.startswith(other_path + ".") or other_path.startswith(path + ".")
+
+  # Gets the parameter at a dot-separated path.
+  def __get_param(self, params: dict, path: str):
+    for name in path.split("."):
+      params = params[name]
+    return params
+
+
+"""
+Sweeps a grid of biosensor processing parameters on a well, only running the stages of process_biosensor_data which depend on
+the changed parameters, e.g. the drift correction and the SRRF magnification are not repeated for the localization thresholds.
+The grid is run with the parameters of the earlier stages changing the slowest, so every stage runs once for each distinct
+combination of the parameters it depends on. Every setting is aligned to the microscope points with the given method.
+
+:param well_data: the biosensor time series of the well.
+:param params: the base parameters of process_biosensor_data.
+:param grid: dict of the dot-separated parameter paths to the lists of their values, e.g. {"localization_params.neighbourhood_size": [3, 5]}.
+:param microscope_points: the cell centroids of the microscope image of the well, None only processes the settings.
+:param mode: the alignment method of run_pipeline, e.g. ("voting", 1).
+:param refine: the refine_translation parameters of run_pipeline.
+:param support_threshold: pairing threshold of the support of the translations, see alignment.get_translation_support.
+:param stages: the stages of the processing, see StageGraph.
+:param profiler: profiling.Profiler recording the stages and the number of the run and reused stages.
+:return: list of dicts of every setting, with the "params" of the grid, the "stages" which were run, the biosensor "points",
+the "translation" of the biosensor points to the microscope points and its "support". The last two are None without microscope points.
+"""
+def sweep_biosensor_params(well_data: np.ndarray, params: dict, grid: dict, microscope_points: np.ndarray = None, mode: tuple = ("voting", 1),
+                           refine: dict = None, support_threshold: float = 3, stages: list = BIOSENSOR_STAGES, profiler=None):
+  from pipeline import run_pipeline
+  from alignment import get_translation_support
+
+  profiler = get_profiler(profiler)
+  graph = StageGraph(stages)
+  paths = sorted(grid, key=graph.stage_index)
+
+  settings = []
+  for values in itertools.product(*[grid[path] for path in paths]):
+    setting_params = copy.deepcopy(params)
+    for path, value in zip(paths, values):
+      __set_param(setting_params, path, value)
+
+    with profiler.stage("sweep", **{path: str(value) for path, value in zip(paths, values)}):
+      biosensor_processed, run_stages = graph.run(well_data, setting_params, profiler)
+      setting = {"params": dict(zip(paths, values)), "stages": run_stages, "points": biosensor_processed[1], "translation": None, "support": None}
+
+      # Aligning like the pipeline, the settings without points have no support.
+      if microscope_points is not None and len(biosensor_processed[1]) > 0:
+        data = {"sweep": ((None, microscope_points), biosensor_processed)}
+        setting["translation"] = run_pipeline(data, mode, is_processed=True, refine=refine, profiler=profiler)["sweep"][2]
+        setting["support"] = get_translation_support(biosensor_processed[1], microscope_points, setting["translation"], support_threshold)
+      elif microscope_points is not None:
+        setting["support"] = 0.0
+    settings.append(setting)
+
+  return settings
+
+
+# Sets the parameter at a dot-separated path.
+def __set_param(params: dict, path: str, value):
+  names = path.split(".")
+  for name in names[:-1]:
+    params = params[name]
+  params[names[-1]] = value
@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+
+"""
+Records the wall time, cpu time and optionally the peak memory of the stages of the pipeline per well,
+along with algorithm counters. The stages can be nested, the times of the inner stages are included in the outer ones.
+
+:param memory: if true, the peak memory of the stages is traced with tracemalloc, which slows down the allocations.
+The tracing is started by the outermost stage and stopped when it ends, unless it was already running.
+"""
+class Profiler:
+  enabled = True
+
+  def __init__(self, memory: bool = False):
+    self.memory = memory
+    self.records = []
+    self.counters = {}
+    self.current_well = None
+    self.stack = []
+    self.tracing = False
+
+    # Offset of the performance counter to the wall clock, the traces of the processes are aligned by it.
+    self.origin = time.time() - time.perf_counter()
+
+  # Attributes the stages and counters inside to a well.
+  @contextmanager
+  def well(self, key):
+    previous_well, self.current_well = self.current_well, key
+    try:
+      yield
+    finally:
+      self.current_well = previous_well
+
+  # Measures a stage, the keyword arguments are stored along with it.
+  @contextmanager
+  def stage(self, name: str, **args):
+    if self.memory and not tracemalloc.is_tracing():
+      tracemalloc.start()
+      self.tracing = True
+
+    # The peak of the outer stage is saved before the peak is reset for this one.
+    frame = {"start_memory": 0, "peak_memory": 0}
+    if self.memory:
+      current_memory, peak_memory = tracemalloc.get_traced_memory()
+      if len(self.stack) > 0:
+        self.stack[-1]["peak_memory"] = max(self.stack[-1]["peak_memory"], peak_memory)
+      tracemalloc.reset_peak()
+      frame = {"start_memory": current_memory, "peak_memory": current_memory}
+    self.stack.append(frame)
+
+    start_time, start_cpu_time = time.perf_counter(), time.process_time()
+    try:
+      yield
+    finally:
+      end_time, end_cpu_time = time.perf_counter(), time.process_time()
+
+      self.stack.pop()
+      if self.memory:
+        frame["peak_memory"] = max(frame["peak_memory"], tracemalloc.get_traced_memory()[1])
+        if len(self.stack) > 0:
+          self.stack[-1]["peak_memory"] = max(self.stack[-1]["peak_memory"], frame["peak_memory"])
+        elif self.tracing:
+          tracemalloc.stop()
+          self.tracing = False
+
+      self.records.append({
+        "well": self.current_well,
+        "stage": name,
+        "start": self.origin + start_time,
+        "wall_time": end_time - start_time,
+        "cpu_time": end_cpu_time - start_cpu_time,
+        "peak_memory": frame["peak_memory"] - frame["start_memory"] if self.memory else None,
+        "pid": os.getpid(),
+        "tid": threading.get_ident(),
+        "args": args
+      })
+
+  # Adds a value to a counter of the current well.
+  def count(self, name: str, value: int = 1):
+    key = (self.current_well, name)
+    self.counters[key] = self.counters.get(key, 0) + value
+
+  # Creates an empty profiler with the same settings, e.g. for a worker process.
+  def fork(self):
+    return Profiler(self.memory)
+
+  # Adds the records and counters of another profiler.
+  def merge(self, other):
+    if other is self or not other.enabled:
+      return
+
+    self.records.extend(other.records)
+    for key, value in other.counters.items():
+      self.counters[key] = self.counters.get(key, 0) + value
+
+  # Summarizes the stages and counters per well and in total. The wells are keyed by their keys,
+  # the stages outside of any well, like the batched segmentation, are under None.
+  def report(self):
+    wells, total = {}, {"stages": {}, "counters": {}}
+
+    for record in self.records:
+      well = wells.setdefault(record["well"], {"stages": {}, "counters": {}})
+      for summary in (well, total):
+        stage = summary["stages"].setdefault(record["stage"], {"calls": 0, "wall_time": 0.0, "cpu_time": 0.0, "peak_memory": None})
+        stage["calls"] += 1
+        stage["wall_time"] += record["wall_time"]
+        stage["cpu_time"] += record["cpu_time"]
+        if record["peak_memory"] is not None:
+          stage["peak_memory"] = max(stage["peak_memory"] or 0, record["peak_memory"])
+
+    for (key, name), value in self.counters.items():
+      well = wells.setdefault(key, {"stages": {}, "counters": {}})
+      for summary in (well, total):
+        summary["counters"][name] = summary["counters"].get(name, 0) + value
+
+    return {"wells": wells, "total": total}
+
+  # Formats the total of the stages and counters as a table.
+  def summary(self):
+    total = self.report()["total"]
+
+    lines = [f"{'stage':<32}{'calls':>8}{'wall [s]':>12}{'cpu [s]':>12}{'peak [MiB]':>12}"]
+    for name, stage in sorted(total["stages"].items(), key=lambda item: -item[1]["wall_time"]):
+      peak_memory = f"{stage['peak_memory'] / 2**20:.1f}" if stage["peak_memory"] is not None else "-"
+      lines.append(f"{name:<32}{stage['calls']:>8}{stage['wall_time']:>12.4f}{stage['cpu_time']:>12.4f}{peak_memory:>12}")
+    for name, value in sorted(total["counters"].items()):
+      lines.append(f"{name:<32}{value:>8}")
+
+    return "\n".join(lines)
+
+  # Saves the stages as Chrome trace events, which can be opened in chrome://tracing or Perfetto.
+  # The counters of a well are added to the arguments of its "well" stage.
+  def save_chrome_trace(self, path: str):
+    well_counters = {}
+    for (key, name), value in self.counters.items():
+      well_counters.setdefault(key, {})[name] = value
+
+    events = []
+    for record in self.records:
+      args = {"well": str(record["well"]), "cpu_time": record["cpu_time"], **{key: str(value) for key, value in record["args"].items()}}
+      if record["peak_memory"] is not None:
+        args["peak_memory"] = record["peak_memory"]
+      if record["stage"] == "well":
+        args.update(well_counters.get(record["well"], {}))
+
+      events.append({
+        "name": record["stage"],
+        "cat": "stage",
+        "ph": "X",
+        "ts": record["start"] * 1e6,
+        "dur": record["wall_time"] * 1e6,
+        "pid": record["pid"],
+        "tid": record["tid"],
+        "args": args
+      })
+
+    with open(path, "w") as file:
+      json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+
+"""
+Profiler which records nothing, used when profiling is disabled.
+"""
+class NullProfiler:
+  enabled = False
+
+  def __init__(self):
+    self.context = nullcontext()
+
+  def well(self, key):
+    return self.context
+
+  def stage(self, name: str, **args):
+    return self.context
+
+  def count(self, name: str, value: int = 1):
+    pass
+
+  def fork(self):
+    return self
+
+  def merge(self, other):
+    pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+# Gets the given profiler, or the null profiler if profiling is disabled.
+def get_profiler(profiler=None):
+  return NULL_PROFILER if profiler is None else profiler
@@ -0,0 +1,210 @@
+import os
+import copy
+import json
+import shutil
+import tempfile
+import numpy as np
+from collections.abc import Mapping
+
+
+# Columns of the table of the wells, the missing values are nan for floats and 0 for flags.
+COLUMNS = {
+  "translation_x": np.float64,
+  "translation_y": np.float64,
+  "n_microscope_points": np.int64,
+  "n_biosensor_points": np.int64,
+  "wall_time": np.float64,
+  "support": np.float64,
+  "outlier": np.uint8,
+  "fallback": np.uint8,
+  "reference": np.uint8
+}
+
+
+"""
+Persistent store of the results of the pipeline, which is appended to while the pipeline runs and can be read
+well by well without loading the whole run. The per-well values are stored in a columnar table, one append-only
+binary file per column, and the arrays of every well, like the images and the point sets, as .npy files in the
+directory of the well, which are loaded memory-mapped.
+
+The store is a read-only mapping of the well keys to the result tuples of run_pipeline, so it can be passed to
+visuals.show_alignment_result instead of the result dict. A well appended again under the same key replaces the
+earlier one in the mapping and in the table, keeping the position of the key, and its files are removed. The wells are
+ordered by the first append of their keys, see select for the wells of a run in the order of its input. All the wells of a
+store have the same fields, which are saved with the first append. The rows are only counted once their key is written, which is the last step of the
+append, so the store is consistent after an interrupted append.
+
+:param path: directory of the store, created if it doesn't exist.
+"""
+class ResultStore(Mapping):
+  def __init__(self, path: str):
+    self.path = path
+    os.makedirs(os.path.join(path, "wells"), exist_ok=True)
+    os.makedirs(os.path.join(path, "columns"), exist_ok=True)
+
+    self.row_keys = []
+    if os.path.exists(self.__keys_path()):
+      with open(self.__keys_path(), "r") as file:
+        self.row_keys = [json.loads(line) for line in file if line.endswith("\n")]
+    self.rows = {key: row for row, key in enumerate(self.row_keys)}
+
+    self.fields = None
+    if os.path.exists(self.__fields_path()):
+      with open(self.__fields_path(), "r") as file:
+        self.fields = json.load(file)
+
+    # Dropping the values of an interrupted append.
+    for name, dtype in COLUMNS.items():
+      column_path = self.__column_path(name)
+      if os.path.exists(column_path) and os.path.getsize(column_path) > len(self.row_keys) * np.dtype(dtype).itemsize:
+        os.truncate(column_path, len(self.row_keys) * np.dtype(dtype).itemsize)
+
+  # Appends the result of a well. The fields are the names of the items of the result tuple, see get_result_fields.
+  # Further column values, like the wall_time, are given as keyword arguments.
+  def append(self, key, result: tuple, fields: list, **columns):
+    self.check_fields(fields)
+    if self.fields is None:
+      with open(self.__fields_path(), "w") as file:
+        json.dump(list(fields), file)
+      self.fields = list(fields)
+
+    key = self.__to_key(key)
+    row = len(self.row_keys)
+    replaced_row = self.rows.get(key)
+    well = dict(zip(fields, result))
+
+    # Writing the arrays into a temporary directory first, so readers never see a partial well.
+    temp_path = tempfile.mkdtemp(dir=os.path.join(self.path, "wells"), prefix=".tmp-")
+    info = {"fields": {}}
+    for field, value in well.items():
+      if isinstance(value, dict):
+        info["fields"][field] = "dict"
+        info[field] = value
+      elif isinstance(value, tuple):
+        info["fields"][field] = [item is not None for item in value]
+        for i, item in enumerate(value):
+          if item is not None:
+            np.save(os.path.join(temp_path, f"{field}_{i}.npy"), np.asarray(item))
+      else:
+        info["fields"][field] = "array"
+        np.save(os.path.join(temp_path, f"{field}.npy"), np.asarray(value))
+    with open(os.path.join(temp_path, "well.json"), "w") as file:
+      json.dump(info, file, default=self.__to_json)
+    well_path = os.path.join(self.path, "wells", str(row))
+    shutil.rmtree(well_path, ignore_errors=True)
+    os.rename(temp_path, well_path)
+
+    values = {name: self.__get_column_value(name, well, columns) for name in COLUMNS}
+    for name, dtype in COLUMNS.items():
+      with open(self.__column_path(name), "ab") as file:
+        file.write(np.array([values[name]], dtype=dtype).tobytes())
+
+    with open(self.__keys_path(), "a") as file:
+      file.write(json.dumps(key) + "\n")
+    self.row_keys.append(key)
+    self.rows[key] = row
+
+    # The files of the replaced well are only removed once the new well is reachable by its key.
+    if replaced_row is not None:
+      shutil.rmtree(os.path.join(self.path, "wells", str(replaced_row)), ignore_errors=True)
+
+  # Raises a ValueError if the fields differ from the fields of the wells already in the store, see get_result_fields.
+  def check_fields(self, fields: list):
+    if self.fields is not None and list(fields) != self.fields:
+      raise ValueError(f"The results with the fields {list(fields)} can't be appended to the store {self.path} of the fields {self.fields}.")
+
+  # Gets a read-only view of the store limited to the wells of the keys, in their order, e.g. the wells of a run.
+  # The keys which are not in the store are skipped.
+  def select(self, keys):
+    view = copy.copy(self)
+    view.rows = {key: self.rows[key] for key in map(self.__to_key, keys) if key in self.rows}
+    return view
+
+  # Gets a column of the table with the latest row of every key, in the order of the mapping. It is memory-mapped,
+  # unless some rows are replaced, then the latest rows are copied.
+  def column(self, name: str):
+    if len(self.row_keys) == 0:
+      return np.zeros(0, dtype=COLUMNS[name])
+
+    column = np.memmap(self.__column_path(name), dtype=COLUMNS[name], mode="r", shape=(len(self.row_keys),))
+    if len(self.rows) < len(self.row_keys):
+      return column[list(self.rows.values())]
+    return column
+
+  # Gets the whole table as a dict of columns, with the keys of the rows.
+  def table(self):
+    return {"key": list(self.rows), **{name: self.column(name) for name in COLUMNS}}
+
+  # Loads the fields of a well as a dict, the arrays are memory-mapped.
+  def load_well(self, key):
+    well_path = os.path.join(self.path, "wells", str(self.rows[key]))
+    with open(os.path.join(well_path, "well.json"), "r") as file:
+      info = json.load(file)
+
+    well = {}
+    for field, kind in info["fields"].items():
+      if kind == "dict":
+        well[field] = info[field]
+      elif kind == "array":
+        well[field] = np.load(os.path.join(well_path, f"{field}.npy"), mmap_mode="r")
+      else:
+        well[field] = tuple(np.load(os.path.join(well_path, f"{field}_{i}.npy"), mmap_mode="r") if saved else None for i, saved in enumerate(kind))
+
+    return well
+
+  def __getitem__(self, key):
+    return tuple(self.load_well(key).values())
+
+  def __iter__(self):
+    return iter(self.rows)
+
+  def __len__(self):
+    return len(self.rows)
+
+  # Gets the value of a column from the fields of a well or from the given column values.
+  def __get_column_value(self, name: str, well: dict, columns: dict):
+    if name in columns:
+      return columns[name]
+
+    translation, plate = well.get("translation"), well.get("plate", {})
+    if name in ("translation_x", "translation_y"):
+      return translation[0 if name == "translation_x" else 1] if translation is not None else np.nan
+    if name in ("n_microscope_points", "n_biosensor_points"):
+      processed = well["microscope" if name == "n_microscope_points" else "biosensor"]
+      return len(processed[1]) if processed[1] is not None else 0
+    if name in ("outlier", "fallback", "reference"):
+      return bool(plate.get(name, False))
+    if name == "support":
+      return plate.get("support", np.nan)
+    return np.nan
+
+  # Converts a well key to the type stored in the keys file.
+  def __to_key(self, key):
+    return key if isinstance(key, (str, int)) else str(key)
+
+  # Converts the numpy values of the plate dict to json.
+  def __to_json(self, value):
+    if isinstance(value, np.ndarray):
+      return value.tolist()
+    if isinstance(value, np.generic):
+      return value.item()
+    raise TypeError(f"Unsupported type: {type(value)}")
+
+  def __keys_path(self):
+    return os.path.join(self.path, "keys.jsonl")
+
+  def __fields_path(self):
+    return os.path.join(self.path, "fields.json")
+
+  def __column_path(self, name: str):
+    return os.path.join(self.path, "columns", f"{name}.bin")
+
+
+"""
+Gets the names of the items of the result tuples of run_pipeline with the given options.
+"""
+def get_result_fields(only_process: bool = False, affine: bool = False, track: bool = False, plate: bool = False):
+  if only_process:
+    return ["microscope", "biosensor"]
+  return ["microscope", "biosensor", "translation"] + ["affine"] * affine + ["tracking"] * track + ["plate"] * plate
+
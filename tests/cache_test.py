@@ -0,0 +1,62 @@
+import os
+import tempfile
+import numpy as np
+import unittest
+
+from preprocessing.cache import ProcessingCache
+
+
+class CacheTest(unittest.TestCase):
+  def test_save_load(self):
+    # Arrange
+    cache = ProcessingCache(tempfile.mkdtemp())
+    raw_data = np.arange(10)
+    arrays = (np.ones((4, 4)), np.array([[1.5, 2.5]]))
+
+    # Act
+    key = cache.key("biosensor", raw_data, {"threshold": 75})
+    missing = cache.load(key)
+    cache.save(key, arrays)
+    result = cache.load(key)
+
+    # Assert
+    self.assertIsNone(missing)
+    self.assertNotEqual(key, cache.key("biosensor", raw_data, {"threshold": 50}))
+    self.assertEqual(len(result), 2)
+    self.assertTrue(np.array_equal(result[0], arrays[0]))
+    self.assertTrue(np.array_equal(result[1], arrays[1]))
+
+  def test_evict(self):
+    # Arrange
+    path = tempfile.mkdtemp()
+    cache = ProcessingCache(path, max_bytes=2000)
+
+    # Act
+    keys = [cache.key("microscope", np.arange(i), "model") for i in range(4)]
+    for i, key in enumerate(keys):
+      cache.save(key, (np.zeros(100),))
+      os.utime(os.path.join(path, key), (i, i))
+    cache.evict()
+
+    # Assert
+    self.assertIsNone(cache.load(keys[0]))
+    self.assertIsNone(cache.load(keys[1]))
+    self.assertIsNotNone(cache.load(keys[3]))
+
+  def test_interrupted_save(self):
+    # Arrange
+    path = tempfile.mkdtemp()
+    old_path, recent_path = os.path.join(path, ".tmp-old"), os.path.join(path, ".tmp-recent")
+    os.makedirs(old_path)
+    os.makedirs(recent_path)
+    os.utime(old_path, (0, 0))
+
+    # Act
+    cache = ProcessingCache(path)
+    key = cache.key("biosensor_wells", None, {"files": [["well.bin", 10, 0]]})
+
+    # Assert
+    self.assertFalse(os.path.exists(old_path))
+    self.assertTrue(os.path.exists(recent_path))
+    self.assertNotEqual(key, cache.key("biosensor_wells", None, {"files": [["well.bin", 10, 1]]}))
+    self.assertIsNone(cache.paths(key))
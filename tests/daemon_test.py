@@ -0,0 +1,73 @@
+import os
+import time
+import pickle
+import socket
+import tempfile
+import threading
+import click
+import numpy as np
+import unittest
+from unittest import mock
+
+from cli import client
+from cli.client import send_request
+from cli.daemon import serve
+
+
+class DaemonTest(unittest.TestCase):
+  def test_requests(self):
+    # Arrange
+    socket_path = os.path.join(tempfile.mkdtemp(), "daemon.sock")
+    thread = threading.Thread(target=serve, args=(socket_path,), kwargs={"warm_modules": [], "request_timeout": 0.5})
+    thread.start()
+    while not os.path.exists(socket_path):
+      time.sleep(0.01)
+
+    data_path = os.path.join(os.path.dirname(socket_path), "data.pkl")
+    np.random.seed(0)
+    mic_coords = np.random.rand(30, 2) * 50
+    with open(data_path, "wb") as file:
+      pickle.dump({"A1": ((np.zeros((8, 8)), mic_coords), (np.zeros((4, 4)), mic_coords[:20] + np.array([3, 2]), None))}, file)
+
+    # Act
+    # A silent client times out instead of blocking the daemon.
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as silent_connection:
+      silent_connection.connect(socket_path)
+      ping_response = send_request({"command": "ping"}, socket_path, timeout=5)
+    unknown_response = send_request({"command": "unknown"}, socket_path)
+    align_response = send_request({"command": "align", "options": {"is_processed": True}}, socket_path)
+    processed_align_response = send_request({"command": "align", "path": data_path, "mode": ["voting", 1], "options": {"is_processed": True}}, socket_path)
+    shutdown_response = send_request({"command": "shutdown"}, socket_path)
+    thread.join(10)
+
+    # Assert
+    self.assertEqual(ping_response["status"], "ok")
+    self.assertEqual(ping_response["jobs"], 0)
+    self.assertEqual(unknown_response["status"], "error")
+    self.assertEqual(align_response["status"], "error")
+    self.assertIn("KeyError", align_response["error"])
+    self.assertEqual(processed_align_response["status"], "ok")
+    self.assertTrue(np.allclose(processed_align_response["translations"]["A1"], [-3, -2], atol=0.1))
+    self.assertEqual(shutdown_response["status"], "ok")
+    self.assertFalse(thread.is_alive())
+    self.assertFalse(os.path.exists(socket_path))
+
+
+  def test_is_running(self):
+    # Arrange
+    socket_path = os.path.join(tempfile.mkdtemp(), "daemon.sock")
+    is_running = getattr(client, "__is_running")
+
+    # Act
+    stopped = is_running(socket_path)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as busy_daemon:
+      busy_daemon.bind(socket_path)
+      busy_daemon.listen()
+      busy = is_running(socket_path)
+
+    # Assert
+    self.assertFalse(stopped)
+    self.assertTrue(busy)
+    with mock.patch.object(client, "send_request", side_effect=ConnectionResetError()):
+      with self.assertRaises(click.ClickException):
+        is_running(socket_path)
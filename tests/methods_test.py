@@ -1,7 +1,8 @@
 import numpy as np
 import unittest
 
-from alignment import find_translation_pmc, find_translation_stochastic
+from alignment import find_translation_pmc, find_translation_stochastic, find_translation_voting, find_translation_fft, make_pairing, refine_translation, get_affine_transformation, refine_affine, get_translation_support, estimate_translation_prior, track_translation, \
+  concatenate_point_sets, find_translation_batch, find_translation_voting_batch, refine_translation_batch
 
 
 class MethodsTest(unittest.TestCase):
@@ -27,4 +28,272 @@ class MethodsTest(unittest.TestCase):
     result = find_translation_pmc(cardio_coords, mic_coords, 1)
 
     # Assert
-    self.assertTrue(np.allclose(-result[0], translation, 0.2))
\ No newline at end of file
+    self.assertTrue(np.allclose(-result[0], translation, 0.2))
+
+  def test_find_translation_pmc_engines(self):
+    # Arrange
+    np.random.seed(0)
+    mic_coords = np.random.rand(30, 2) * 20
+    cardio_coords = mic_coords[:20] + np.array([3, 2]) + np.random.normal(0, 0.2, (20, 2))
+
+    # Act
+    np.random.seed(1)
+    numpy_result = find_translation_pmc(cardio_coords, mic_coords, 1, engine="numpy")
+    np.random.seed(1)
+    bitset_result = find_translation_pmc(cardio_coords, mic_coords, 1, engine="bitset")
+
+    # Assert
+    self.assertTrue(np.array_equal(numpy_result[0], bitset_result[0]))
+    self.assertEqual(numpy_result[1], bitset_result[1])
+
+  def test_find_translation_pmc_large_graph(self):
+    # Arrange
+    np.random.seed(0)
+    translation = np.array([30, -20])
+    # 72000 candidates, the nodes of the clique are spread beyond the range of uint16 indices.
+    mic_coords = np.random.rand(300, 2) * 5000
+    cardio_coords = mic_coords[:240] + translation
+
+    # Act
+    result = find_translation_pmc(cardio_coords, mic_coords, 1)
+
+    # Assert
+    self.assertGreater(len(cardio_coords) * len(mic_coords), np.iinfo(np.uint16).max)
+    self.assertTrue(np.allclose(-result[0], translation))
+    self.assertEqual(result[1], 240)
+
+  def test_find_translation_pmc_workers(self):
+    # Arrange
+    np.random.seed(0)
+    mic_coords = np.random.rand(40, 2) * 50
+    cardio_coords = mic_coords[:25] + np.array([3, 2]) + np.random.normal(0, 0.2, (25, 2))
+
+    # Act
+    np.random.seed(1)
+    serial_result = find_translation_pmc(cardio_coords, mic_coords, 1)
+    np.random.seed(1)
+    parallel_result = find_translation_pmc(cardio_coords, mic_coords, 1, workers=2)
+
+    # Assert
+    self.assertTrue(np.array_equal(serial_result[0], parallel_result[0]))
+    self.assertEqual(serial_result[1], parallel_result[1])
+
+  def test_find_translation_pmc_budget(self):
+    # Arrange
+    np.random.seed(0)
+    mic_coords = np.random.rand(60, 2) * 100
+    cardio_coords = mic_coords[:40] + np.array([3, 2]) + np.random.normal(0, 0.2, (40, 2))
+
+    # Act
+    np.random.seed(1)
+    result = find_translation_pmc(cardio_coords, mic_coords, 1, return_info=True)
+    np.random.seed(1)
+    budget_result = find_translation_pmc(cardio_coords, mic_coords, 1, node_budget=1, return_info=True)
+
+    # Assert
+    self.assertTrue(result[2]["optimal"])
+    self.assertEqual(result[2]["upper_bound"], result[1])
+    self.assertTrue(np.allclose(-budget_result[0], [3, 2], atol=0.5))
+    self.assertLessEqual(budget_result[1], result[1])
+    self.assertGreaterEqual(budget_result[2]["upper_bound"], result[1])
+    self.assertEqual(budget_result[2]["optimal"], budget_result[2]["upper_bound"] == budget_result[1])
+    with self.assertRaises(ValueError):
+      find_translation_pmc(cardio_coords, mic_coords, 1, engine="numpy", time_budget=1)
+
+  def test_find_translation_voting(self):
+    # Arrange
+    translation = np.array([3, 2])
+    mic_coords = np.array([[1, 0], [2, 0], [3, 0], [4, 0], [5, 0]])
+    cardio_coords = np.delete(mic_coords, [1, 2], axis=0) + translation
+
+    # Act
+    result = find_translation_voting(cardio_coords, mic_coords, 1)
+
+    # Assert
+    self.assertTrue(np.allclose(-result[0], translation, 0.2))
+    self.assertEqual(result[1], 3)
+
+  def test_find_translation_fft(self):
+    # Arrange
+    np.random.seed(0)
+    translation = np.array([30.4, -20.7])
+    mic_coords = np.random.rand(100, 2) * 500
+    cardio_coords = mic_coords[:80] + translation + np.random.normal(0, 0.3, (80, 2))
+
+    # Act
+    result = find_translation_fft(cardio_coords, mic_coords)
+    window_result = find_translation_fft(cardio_coords, mic_coords, n_levels=1, search_center=[-25, 25], search_radius=10)
+
+    # Assert
+    self.assertTrue(np.allclose(-result[0], translation, atol=0.5))
+    self.assertGreater(result[1], 1.5)
+    self.assertTrue(np.allclose(-window_result[0], translation, atol=0.5))
+
+  def test_search_window(self):
+    # Arrange
+    np.random.seed(0)
+    translation = np.array([3, 2])
+    mic_coords = np.random.rand(40, 2) * 50
+    cardio_coords = mic_coords[:25] + translation + np.random.normal(0, 0.2, (25, 2))
+    search_center = -translation + 1
+
+    # Act
+    pmc_result = find_translation_pmc(cardio_coords, mic_coords, 1, search_center=search_center, search_radius=3)
+    stochastic_result = find_translation_stochastic(cardio_coords, mic_coords, 0.5, search_center=search_center, search_radius=3)
+    voting_result = find_translation_voting(cardio_coords, mic_coords, 1, search_center=search_center, search_radius=3)
+
+    # Assert
+    self.assertTrue(np.allclose(-pmc_result[0], translation, atol=0.5))
+    self.assertEqual(pmc_result[1], 25)
+    self.assertTrue(np.allclose(-stochastic_result[0], translation, atol=0.5))
+    self.assertTrue(np.allclose(-voting_result[0], translation, atol=0.5))
+
+  def test_refine_translation(self):
+    # Arrange
+    np.random.seed(0)
+    translation = np.array([3.4, 2.7])
+    mic_coords = np.random.rand(50, 2) * 200
+    cardio_coords = mic_coords[:40] + translation
+
+    # Act
+    result = refine_translation(cardio_coords, mic_coords, -np.array([6, 0]))
+
+    # Assert
+    self.assertTrue(np.allclose(-result[0], translation, atol=0.01))
+
+  def test_make_pairing(self):
+    # Arrange
+    translation = np.array([3, 2])
+    mic_coords = np.array([[1, 0], [2, 0], [3, 0], [4, 0], [5, 0]])
+    cardio_coords = np.delete(mic_coords, [1, 2], axis=0) + translation
+
+    # Act
+    dense_result = make_pairing(cardio_coords, mic_coords, -translation, 0.5, engine="dense")
+    kdtree_result = make_pairing(cardio_coords, mic_coords, -translation, 0.5, engine="kdtree")
+    optimal_result = make_pairing(cardio_coords, mic_coords, -translation, 0.5, assignment="optimal")
+
+    # Assert
+    self.assertEqual(dense_result, [(0, 0, 0.0), (1, 3, 0.0), (2, 4, 0.0)])
+    self.assertEqual(kdtree_result, dense_result)
+    self.assertEqual(optimal_result, dense_result)
+
+  def test_get_affine_transformation(self):
+    # Arrange
+    affine = np.array([[1.02, 0.01, 0], [-0.01, 0.98, 0], [5, -3, 1]])
+    source_points = np.array([[0, 0], [10, 0], [0, 10], [10, 10], [5, 3]])
+    target_points = source_points @ affine[:2, :2] + affine[2, :2]
+    target_points[4] += 100
+    pairing = [(i, i, 0) for i in range(5)]
+
+    # Act
+    result = get_affine_transformation(source_points, target_points, pairing, weights=np.array([1, 1, 1, 1, 0]))
+    empty_result = get_affine_transformation(source_points, target_points, [])
+
+    # Assert
+    self.assertTrue(np.allclose(result, affine))
+    self.assertTrue(np.array_equal(empty_result, np.diag([0, 0, 1])))
+
+  def test_refine_affine(self):
+    # Arrange
+    np.random.seed(0)
+    affine = np.array([[1.01, 0.02, 0], [-0.02, 1.01, 0], [30, -20, 1]])
+    source_points = np.random.rand(200, 2) * 1000
+    target_points = source_points @ affine[:2, :2] + affine[2, :2] + np.random.normal(0, 0.2, (200, 2))
+    target_points = np.concatenate((target_points[:150], np.random.rand(30, 2) * 1000))
+
+    # Act
+    result, inliers = refine_affine(source_points, target_points, np.array([32, -18]), threshold=15)
+
+    # Assert
+    self.assertTrue(np.allclose(result, affine, atol=0.5))
+    self.assertTrue(np.allclose(result[:2, :2], affine[:2, :2], atol=1e-3))
+    self.assertGreaterEqual(len(inliers), 145)
+    self.assertTrue(all(i == j for i, j, _ in inliers if j < 150))
+
+  def test_plate_prior(self):
+    # Arrange
+    source_points = np.array([[0, 0], [10, 0], [0, 10], [10, 10]])
+    target_points = np.concatenate((source_points[:3] + [5, 5], [[50, 50]]))
+    translations = [np.array([5, 5]), np.array([6, 4]), np.array([5.5, 5]), np.array([-40, 30])]
+
+    # Act
+    support = get_translation_support(source_points, target_points, np.array([5, 5]), 1)
+    prior, deviation = estimate_translation_prior(translations, [0.9, 0.8, 0.7, 0.1], min_support=0.5)
+    missing_prior, _ = estimate_translation_prior(translations, [0.9, 0.1, 0.1, 0.1], min_support=0.5)
+
+    # Assert
+    self.assertEqual(support, 0.75)
+    self.assertTrue(np.allclose(prior, [5.5, 5]))
+    self.assertAlmostEqual(deviation, 0.5)
+    self.assertIsNone(missing_prior)
+
+  def test_memory_limit(self):
+    # Arrange
+    np.random.seed(0)
+    translation = np.array([3, 2])
+    mic_coords = np.random.rand(60, 2) * 100
+    cardio_coords = mic_coords[:40] + translation + np.random.normal(0, 0.2, (40, 2))
+
+    # Act
+    stochastic_result = find_translation_stochastic(cardio_coords, mic_coords, 0.5, memory_limit=2**16)
+    unlimited_stochastic_result = find_translation_stochastic(cardio_coords, mic_coords, 0.5)
+    pmc_result = find_translation_pmc(cardio_coords, mic_coords, 1, memory_limit=2**20)
+    unlimited_pmc_result = find_translation_pmc(cardio_coords, mic_coords, 1)
+    np.random.seed(1)
+    sampled_pmc_result = find_translation_pmc(cardio_coords, mic_coords, 1, correspondence_ratio=0.5, memory_limit=2**30)
+    np.random.seed(1)
+    unlimited_sampled_pmc_result = find_translation_pmc(cardio_coords, mic_coords, 1, correspondence_ratio=0.5)
+    degraded_pmc_result = find_translation_pmc(cardio_coords, mic_coords, 1, memory_limit=2**17)
+    voting_result = find_translation_voting(cardio_coords, mic_coords, 1, memory_limit=2**22)
+
+    # Assert
+    self.assertTrue(np.allclose(stochastic_result[0], unlimited_stochastic_result[0], atol=1e-3))
+    self.assertTrue(np.allclose(pmc_result[0], unlimited_pmc_result[0], atol=1e-3))
+    self.assertEqual(pmc_result[1], unlimited_pmc_result[1])
+    self.assertTrue(np.allclose(sampled_pmc_result[0], unlimited_sampled_pmc_result[0], atol=1e-3))
+    self.assertEqual(sampled_pmc_result[1], unlimited_sampled_pmc_result[1])
+    self.assertTrue(np.allclose(-degraded_pmc_result[0], translation, atol=0.5))
+    self.assertTrue(np.allclose(-voting_result[0], translation, atol=0.5))
+    with self.assertRaises(MemoryError):
+      find_translation_pmc(cardio_coords, mic_coords, 1, memory_limit=2**10)
+
+  def test_track_translation(self):
+    # Arrange
+    np.random.seed(0)
+    mic_coords = np.random.rand(80, 2) * 100
+    drifts = np.array([[3, 2], [3.5, 2.2], [4, 2.5], [4.4, 3]])
+    cardio_series = [mic_coords[np.random.choice(80, 50, replace=False)] + drift + np.random.normal(0, 0.1, (50, 2)) for drift in drifts]
+    cardio_series.insert(2, np.zeros((0, 2)))
+
+    # Act
+    translations, errors = track_translation(mic_coords, cardio_series, np.array([3, 2]), radius=2)
+
+    # Assert
+    self.assertTrue(np.allclose(translations[[0, 1, 3, 4]], drifts, atol=0.1))
+    self.assertTrue(np.allclose(translations[2], translations[1]))
+    self.assertTrue(np.isnan(errors[2]))
+
+  def test_batch(self):
+    # Arrange
+    np.random.seed(0)
+    translations = np.array([[3, 2], [-4, 1], [0, 0], [5, -5]])
+    mic_sets = [np.random.rand(30, 2) * 50 for _ in translations] + [np.zeros((0, 2))]
+    cardio_sets = [mic_coords[:20] + translation + np.random.normal(0, 0.2, (20, 2)) for mic_coords, translation in zip(mic_sets, translations)] + [np.ones((3, 2))]
+    cardio_coords, cardio_offsets = concatenate_point_sets(cardio_sets)
+    mic_coords, mic_offsets = concatenate_point_sets(mic_sets)
+
+    # Act
+    voting_result = find_translation_voting_batch(cardio_coords, cardio_offsets, mic_coords, mic_offsets, 5, block_size=1000)
+    refine_result = refine_translation_batch(cardio_coords, cardio_offsets, mic_coords, mic_offsets, voting_result[0])
+    pmc_result = find_translation_batch(cardio_coords, cardio_offsets, mic_coords, mic_offsets, ("pmc", 1), refine={})
+
+    # Assert
+    for i in range(len(translations)):
+      single_voting_result = find_translation_voting(cardio_sets[i], mic_sets[i], 5)
+      single_refine_result = refine_translation(cardio_sets[i], mic_sets[i], single_voting_result[0])
+      self.assertTrue(np.allclose(voting_result[0][i], single_voting_result[0]))
+      self.assertEqual(voting_result[1][i], single_voting_result[1])
+      self.assertTrue(np.allclose(refine_result[0][i], single_refine_result[0]))
+      self.assertTrue(np.allclose(-pmc_result[i], translations[i], atol=0.2))
+    self.assertTrue(np.array_equal(voting_result[0][-1], [0, 0]))
+    self.assertEqual(voting_result[1][-1], 0)
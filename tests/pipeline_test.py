@@ -0,0 +1,76 @@
+import numpy as np
+import unittest
+from unittest import mock
+
+import preprocessing.process
+from pipeline import run_pipeline
+from utils import calculate_microscope_cell_centroids
+
+
+# Segmentation model returning the given masks.
+class MaskModel:
+  def __init__(self, masks: list):
+    self.masks = masks
+
+  def eval(self, images, channels):
+    return self.masks[:len(images)], None, None
+
+
+class PipelineTest(unittest.TestCase):
+  def test_workers(self):
+    # Arrange
+    np.random.seed(0)
+    data = {}
+    for key in ("A1", "A2", "A3", "B1", "B2"):
+      mic_coords = np.random.rand(30, 2) * 50
+      data[key] = ((np.zeros((8, 8)), mic_coords), (np.zeros((4, 4)), mic_coords[:20] + np.array([3, 2]) + np.random.normal(0, 0.2, (20, 2)), None))
+
+    for mode in (("stochastic", 1), ("pmc", 1)):
+      # Act
+      np.random.seed(1)
+      serial_result = run_pipeline(data, mode, is_processed=True)
+      serial_state = np.random.get_state()
+      np.random.seed(1)
+      parallel_result = run_pipeline(data, mode, is_processed=True, workers=3)
+
+      # Assert
+      # The random state of the caller only advanced by drawing the seeds of the wells.
+      np.random.seed(1)
+      np.random.randint(0, 2**32, size=len(data), dtype=np.int64)
+      self.assertTrue(np.array_equal(serial_state[1], np.random.get_state()[1]))
+      self.assertEqual(list(serial_result.keys()), list(parallel_result.keys()))
+      for key in data:
+        self.assertTrue(np.array_equal(serial_result[key][2], parallel_result[key][2]))
+
+  def test_track(self):
+    # Arrange
+    np.random.seed(0)
+    translation, drift = np.array([3, 2]), np.array([0.1, 0])
+    mask = np.zeros((200, 200), dtype=np.int32)
+    for i, (x, y) in enumerate(np.random.randint(10, 190, (25, 2))):
+      mask[y - 1:y + 2, x - 1:x + 2] = i + 1
+    mic_coords = calculate_microscope_cell_centroids(mask)
+
+    # The frames hold their index, the localized points drift with the mean frame of the window.
+    well_data = np.repeat(np.arange(40, dtype=np.float64), 16).reshape(40, 4, 4)
+    epic_params = {"preprocessing_params": {"range_lowerbound": 0}}
+    corrections = []
+    def correct(well_data, params, profiler):
+      corrections.append(len(well_data))
+      return well_data
+    stages = {
+      "__correct_biosensor_data": correct,
+      "__magnify_biosensor_data": lambda well_data, params, profiler: well_data,
+      "__find_biosensor_cells": lambda well_data, params, profiler: mic_coords[:20] + translation + drift * well_data.mean(),
+      "__scale_biosensor_data": lambda well_data, ptss, params, profiler: (np.max(well_data, axis=0), ptss)
+    }
+
+    # Act
+    with mock.patch.dict(preprocessing.process.__dict__, stages):
+      result = run_pipeline({"A1": (np.zeros((200, 200)), well_data)}, ("voting", 1), epic_params=epic_params, track={"window_size": 10, "radius": 5},
+                            cellpose_model=MaskModel([mask]))
+
+    # Assert
+    self.assertEqual(corrections, [40])
+    self.assertTrue(np.allclose(result["A1"][2], -(translation + drift * 19.5), atol=0.1))
+    self.assertTrue(np.allclose(result["A1"][3], [-(translation + drift * (start + 4.5)) for start in range(0, 40, 10)], atol=1e-3))
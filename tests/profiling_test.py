@@ -0,0 +1,70 @@
+import os
+import json
+import tempfile
+import tracemalloc
+import numpy as np
+import unittest
+
+from profiling import Profiler
+from alignment import find_translation_pmc
+
+
+class ProfilingTest(unittest.TestCase):
+  def test_report(self):
+    # Arrange
+    profiler = Profiler(memory=True)
+
+    # Act
+    with profiler.stage("read"):
+      pass
+    for key in ["A1", "A2"]:
+      with profiler.well(key), profiler.stage("well"):
+        with profiler.stage("alignment"):
+          array = np.ones(2**20)
+          del array
+        profiler.count("candidates", 10)
+    report = profiler.report()
+
+    # Assert
+    self.assertEqual(list(report["wells"].keys()), [None, "A1", "A2"])
+    self.assertEqual(report["wells"]["A1"]["counters"], {"candidates": 10})
+    self.assertEqual(report["total"]["counters"], {"candidates": 20})
+    self.assertEqual(report["total"]["stages"]["alignment"]["calls"], 2)
+    self.assertGreaterEqual(report["wells"]["A1"]["stages"]["alignment"]["peak_memory"], 8 * 2**20)
+    self.assertGreaterEqual(report["wells"]["A1"]["stages"]["well"]["peak_memory"], 8 * 2**20)
+    self.assertGreaterEqual(report["wells"]["A1"]["stages"]["well"]["wall_time"], report["wells"]["A1"]["stages"]["alignment"]["wall_time"])
+    self.assertFalse(tracemalloc.is_tracing())
+
+  def test_merge_and_trace(self):
+    # Arrange
+    profiler = Profiler()
+    worker_profiler = profiler.fork()
+    path = os.path.join(tempfile.mkdtemp(), "trace.json")
+
+    # Act
+    with worker_profiler.well("A1"), worker_profiler.stage("well"):
+      worker_profiler.count("candidates", 5)
+    profiler.merge(worker_profiler)
+    profiler.save_chrome_trace(path)
+    with open(path, "r") as file:
+      events = json.load(file)["traceEvents"]
+
+    # Assert
+    self.assertEqual(len(events), 1)
+    self.assertEqual(events[0]["name"], "well")
+    self.assertEqual(events[0]["args"]["candidates"], 5)
+
+  def test_pmc_counters(self):
+    # Arrange
+    source_points = np.array([[0, 0], [10, 0], [0, 10], [25, 25]])
+    target_points = source_points[:3] + [5, 5]
+    profiler = Profiler()
+
+    # Act
+    translation, _ = find_translation_pmc(source_points, target_points, 1, profiler=profiler)
+    counters = profiler.report()["total"]["counters"]
+
+    # Assert
+    self.assertTrue(np.allclose(translation, [5, 5]))
+    self.assertEqual(counters["pmc.graph_nodes"], 12)
+    self.assertGreater(counters["pmc.nodes_expanded"], 0)
@@ -0,0 +1,75 @@
+import os
+import cv2
+import sys
+import types
+import tempfile
+import numpy as np
+import unittest
+from unittest import mock
+
+from preprocessing import NanoReader, ImageMapping, WellMapping, ProcessingCache
+
+
+class ReaderTest(unittest.TestCase):
+  def test_image_mapping(self):
+    # Arrange
+    path = tempfile.mkdtemp()
+    os.makedirs(os.path.join(path, "img_data"))
+    images = {key: np.full((8, 8), i * 50, dtype=np.uint8) for i, key in enumerate(("A1", "A2", "B1", "B2"))}
+    for key, image in images.items():
+      cv2.imwrite(os.path.join(path, "img_data", f"{key}.jpeg"), image)
+
+    # Act
+    mapping = NanoReader(path, [False, False], lazy=True, workers=2, prefetch=1).read_microscope_data()
+    items = list(mapping.iter_items(["B2", "A1", "B1"]))
+
+    # Assert
+    self.assertIsInstance(mapping, ImageMapping)
+    self.assertEqual(sorted(mapping.keys()), sorted(images.keys()))
+    self.assertTrue(np.allclose(mapping["A2"], images["A2"], atol=2))
+    self.assertEqual([key for key, _ in items], ["B2", "A1", "B1"])
+    self.assertTrue(all(np.allclose(image, images[key], atol=2) for key, image in items))
+
+  def test_well_mapping(self):
+    # Arrange
+    path = tempfile.mkdtemp()
+    wells = {"A1": np.random.rand(5, 4, 4), "A2": np.random.rand(5, 4, 4)}
+    for key, well in wells.items():
+      np.save(os.path.join(path, f"{key}.npy"), well)
+
+    # Act
+    mapping = WellMapping({key: os.path.join(path, f"{key}.npy") for key in wells})
+
+    # Assert
+    self.assertEqual(list(mapping), ["A1", "A2"])
+    self.assertEqual(len(mapping), 2)
+    self.assertIsInstance(mapping["A1"], np.memmap)
+    self.assertTrue(np.array_equal(mapping["A2"], wells["A2"]))
+
+  def test_well_mapping_eviction(self):
+    # Arrange
+    path = tempfile.mkdtemp()
+    os.makedirs(os.path.join(path, "epic_data"))
+    with open(os.path.join(path, "epic_data", "wells.bin"), "wb") as file:
+      file.write(b"raw")
+    wells = {key: np.random.rand(50, 64, 64) for key in ("A1", "A2", "A3")}
+    processing = types.ModuleType("nanobio_core.epic_cardio.processing")
+    processing.load_data = lambda folder_path, flip: (wells, None, None)
+    modules = {"nanobio_core": types.ModuleType("nanobio_core"), "nanobio_core.epic_cardio": types.ModuleType("nanobio_core.epic_cardio"),
+               "nanobio_core.epic_cardio.processing": processing}
+    cache = ProcessingCache(os.path.join(path, "cache"), max_bytes=6 * 2**20)
+
+    # Act
+    with mock.patch.dict(sys.modules, modules):
+      mapping = NanoReader(path, [False, False], lazy=True, cache=cache).read_biosensor_data()
+      cache.save("processed", (np.zeros(2 * 10**5),))
+      pinned_well = np.array(mapping["A2"])
+      mapping.close()
+      os.utime(os.path.dirname(mapping.paths["A2"]), (0, 0))
+      cache.save("other_processed", (np.zeros(2 * 10**5),))
+
+    # Assert
+    self.assertIsInstance(mapping, WellMapping)
+    self.assertTrue(np.array_equal(pinned_well, wells["A2"]))
+    self.assertFalse(any(name.startswith(".pin-") for entry in os.listdir(cache.path) for name in os.listdir(os.path.join(cache.path, entry))))
+    self.assertFalse(os.path.exists(os.path.dirname(mapping.paths["A2"])))
@@ -0,0 +1,81 @@
+import os
+import tempfile
+import numpy as np
+import unittest
+
+from pipeline import run_pipeline
+from results import ResultStore
+
+
+class ResultsTest(unittest.TestCase):
+  def test_store(self):
+    # Arrange
+    np.random.seed(0)
+    path = tempfile.mkdtemp()
+    translation = np.array([3, 2])
+    data = {}
+    for key in ("A1", "A2", "B1"):
+      mic_coords = np.random.rand(30, 2) * 50
+      data[key] = ((np.zeros((8, 8)), mic_coords), (np.ones((4, 4)), mic_coords[:20] + translation, None))
+
+    # Act
+    result = run_pipeline(data, ("voting", 1), is_processed=True, plate={"n_reference": 2}, store=path)
+    reopened_store = ResultStore(path)
+    table = reopened_store.table()
+
+    # Assert
+    self.assertEqual(sorted(result.keys()), ["A1", "A2", "B1"])
+    self.assertEqual(len(reopened_store), 3)
+    self.assertTrue(np.allclose(np.column_stack((table["translation_x"], table["translation_y"])), -translation))
+    self.assertTrue(np.array_equal(table["n_biosensor_points"], [20, 20, 20]))
+    self.assertTrue(np.all(table["wall_time"] > 0))
+    self.assertTrue(np.array_equal(reopened_store["A2"][0][1], data["A2"][0][1]))
+    self.assertIsNone(reopened_store["A2"][1][2])
+    self.assertTrue(np.allclose(reopened_store["A2"][2], -translation))
+    self.assertIn("support", reopened_store["A2"][3])
+
+  def test_interrupted_append(self):
+    # Arrange
+    path = tempfile.mkdtemp()
+    store = ResultStore(path)
+    well = ((np.zeros((2, 2)), np.zeros((3, 2))), (np.zeros((2, 2)), np.zeros((5, 2)), np.zeros((2, 2))), np.array([1.0, 2.0]))
+    store.append("A1", well, ["microscope", "biosensor", "translation"])
+
+    # Act
+    with open(os.path.join(path, "columns", "translation_x.bin"), "ab") as file:
+      file.write(np.array([5.0]).tobytes())
+    reopened_store = ResultStore(path)
+    reopened_store.append("A2", well, ["microscope", "biosensor", "translation"])
+
+    # Assert
+    self.assertEqual(list(reopened_store.keys()), ["A1", "A2"])
+    self.assertTrue(np.array_equal(reopened_store.column("translation_x"), [1.0, 1.0]))
+    self.assertEqual(os.path.getsize(os.path.join(path, "columns", "translation_x.bin")), 16)
+
+  def test_replaced_well(self):
+    # Arrange
+    np.random.seed(0)
+    path = tempfile.mkdtemp()
+    data = {}
+    for key in ("A1", "A2"):
+      mic_coords = np.random.rand(30, 2) * 50
+      data[key] = ((np.zeros((8, 8)), mic_coords), (np.ones((4, 4)), mic_coords[:20] + np.array([3, 2]), None))
+
+    # Act
+    run_pipeline(data, ("voting", 1), is_processed=True, store=path)
+    data["A1"] = (data["A1"][0], (data["A1"][1][0], data["A1"][1][1][:10] + np.array([1, 1]), None))
+    result = run_pipeline({"A1": data["A1"]}, ("voting", 1), is_processed=True, store=path)
+    store = ResultStore(path)
+    table = store.table()
+
+    # Assert
+    self.assertEqual(list(result.keys()), ["A1"])
+    self.assertEqual(result.table()["key"], ["A1"])
+    self.assertEqual(len(result["A1"][1][1]), 10)
+    self.assertEqual(table["key"], ["A1", "A2"])
+    self.assertTrue(np.array_equal(table["n_biosensor_points"], [10, 20]))
+    self.assertTrue(np.allclose(store.column("translation_x"), [-4, -3], atol=0.1))
+    self.assertEqual(sorted(os.listdir(os.path.join(path, "wells"))), ["1", "2"])
+    with self.assertRaises(ValueError):
+      run_pipeline({"A2": data["A2"]}, ("voting", 1), is_processed=True, affine={}, store=path)
+    self.assertEqual(len(ResultStore(path)), 2)
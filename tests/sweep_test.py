@@ -0,0 +1,125 @@
+import sys
+import types
+import numpy as np
+import unittest
+from unittest import mock
+
+from preprocessing import StageGraph, sweep_biosensor_params, process_biosensor_data
+
+
+# Test stages, the points are shifted by the offset and the ones within the radius from the origin are kept.
+def shift_points(points, params, profiler):
+  return points + params["preprocessing_params"]["offset"]
+
+def filter_points(points, params, profiler):
+  return points[np.linalg.norm(points, axis=1) <= params["localization_params"]["radius"]]
+
+def join_result(points, params, profiler):
+  return (None, points, None)
+
+STAGES = [
+  {"name": "shift", "inputs": ["data"], "params": ["preprocessing_params.offset"], "function": shift_points},
+  {"name": "filter", "inputs": ["shift"], "params": ["localization_params"], "function": filter_points},
+  {"name": "result", "inputs": ["filter"], "params": [], "function": join_result}
+]
+
+
+# Stubs of the nanobio_core and nanopyx modules used by the biosensor stages.
+def get_stub_modules():
+  modules = {name: types.ModuleType(name) for name in ("nanopyx", "nanopyx.methods", "nanobio_core", "nanobio_core.epic_cardio", "nanobio_core.epic_cardio.data_correction",
+                                                        "nanobio_core.epic_cardio.math_ops", "nanobio_core.image_fitting", "nanobio_core.image_fitting.cardio_mic")}
+  modules["nanobio_core.epic_cardio.data_correction"].correct_well = lambda well_data, coords, threshold, mode: (well_data - well_data[0] + threshold, None, None)
+  modules["nanopyx.methods"].SRRF = lambda well_data, magnification, ring_radius: [np.kron(well_data, np.ones((1, magnification, magnification)))]
+  modules["nanobio_core.epic_cardio.math_ops"].calculate_cell_maximas = lambda well_data, min_threshold, max_threshold, neighborhood_size, error_mask: \
+    np.argwhere((well_data.max(axis=0) >= min_threshold) & (well_data.max(axis=0) <= max_threshold))[:, ::-1] * neighborhood_size
+  cardio_mic = modules["nanobio_core.image_fitting.cardio_mic"]
+  cardio_mic.CardioMicScaling = types.SimpleNamespace(MIC_5X=5)
+  cardio_mic.CardioMicFitter = types.SimpleNamespace(_get_scale=lambda scaling: (16 * scaling, None))
+  return modules
+
+
+class SweepTest(unittest.TestCase):
+  def test_stage_graph(self):
+    # Arrange
+    points = np.random.rand(20, 2) * 10
+    graph = StageGraph(STAGES)
+    params = {"preprocessing_params": {"offset": 1}, "localization_params": {"radius": 100}}
+
+    # Act
+    _, first_stages = graph.run(points, params)
+    params["localization_params"]["radius"] = 5
+    result, second_stages = graph.run(points, params)
+    params["preprocessing_params"]["offset"] = 2
+    _, third_stages = graph.run(points, params)
+
+    # Assert
+    self.assertEqual(first_stages, ["shift", "filter", "result"])
+    self.assertEqual(second_stages, ["filter", "result"])
+    self.assertEqual(third_stages, ["shift", "filter", "result"])
+    self.assertTrue(np.array_equal(result[1], filter_points(points + 1, params, None)))
+    self.assertEqual(graph.stage_index("localization_params.radius"), 1)
+
+  def test_stage_graph_inputs(self):
+    # Arrange
+    graph = StageGraph(STAGES)
+    params = {"preprocessing_params": {"offset": 1}, "localization_params": {"radius": 100}}
+    points, other_points = np.random.rand(20, 2), np.random.rand(30, 2)
+
+    # Act
+    graph.run(points, params)
+    other_result, other_stages = graph.run(other_points, params)
+    _, copied_stages = graph.run(other_points.copy(), params)
+
+    # Assert
+    self.assertEqual(other_stages, ["shift", "filter", "result"])
+    self.assertTrue(np.array_equal(other_result[1], other_points + 1))
+    self.assertEqual(copied_stages, [])
+
+  def test_sweep_biosensor_params(self):
+    # Arrange
+    np.random.seed(0)
+    points = np.random.rand(40, 2) * 100
+    microscope_points = points + np.array([5, 3])
+    params = {"preprocessing_params": {"offset": 0}, "localization_params": {"radius": 1000}}
+    grid = {"localization_params.radius": [1000, 1e-3], "preprocessing_params.offset": [0, 2]}
+
+    # Act
+    settings = sweep_biosensor_params(points, params, grid, microscope_points, ("voting", 1), stages=STAGES)
+
+    # Assert
+    self.assertEqual([setting["params"]["preprocessing_params.offset"] for setting in settings], [0, 0, 2, 2])
+    self.assertEqual([len(setting["stages"]) for setting in settings], [3, 2, 3, 2])
+    self.assertTrue(np.allclose(settings[0]["translation"], [5, 3]))
+    self.assertTrue(np.allclose(settings[2]["translation"], [3, 1]))
+    self.assertAlmostEqual(settings[0]["support"], 1)
+    self.assertEqual(settings[1]["support"], 0)
+    self.assertIsNone(settings[1]["translation"])
+    self.assertEqual(params["preprocessing_params"]["offset"], 0)
+
+  def test_biosensor_stages(self):
+    # Arrange
+    np.random.seed(0)
+    well_data = np.random.rand(10, 8, 8)
+    params = {
+      "preprocessing_params": {"range_lowerbound": 0.2, "drift_correction": {"threshold": 1, "filter_method": "mean"}, "magnification": 2, "scaling": "MIC_5X"},
+      "localization_params": {"threshold_range": [1.5, 2], "neighbourhood_size": 3}
+    }
+    grid = {"localization_params.threshold_range": [[1.5, 2], [1.2, 1.8]], "preprocessing_params.magnification": [1, 2]}
+
+    # Act
+    with mock.patch.dict(sys.modules, get_stub_modules()):
+      result = process_biosensor_data(well_data, params)
+      graph_result, _ = StageGraph().run(well_data, params)
+      settings = sweep_biosensor_params(well_data, params, grid)
+      setting_results = [process_biosensor_data(well_data, {**params, "preprocessing_params": {**params["preprocessing_params"], "magnification": magnification},
+                                                            "localization_params": {**params["localization_params"], "threshold_range": threshold_range}})
+                         for magnification in grid["preprocessing_params.magnification"] for threshold_range in grid["localization_params.threshold_range"]]
+
+    # Assert
+    self.assertGreater(len(result[1]), 0)
+    for expected, actual in zip(result, graph_result):
+      self.assertTrue(np.array_equal(expected, actual))
+    self.assertEqual([setting["stages"] for setting in settings], [["raw", "drift_correction", "srrf", "localization", "scaling", "result"], ["localization", "scaling", "result"],
+                                                                  ["srrf", "localization", "scaling", "result"], ["localization", "scaling", "result"]])
+    for setting, setting_result in zip(settings, setting_results):
+      self.assertTrue(np.array_equal(setting["points"], setting_result[1]))
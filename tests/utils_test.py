@@ -19,3 +19,33 @@ class UtilsTest(unittest.TestCase):
     # Assert
     self.assertTrue(np.allclose(result, [[0.25, 0.75], [2.5, 0.5], [4.66666, 0.666666]]))
 
+  def test_calculate_microscope_cell_centroids_stats(self):
+    # Arrange
+    segmentation = np.array([
+      [1, 1, 0, 4, 4, 4],
+      [1, 0, 0, 0, 4, 4],
+      [1, 0, 0, 0, 0, 0]
+    ])
+
+    # Act
+    result, areas, bounding_boxes = utils.calculate_microscope_cell_centroids(segmentation, return_stats=True)
+
+    # Assert
+    self.assertTrue(np.allclose(result, [[0.25, 0.75], [4.2, 0.4]]))
+    self.assertTrue(np.array_equal(areas, [4, 5]))
+    self.assertTrue(np.array_equal(bounding_boxes, [[0, 0, 2, 3], [3, 0, 6, 2]]))
+
+  def test_get_microscope_cell_centroids_mask(self):
+    # Arrange
+    segmentation = np.array([
+      [1, 1, 2, 2, 2, 3],
+      [1, 2, 2, 2, 3, 3],
+      [1, 0, 0, 0, 0, 0]
+    ])
+
+    # Act
+    result = utils.get_microscope_cell_centroids_mask(segmentation)
+
+    # Assert
+    self.assertTrue(np.array_equal(np.argwhere(result == 1), [[0, 0], [0, 2], [0, 4]]))
+
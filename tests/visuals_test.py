@@ -0,0 +1,43 @@
+import os
+import tempfile
+import numpy as np
+import unittest
+
+from visuals import render_alignment_results
+
+
+class VisualsTest(unittest.TestCase):
+  def test_render_alignment_results(self):
+    # Arrange
+    path = tempfile.mkdtemp()
+    microscope_img = np.zeros((64, 64))
+    microscope_img[0, 0] = 1
+    well_img = np.random.rand(16, 16)
+    result = {key: ((microscope_img, np.array([[40, 50]])), (well_img, None, None), np.array([10, 20])) for key in ("A1", "A2", "B1")}
+
+    # Act
+    mosaic = render_alignment_results(result, path, size=32, workers=2)
+
+    # Assert
+    self.assertEqual(mosaic.shape, (64, 64, 3))
+    self.assertTrue(all(os.path.exists(os.path.join(path, f"{key}.png")) for key in result))
+    self.assertTrue(os.path.exists(os.path.join(path, "plate.png")))
+    thumbnail = mosaic[:32, 32:]
+    self.assertTrue(np.all(thumbnail[11:17, 6:12].sum(axis=2) > 0))
+    self.assertTrue(np.all(thumbnail[20:, :4] == 0))
+    self.assertTrue(np.array_equal(thumbnail[25, 20], [191, 0, 0]))
+    self.assertTrue(np.all(mosaic[32:, 32:] == 0))
+
+  def test_render_downsampling(self):
+    # Arrange
+    path = tempfile.mkdtemp()
+    well_img = np.full((256, 256), 0.25)
+    well_img[:, :128] = np.arange(128) % 4 == 0
+    result = {"A1": ((np.zeros((256, 256)), np.zeros((0, 2))), (well_img, None, None), np.array([0, 0]))}
+
+    # Act
+    mosaic = render_alignment_results(result, path, size=64, workers=1)
+
+    # Assert
+    # The stripes are averaged to the value of the other half instead of aliasing, the label is above the checked rows.
+    self.assertEqual(len(np.unique(mosaic[24:].reshape(-1, 3), axis=0)), 1)
@@ -4,28 +4,39 @@ import numpy as np
 """
 :param segmentation: microscope image segmentation mask where each cell instance
 is marked with an unique number started from 1. (cell ids are 1, 2, 3...)
+:param return_stats: if true, the areas and bounding boxes of the cells are returned too.
 :return: an array where the ith indexed centroid corresponds to the (i+1)th cell id.
+Missing cell ids are skipped. With return_stats the pixel count of each cell and the
+(x_min, y_min, x_max, y_max) bounding boxes with exclusive maximums are returned as well.
 """
-def calculate_microscope_cell_centroids(segmentation: np.ndarray):
-  # Calculating the number of cells on the image.
-  mx_id = np.max(segmentation)
+def calculate_microscope_cell_centroids(segmentation: np.ndarray, return_stats: bool = False):
+  # Accumulating the pixel counts and coordinate sums of every cell id row by row, so no full-size coordinate arrays are needed.
+  height, width = segmentation.shape
+  n_ids = int(segmentation.max()) + 1 if segmentation.size > 0 else 1
+  x_coords = np.arange(width, dtype=np.float64)
 
-  # For every cell instance we have a centroid.
-  result = []
+  counts, x_sums, y_sums = np.zeros(n_ids, dtype=np.intp), np.zeros(n_ids), np.zeros(n_ids)
+  for y in range(height):
+    row = segmentation[y].astype(np.intp, copy=False)
+    row_counts = np.bincount(row, minlength=n_ids)
+    counts += row_counts
+    y_sums += y * row_counts
+    x_sums += np.bincount(row, weights=x_coords, minlength=n_ids)
 
-  # Calculating cell centroids for each cell id.
-  for id in range(1, mx_id + 1):
-    # Getting x and y indices of the current cell.
-    indices = np.where(segmentation == id)
+  # Background is id 0, cell ids without pixels are skipped.
+  cell_ids = np.flatnonzero(counts[1:]) + 1
+  result = np.column_stack((x_sums[cell_ids] / counts[cell_ids], y_sums[cell_ids] / counts[cell_ids]))
 
-    if len(indices[0]) > 0 and len(indices[1]) > 0:
-      # Getting coords by averaging cell indices.
-      y_mean = np.mean(indices[0])
-      x_mean = np.mean(indices[1])
+  if not return_stats:
+    return result
 
-      result.append(np.array([x_mean, y_mean]))
+  # Bounding boxes of the cells as slices of the mask, the maximums are exclusive.
+  from scipy import ndimage
 
-  return np.array(result)
+  slices = ndimage.find_objects(segmentation)
+  bounding_boxes = np.array([(slices[i - 1][1].start, slices[i - 1][0].start, slices[i - 1][1].stop, slices[i - 1][0].stop) for i in cell_ids], dtype=np.intp).reshape(-1, 4)
+
+  return result, counts[cell_ids], bounding_boxes
 
 
 """
@@ -34,10 +45,7 @@ is marked with an unique number started from 1. (cell ids are 1, 2, 3...)
 :return: an identical mask where each centroid pixel is marked with 1.
 """
 def get_microscope_cell_centroids_mask(segmentation: np.ndarray):
-  cell_centroids = calculate_microscope_cell_centroids(segmentation)
+  cell_centroids = calculate_microscope_cell_centroids(segmentation).astype(np.intp)
   mask = np.zeros_like(segmentation)
-  for centroid in cell_centroids:
-    x, y = int(centroid[0]), int(centroid[1])
-    mask[y][x] = 1
+  mask[cell_centroids[:, 1], cell_centroids[:, 0]] = 1
   return mask
-
@@ -20,4 +20,96 @@ def show_alignment_result(ax, well_id, result):
   )
 
   ax.set_xlim([0, width1])
-  ax.set_ylim([height1, 0])
\ No newline at end of file
+  ax.set_ylim([height1, 0])
+
+"""
+Renders the alignment overlays of all the wells without matplotlib, the QC images of a whole plate in seconds.
+Every well is downsampled to a thumbnail first, then the translated biosensor image is blended on the microscope image
+and the microscope cell centroids are marked, like in show_alignment_result. The wells are rendered in a thread pool,
+each is saved as {key}.png and all of them as a mosaic.
+
+:param result: the result of run_pipeline, or any mapping of the well keys to the result tuples, like results.ResultStore.
+:param path: directory of the images, created if it doesn't exist.
+:param size: size of the longer side of the thumbnails.
+:param columns: number of thumbnails in a row of the mosaic. Defaults to a square mosaic.
+:param workers: number of threads rendering the wells.
+:param mosaic_name: file name of the mosaic.
+:return: the mosaic as an RGB image.
+"""
+def render_alignment_results(result, path: str, size: int = 256, columns: int = None, workers: int = 4, mosaic_name: str = "plate.png"):
+  import os
+  import cv2
+  import numpy as np
+  from concurrent.futures import ThreadPoolExecutor
+
+  os.makedirs(path, exist_ok=True)
+  keys = list(result.keys())
+  if columns is None:
+    columns = max(1, int(np.ceil(np.sqrt(len(keys)))))
+
+  # Rendering and saving a well, the wells of a result store are loaded by the threads too.
+  def render_well(key):
+    thumbnail = __render_thumbnail(result[key], size)
+    cv2.putText(thumbnail, str(key), (4, 16), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1, cv2.LINE_AA)
+    cv2.imwrite(os.path.join(path, f"{key}.png"), thumbnail)
+    return thumbnail
+
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    thumbnails = list(executor.map(render_well, keys))
+
+  # Placing the thumbnails in a grid, the smaller ones at the top left of their cell.
+  rows = max(1, -(-len(keys) // columns))
+  mosaic = np.zeros((rows * size, columns * size, 3), dtype=np.uint8)
+  for i, thumbnail in enumerate(thumbnails):
+    row, column = divmod(i, columns)
+    mosaic[row * size:row * size + thumbnail.shape[0], column * size:column * size + thumbnail.shape[1]] = thumbnail
+  cv2.imwrite(os.path.join(path, mosaic_name), mosaic)
+
+  return cv2.cvtColor(mosaic, cv2.COLOR_BGR2RGB)
+
+
+# Renders the overlay of a well to a BGR thumbnail, whose longer side is size.
+def __render_thumbnail(well_result: tuple, size: int):
+  import cv2
+  import numpy as np
+
+  microscope_img, microscope_points = well_result[0]
+  well_img = well_result[1][0]
+  translation = well_result[2] if len(well_result) > 2 else None
+
+  # Downsampling before any other operation, so the full resolution image is only read once.
+  height, width = microscope_img.shape[:2]
+  scale = size / max(height, width)
+  thumbnail_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+  microscope_thumbnail = cv2.resize(np.asarray(microscope_img, dtype=np.float32), thumbnail_size, interpolation=cv2.INTER_AREA)
+  if microscope_thumbnail.ndim == 3:
+    microscope_thumbnail = cv2.cvtColor(microscope_thumbnail, cv2.COLOR_RGB2GRAY)
+  thumbnail = cv2.cvtColor(__to_uint8(microscope_thumbnail), cv2.COLOR_GRAY2BGR).astype(np.float32)
+
+  # Blending the biosensor image translated and scaled to the thumbnail, like with the extent of show_alignment_result.
+  if well_img is not None and translation is not None:
+    # The image is downsampled with area averaging first, warpAffine only shifts it by the subpixel translation.
+    well_size = (max(1, round(well_img.shape[1] * scale)), max(1, round(well_img.shape[0] * scale)))
+    well_thumbnail = cv2.resize(np.asarray(well_img, dtype=np.float32), well_size, interpolation=cv2.INTER_AREA)
+    well_thumbnail = cv2.applyColorMap(__to_uint8(well_thumbnail), cv2.COLORMAP_VIRIDIS).astype(np.float32)
+    transformation = np.array([[1, 0, translation[0] * scale], [0, 1, translation[1] * scale]], dtype=np.float32)
+    warped = cv2.warpAffine(well_thumbnail, transformation, thumbnail_size, flags=cv2.INTER_LINEAR)
+    coverage = cv2.warpAffine(np.ones(well_thumbnail.shape[:2], dtype=np.float32), transformation, thumbnail_size, flags=cv2.INTER_LINEAR)
+    alpha = 0.4 * coverage[:, :, np.newaxis]
+    thumbnail = thumbnail * (1 - alpha) + warped * alpha
+
+  # Marking the centroids with red pixels.
+  if microscope_points is not None and len(microscope_points) > 0:
+    points = np.round(np.asarray(microscope_points)[:, :2] * scale).astype(np.intp)
+    points = points[np.all((points >= 0) & (points < thumbnail_size), axis=1)]
+    thumbnail[points[:, 1], points[:, 0]] = thumbnail[points[:, 1], points[:, 0]] * 0.25 + np.array([0, 0, 255]) * 0.75
+
+  return thumbnail.astype(np.uint8)
+
+
+# Converts an image to uint8, stretching the 1st to 99th percentile to the full range.
+def __to_uint8(image):
+  import numpy as np
+
+  low, high = np.percentile(image, (1, 99))
+  return np.clip((image - low) * (255 / max(high - low, 1e-6)), 0, 255).astype(np.uint8)